@@ -0,0 +1,69 @@
+"""Micro-benchmark of the entity path of StreamingOptimizedNLP.
+
+    Compares the single pass entity index (StreamingOptimizedNLP._index_entities)
+    with the previous lookup, which rescanned doc.ents for every extracted entity.
+    Docs are built from a blank pipeline with synthetic entities, so no model is needed.
+
+    usage: python -m benchmarks.bench_entity_lookup"""
+import math
+import timeit
+
+import spacy
+from spacy.tokens import Doc, Span
+
+from modules.nlp import StreamingOptimizedNLP
+
+SIZES = [100, 200, 400, 800, 1600]
+REPEAT = 5
+
+
+def make_doc(vocab, n_entities: int) -> Doc:
+    """A doc with n_entities one-token entities separated by filler words.
+    Half of the entities repeat an earlier lemma, as it happens in full texts."""
+    words, lemmas = [], []
+    for i in range(n_entities):
+        name = f"gene{i % max(1, n_entities // 2)}"
+        words += [name.upper(), "and"]
+        lemmas += [name, "and"]
+    doc = Doc(vocab, words=words, lemmas=lemmas)
+    doc.ents = [Span(doc, i, i + 1, label="GENE_OR_GENE_PRODUCT") for i in range(0, len(words), 2)]
+    return doc
+
+
+def previous_lookup(doc: Doc):
+    """The lookup replaced by _index_entities, one scan of doc.ents per entity."""
+    extracted = [ent.lemma_.strip().lower() for ent in doc.ents]
+    for text in extracted:
+        for ent in doc.ents:
+            if ent.lemma_.strip().lower() == text:
+                break
+
+
+def slope(sizes: list[int], timings: list[float]) -> float:
+    """Growth exponent of timings against sizes (least squares on log-log), 1 = linear."""
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(timing) for timing in timings]
+    x_mean, y_mean = sum(xs) / len(xs), sum(ys) / len(ys)
+    return (sum((x - x_mean) * (y - y_mean) for x, y in zip(xs, ys))
+            / sum((x - x_mean) ** 2 for x in xs))
+
+
+def main():
+    vocab = spacy.blank("en").vocab
+    indexed, previous = [], []
+
+    print(f"{'entities':>10} {'indexed (ms)':>14} {'previous (ms)':>14} {'us/entity':>10}")
+    for size in SIZES:
+        doc = make_doc(vocab, size)
+        indexed_time = min(timeit.repeat(lambda: StreamingOptimizedNLP._index_entities(doc), number=1, repeat=REPEAT))
+        previous_time = min(timeit.repeat(lambda: previous_lookup(doc), number=1, repeat=REPEAT))
+        indexed.append(indexed_time)
+        previous.append(previous_time)
+        print(f"{size:>10} {indexed_time * 1e3:>14.3f} {previous_time * 1e3:>14.3f} {indexed_time / size * 1e6:>10.2f}")
+
+    print(f"\ngrowth exponent, indexed: {slope(SIZES, indexed):.2f} (1 = linear)")
+    print(f"growth exponent, previous: {slope(SIZES, previous):.2f} (2 = quadratic)")
+
+
+if __name__ == "__main__":
+    main()
@@ -115,8 +115,10 @@ PM_QUERIES = {
 
 
 #UMLS CONFIGURATION
-#we are allowed to do 20req/s, which means that we should wait at least 0.05s/req
-UMLS_API_SLEEP_TIME = 0.06 
+#we are allowed to do 20req/s, the rate limiter spaces the request starts by 1/20s
+UMLS_REQUESTS_PER_SECOND = 20
+#max requests waiting for a response at once (also the connection pool size)
+UMLS_MAX_IN_FLIGHT = 20
 
 
 
@@ -0,0 +1,16 @@
+#the raw annotation outputs are cleaned chunksize rows at a time, memory depends on
+#the number of unique entities and relations, not on the number of raw rows.
+#max_pmids = pmids kept per relation (the first articles supporting it, all of them are counted)
+CLEAN = {"chunksize": 100_000,
+         "max_pmids": 20}
+
+#entities and relations already cleaned, for the incremental clean (python main.py clean --incremental),
+#which only reads the raw rows written since its previous run and writes delta files
+REGISTRY = {"path": "cache/entity_registry.sqlite"}
+
+#neo4j-admin bulk import files (python main.py clean --bulk-export), for first-time builds of the
+#graph: gzipped csv shards of at most shard_rows rows per label and per relation type, a manifest
+#and import.sh with the import command into database (stop it first, it is overwritten)
+BULK_EXPORT = {"dir": "data/neo4j_import",
+               "shard_rows": 1_000_000,
+               "database": "neo4j"}
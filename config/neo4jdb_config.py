@@ -16,6 +16,10 @@ NEO4J_LABELS = ['AMINO_ACID',
                 'SIMPLE_CHEMICAL',
                 'TISSUE']
 
+#label shared by all the entity nodes (on top of their own label), ids are unique across
+#labels (see clean.py), so relations find their endpoints through its id index
+NEO4J_ENTITY_LABEL = 'Entity'
+
 #relations we defined in config/nlp_config
 NEO4J_REL_TYPES = ['PRODUCES',
                    'CONTAINS',
@@ -189,6 +189,10 @@ MATCHER_PATTERNS = {
     ]
 }
 
+#maximum number of tokens a token pattern match can span. Sentences are matched in
+#windows of this size so the {"OP": "*"} wildcards stay bounded on long sentences.
+RELATION_MAX_WINDOW = 30
+
 # -------------------------------
 # ENHANCED DEPENDENCY MATCHER PATTERNS
 # -------------------------------
@@ -820,6 +824,125 @@ GENERIC_ENTITIES = {
 }
 
 
+# -------------------------------
+# CURATED TERMS (MeSH HEADINGS & AUTHOR KEYWORDS)
+# -------------------------------
+#entities already known to the graph, used to resolve MeSH headings and keywords
+#by exact lookup instead of running them through the NER model.
+KNOWN_ENTITIES_PATH = "data/ready_for_neo4j/entities4neo4j.csv"
+
+
+# -------------------------------
+# NORMALIZATION CACHE
+# -------------------------------
+NORMALIZATION_CACHE = {"path": "cache/normalization_cache.sqlite",
+                       #the pickled cache used before, imported once into the sqlite one
+                       "legacy_pickle": "cache/normalization_cache.pkl",
+                       #entities without CUI are looked up again after a week
+                       "negative_ttl": 7 * 24 * 3600}
+
+# -------------------------------
+# ANNOTATION RESULT CACHE
+# -------------------------------
+#entities and relations extracted from each article text, keyed by text, model version and
+#pattern config, an article already annotated with the same ones isn't parsed again
+RESULT_CACHE = {"enabled": True,
+                "path": "cache/annotation_results.sqlite",
+                #remove the rows of other models or patterns when an annotation starts
+                "prune": True}
+
+# -------------------------------
+# PROFILER
+# -------------------------------
+#per stage timings (spaCy components, matchers, normalization wait, writes) and counters
+#of the annotation, written as a JSON report at the end of the run, with a progress
+#line logged every log_every articles (None to never log)
+PROFILER = {"enabled": True,
+            "report_path": "data/annotation_profile.json",
+            "log_every": 1000}
+
+# -------------------------------
+# NORMALIZATION QUEUE
+# -------------------------------
+#new entity texts are normalized in the background, by deduplicated batches of up to
+#batch_size texts, a batch is sent once full or max_wait seconds after its first text
+NORMALIZATION_QUEUE = {"batch_size": 200,
+                       "max_wait": 2.0}
+
+# -------------------------------
+# NORMALIZER BACKEND
+# -------------------------------
+#"umls_api" = UMLS REST API (needs UMLS_API_KEY), "local" = offline LocalUMLSLinker,
+#build its index first: python -m modules.local_linker <MRCONSO.RRF or scispacy kb .jsonl>
+NORMALIZER_BACKEND = "umls_api"
+
+# -------------------------------
+# ANNOTATION OUTPUTS
+# -------------------------------
+#fixed columns of the extracted entities and relations files, in this order
+ENTITY_COLUMNS = ["text", "label", "pmid", "pmcid", "fetching_date",
+                  "cui", "normalized_name", "normalization_source", "url"]
+RELATION_COLUMNS = ["ent1", "relation", "ent2", "pmid", "pmcid", "fetching_date"]
+
+#format = "csv" or "parquet" (needs pyarrow), compression = None, "gzip" or "zstd" (csv needs zstandard),
+#rotate_bytes = size after which a new file is started (name.1.csv, name.2.csv...), None for one file
+OUTPUT = {"format": "csv",
+          "compression": None,
+          "rotate_bytes": None}
+
+# -------------------------------
+# ANNOTATION CHECKPOINTS
+# -------------------------------
+#progress of the annotation (last article done, complete output files) is committed
+#every `every` articles, `python main.py annotate --resume` goes on from there
+CHECKPOINT = {"path": "cache/annotation_checkpoint.json",
+              "every": 200}
+
+# -------------------------------
+# DEDUPLICATION
+# -------------------------------
+#entity and relation keys already written are kept as 64-bit hashes (modules/key_set.py)
+#"exact" = hash table that grows as needed, "bloom" = fixed size, may drop a few new keys
+DEDUP = {"mode": "exact",
+         #initial number of keys for "exact", guaranteed number of keys for "bloom"
+         "capacity": 200_000,
+         #"bloom" only, probability that a new key is taken for a duplicate
+         "error_rate": 1e-4,
+         #directory of the memory-mapped tables, None to keep them in memory
+         "spill_dir": None}
+
+LOCAL_LINKER = {"index_dir": "cache/local_linker",
+                #hits with a cosine similarity below threshold are not trusted
+                "threshold": 0.8,
+                #low confidence hits are looked up with the UMLS API if True, dropped otherwise
+                "api_fallback": False,
+                #nearest aliases retrieved per lookup
+                "k": 10}
+
+# -------------------------------
+# PARSED DOCS CACHE
+# -------------------------------
+#spaCy package of the NER model
+NER_MODEL = "en_ner_bionlp13cg_md"
+#parsed docs (tokens, lemmas, dependencies, entities) saved as DocBin shards of shard_size docs
+#under dir/<model>-<version>.<profile>-<settings hash>/, `python main.py annotate --relations-only`
+#re-runs the patterns over the docs of the configured profile
+DOC_CACHE = {"enabled": False,
+             "dir": "cache/docs",
+             "shard_size": 1000}
+
+# -------------------------------
+# PIPELINE PROFILES
+# -------------------------------
+#components of NER_MODEL actually loaded: exclude = components left out, sentencizer = add the
+#rule based sentencizer (needed without parser). Without parser, dependency patterns never match.
+PIPELINE_PROFILES = {"full": {"exclude": [], "sentencizer": False},
+                     "no_parser": {"exclude": ["parser"], "sentencizer": True}}
+#the assembled pipeline of a profile is saved once under dir, later runs load it from there
+PIPELINE = {"profile": "full",
+            "dir": "cache/pipelines"}
+
+
 
 
 if __name__ == "__main__":
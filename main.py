@@ -3,11 +3,12 @@ import argparse
 import sys
 
 from scripts.extract import extract_pubmed_to_mongo
-from scripts.transform.annotate import annotate_mongo_articles
-from scripts.transform.clean import prepare_data_for_neo4j
+from scripts.transform.annotate import annotate_mongo_articles, extract_relations_from_docs
+from scripts.transform.clean import prepare_data_for_neo4j, prepare_incremental_data_for_neo4j, export_for_neo4j_admin
 from scripts.load import load_to_aura
 
 from config.neo4jdb_config import NEO4J_LABELS, NEO4J_REL_TYPES
+from config.nlp_config import DOC_CACHE
 
 def extract_stage(max_results=1000, extract_abstracts_only=True):
     """Step 1: Extract articles from PubMed to MongoDB."""
@@ -32,12 +33,19 @@ def extract_stage(max_results=1000, extract_abstracts_only=True):
 
 
 
-def annotate_stage(ents_path="data/extracted_entities.csv", rels_path="data/extracted_relations.csv"):
-    """Step 2: Annotate articles (NER, RE, Linking)."""
+def annotate_stage(ents_path="data/extracted_entities.csv", rels_path="data/extracted_relations.csv", resume=False, workers=1,
+                   cache_docs=DOC_CACHE["enabled"], relations_only=False):
+    """Step 2: Annotate articles (NER, RE, Linking), resume = go on after the last checkpoint,
+    workers = number of annotation processes, cache_docs = save the parsed docs,
+    relations_only = only re-run the relation patterns over the saved docs."""
     try:
         logging.info("Starting annotation stage.")
         print("Starting annotation stage...")
-        annotate_mongo_articles(ents_path=ents_path, rels_path=rels_path)
+        if relations_only:
+            extract_relations_from_docs(rels_path=rels_path)
+        else:
+            annotate_mongo_articles(ents_path=ents_path, rels_path=rels_path, resume=resume, workers=workers,
+                                    cache_docs=cache_docs)
         logging.info(f"Annotation stage completed. Entities: {ents_path}, Relations: {rels_path}")
         print("Annotation stage completed.")
         return True
@@ -54,8 +62,10 @@ def annotate_stage(ents_path="data/extracted_entities.csv", rels_path="data/extr
 
 def clean_stage(raw_ents_path="data/extracted_entities.csv", 
                 raw_rels_path="data/extracted_relations.csv", 
-                saving_dir="data/ready_for_neo4j"):
-    """Step 3: Prepare data for Neo4j and return cleaned CSV paths."""
+                saving_dir="data/ready_for_neo4j",
+                bulk_export=False):
+    """Step 3: Prepare data for Neo4j and return cleaned CSV paths, bulk_export = also
+    write the neo4j-admin import files (see BULK_EXPORT)."""
     try:
         logging.info("Starting cleaning stage.")
         print("Starting cleaning stage...")
@@ -64,6 +74,8 @@ def clean_stage(raw_ents_path="data/extracted_entities.csv",
             raw_rels_path=raw_rels_path,
             saving_dir=saving_dir
         )
+        if bulk_export:
+            export_for_neo4j_admin(ents_path, rels_path)
         logging.info(f"Cleaning stage completed. Cleaned files: {ents_path}, {rels_path}")
         print("Cleaning stage completed.")
         return ents_path, rels_path
@@ -78,12 +90,41 @@ def clean_stage(raw_ents_path="data/extracted_entities.csv",
 
 
 
+def incremental_clean_stage(raw_ents_path="data/extracted_entities.csv",
+                            raw_rels_path="data/extracted_relations.csv",
+                            saving_dir="data/ready_for_neo4j"):
+    """Step 3, incremental: clean the raw rows written since the last incremental clean
+    and return the delta files (new entities, changed entities, new relations)."""
+    try:
+        logging.info("Starting incremental cleaning stage.")
+        print("Starting incremental cleaning stage...")
+        delta_paths = prepare_incremental_data_for_neo4j(
+            raw_ents_path=raw_ents_path,
+            raw_rels_path=raw_rels_path,
+            saving_dir=saving_dir
+        )
+        logging.info(f"Incremental cleaning stage completed. Delta files: {', '.join(delta_paths)}")
+        print("Incremental cleaning stage completed.")
+        return delta_paths
+    except KeyboardInterrupt:
+        print("Incremental cleaning stage interrupted manually.")
+        logging.warning("Incremental cleaning stage interrupted manually.")
+        return None, None, None
+    except Exception as e:
+        print(f"Incremental cleaning stage failed: {e}")
+        logging.exception(f"Incremental cleaning stage failed: {e}")
+        return None, None, None
+
+
+
 def load_stage(ents_clean_csv='data/ready_for_neo4j/entities4neo4j.csv',
                rels_clean_csv='data/ready_for_neo4j/relations4neo4j.csv',
                labels=NEO4J_LABELS,
                reltypes=NEO4J_REL_TYPES,
-               load_batch_size=1000):
-    """Step 4: Load entities and relations into Neo4j Aura."""
+               load_batch_size=1000,
+               add_evidence=False):
+    """Step 4: Load entities and relations into Neo4j Aura, add_evidence = add the evidence
+    of the relations to the one in the graph instead of replacing it."""
     try:
         logging.info("Starting loading stage.")
         print("Starting loading stage...")
@@ -92,7 +133,8 @@ def load_stage(ents_clean_csv='data/ready_for_neo4j/entities4neo4j.csv',
             ents_clean_csv=ents_clean_csv,
             reltypes_to_load=reltypes,
             rels_clean_csv=rels_clean_csv,
-            load_batch_size=load_batch_size
+            load_batch_size=load_batch_size,
+            add_evidence=add_evidence
         )
         logging.info("Loading stage completed.")
         print("Loading stage completed.")
@@ -108,6 +150,19 @@ def load_stage(ents_clean_csv='data/ready_for_neo4j/entities4neo4j.csv',
 
 
 
+def incremental_load_stage(new_ents_csv='data/ready_for_neo4j/new_entities4neo4j.csv',
+                           changed_ents_csv='data/ready_for_neo4j/changed_entities4neo4j.csv',
+                           new_rels_csv='data/ready_for_neo4j/new_relations4neo4j.csv',
+                           load_batch_size=1000):
+    """Step 4, incremental: load the delta files of the last incremental clean on top of the graph."""
+    #changed entities are existing nodes, their properties are set again, the delta
+    #relations only carry new evidence, added to the one of the relations in the graph
+    return (load_stage(ents_clean_csv=changed_ents_csv, rels_clean_csv=None, load_batch_size=load_batch_size)
+            and load_stage(ents_clean_csv=new_ents_csv, rels_clean_csv=new_rels_csv, load_batch_size=load_batch_size,
+                           add_evidence=True))
+
+
+
 def run_etl(max_results=1000, extract_abstracts_only=True, load_batch_size=1000):
     """Full ETL pipeline orchestrator."""
     try:
@@ -167,8 +222,15 @@ Examples:
   python main.py                    # Run full ETL pipeline
   python main.py extract            # Run only extraction stage
   python main.py annotate           # Run only annotation stage
+  python main.py annotate --resume  # Resume annotation from its last checkpoint
+  python main.py annotate --workers 4  # Annotate with 4 processes
+  python main.py annotate --cache-docs  # Annotate and save the parsed docs
+  python main.py annotate --relations-only  # Re-run the relation patterns over the saved docs
   python main.py clean              # Run only cleaning stage
   python main.py load               # Run only loading stage
+  python main.py clean --incremental  # Clean only the new raw rows, write delta files
+  python main.py clean --bulk-export  # Clean and write neo4j-admin import files
+  python main.py load --incremental   # Load the delta files of the last incremental clean
         """
     )
     
@@ -200,6 +262,43 @@ Examples:
         help="Extract full text instead of abstracts only"
     )
     
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Annotation only: go on from the last checkpoint instead of starting from scratch"
+    )
+    
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Annotation only: number of annotation processes, each one annotates a partition of the articles (default: 1)"
+    )
+    
+    parser.add_argument(
+        "--cache-docs",
+        action="store_true",
+        help="Annotation only: save the parsed docs (see DOC_CACHE), for --relations-only"
+    )
+    
+    parser.add_argument(
+        "--relations-only",
+        action="store_true",
+        help="Annotation only: re-run the relation patterns over the docs saved by --cache-docs, without NER"
+    )
+    
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Clean and load only: work on the raw rows written since the last incremental clean (see REGISTRY)"
+    )
+    
+    parser.add_argument(
+        "--bulk-export",
+        action="store_true",
+        help="Clean only: also write neo4j-admin import files and the import command (see BULK_EXPORT)"
+    )
+    
     args = parser.parse_args()
     
     success = False
@@ -211,12 +310,21 @@ Examples:
                 extract_abstracts_only=not args.full_text
             )
         elif args.step == "annotate":
-            success = annotate_stage()
+            success = annotate_stage(resume=args.resume, workers=args.workers,
+                                     cache_docs=args.cache_docs or DOC_CACHE["enabled"],
+                                     relations_only=args.relations_only)
+        elif args.step == "clean" and args.incremental:
+            delta_paths = incremental_clean_stage()
+            success = all(delta_paths)
+            if success:
+                print(f"Delta files ready: {', '.join(delta_paths)}")
         elif args.step == "clean":
-            ents_path, rels_path = clean_stage()
+            ents_path, rels_path = clean_stage(bulk_export=args.bulk_export)
             success = bool(ents_path and rels_path)
             if success:
                 print(f"Cleaned files ready: {ents_path}, {rels_path}")
+        elif args.step == "load" and args.incremental:
+            success = incremental_load_stage(load_batch_size=args.batch_size)
         elif args.step == "load":
             success = load_stage(load_batch_size=args.batch_size)
         else:
@@ -0,0 +1,56 @@
+import logging
+import json
+import os
+
+from datetime import datetime, timezone
+from pathlib import Path
+
+from config.nlp_config import CHECKPOINT
+
+"""Progress of an annotation run, saved as a small json file:
+    the key (pmid) of the last article annotated, the number of articles done, the
+    output files with their size and rows at that point (see writers.commit) and the
+    number of workers of the run (a worker's last key only means something for its
+    partition, pmid % workers).
+    Articles are annotated in key order, so a resumed run fetches the articles after
+    the last key, truncates the files back to their committed size and drops
+    whatever was written after them.
+    The file is replaced atomically (written aside, fsynced, then renamed), a crash
+    leaves either the previous checkpoint or the new one, never half of one."""
+
+
+class AnnotationCheckpoint:
+    def __init__(self, path: str = CHECKPOINT["path"]):
+        self.path = Path(path)
+
+    def load(self):
+        """The saved state, None if there is none."""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        logging.info(f"Checkpoint: Loaded, {state['articles']} Articles Done, Last Key {state['last_key']}.")
+        return state
+
+    def save(self, last_key, articles: int, outputs: dict, workers: int = 1):
+        """Parameters:
+            last_key = key of the last article whose rows are all in the outputs.
+            articles = number of articles done since the start of the run.
+            outputs = {"entities": [committed files], "relations": [committed files]},
+                      committed files = {"path", "bytes", "rows"}, see RowWriter.commit.
+            workers = number of workers of the run, the articles are partitioned by it."""
+        state = {"last_key": last_key, "articles": articles, "outputs": outputs, "workers": workers,
+                 "saved_at": datetime.now(timezone.utc).isoformat()}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        logging.info(f"Checkpoint: Saved, {articles} Articles Done, Last Key {last_key}.")
+
+    def clear(self):
+        """Forget the progress, for a run starting from scratch."""
+        self.path.unlink(missing_ok=True)
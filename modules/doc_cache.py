@@ -0,0 +1,138 @@
+import datetime
+import logging
+import hashlib
+import shutil
+import json
+import os
+import re
+
+from pathlib import Path
+from spacy.language import Language
+from spacy.tokens import Doc, DocBin
+from spacy.util import get_package_version
+from spacy.vocab import Vocab
+
+from config.nlp_config import DOC_CACHE, NER_MODEL, PIPELINE, PIPELINE_PROFILES
+
+"""Parsing is by far the most expensive step of the annotation, the relation
+    patterns only need its result. The parsed docs (tokens, lemmas, dependencies,
+    sentences, entities) can be saved as spaCy DocBin shards of shard_size docs,
+    with the metadata of their article (pmid, pmcid...) in their user data:
+        cache/docs/<model>-<version>.<profile>-<settings hash>/<name>.00000.spacy...
+    The docs of a model version are only valid for that version and the pipeline
+    profile that parsed them (docs parsed without parser have no dependencies),
+    hence one directory per version and profile (see docs_key). load_docs reads
+    them back, without the model, so that the patterns can be re-run over the whole
+    corpus without parsing it again."""
+
+#user data key of the article metadata
+METADATA_KEY = "article"
+_SHARD = re.compile(r"(.+)\.(\d+)\.spacy")
+
+
+def model_key(nlp_pipe: Language = None) -> str:
+    """Name of the model that parsed the docs, <package>-<version>: of the given
+    pipeline, of the installed NER model otherwise."""
+    if nlp_pipe is not None:
+        meta = nlp_pipe.meta
+        return f"{meta['lang']}_{meta['name']}-{meta['version']}"
+    return f"{NER_MODEL}-{get_package_version(NER_MODEL)}"
+
+
+def profile_key(profile: str = PIPELINE["profile"]) -> str:
+    """<profile>-<hash of its settings> of a pipeline profile (see PIPELINE_PROFILES),
+    a profile whose settings are edited gets another key."""
+    if profile not in PIPELINE_PROFILES:
+        raise ValueError(f"Unknown pipeline profile: {profile}, expected one of {list(PIPELINE_PROFILES)}.")
+    settings = json.dumps(PIPELINE_PROFILES[profile], sort_keys=True).encode("utf-8")
+    return f"{profile}-{hashlib.blake2b(settings, digest_size=4).hexdigest()}"
+
+
+def docs_key(nlp_pipe: Language = None, profile: str = PIPELINE["profile"]) -> str:
+    """Key of the docs parsed with a profile, <model key>.<profile key>: by the given
+    pipeline, by the installed NER model otherwise."""
+    return f"{model_key(nlp_pipe)}.{profile_key(profile)}"
+
+
+def _shards(directory: Path, name: str = None) -> list[Path]:
+    """Shards of a model directory (of one name only if given), in writing order."""
+    if not directory.is_dir():
+        return []
+    found = []
+    for path in directory.iterdir():
+        match = _SHARD.fullmatch(path.name)
+        if match and (name is None or match.group(1) == name):
+            found.append((match.group(1), int(match.group(2)), path))
+    return [path for _, _, path in sorted(found)]
+
+
+def _plain(value):
+    """Metadata value that can be stored in the user data (msgpack)."""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return str(value)
+
+
+class DocCache:
+    def __init__(self, model: str, name: str = "docs", directory: str = DOC_CACHE["dir"],
+                 shard_size: int = DOC_CACHE["shard_size"]):
+        """Parameters:
+            model = key of the parsing pipeline and its profile, see docs_key.
+            name = prefix of the shards, one per writing process.
+            directory = root of the parsed docs, one sub directory per key.
+            shard_size = number of docs per shard.
+        The shards already written under that name are kept, new ones come after them."""
+        self.directory = Path(directory) / model
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.name = name
+        self.shard_size = shard_size
+        existing = _shards(self.directory, name)
+        self._shard_index = int(_SHARD.fullmatch(existing[-1].name).group(2)) + 1 if existing else 0
+        self._docbin = DocBin(store_user_data=True)
+        self.docs_written = 0
+
+    def add(self, doc: Doc, article_metadata: dict):
+        """Save a parsed doc with the metadata of its article."""
+        doc.user_data[METADATA_KEY] = {key: _plain(value) for key, value in article_metadata.items()}
+        self._docbin.add(doc)
+        if len(self._docbin) >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        """Write the docs added so far to a new shard."""
+        if not len(self._docbin):
+            return
+        path = self.directory / f"{self.name}.{self._shard_index:05d}.spacy"
+        tmp_path = path.with_suffix(".tmp")
+        self._docbin.to_disk(tmp_path)
+        os.replace(tmp_path, path)
+        self.docs_written += len(self._docbin)
+        logging.debug(f"DocCache: Wrote {len(self._docbin)} Docs To {path}.")
+        self._shard_index += 1
+        self._docbin = DocBin(store_user_data=True)
+
+    @staticmethod
+    def clear(model: str, directory: str = DOC_CACHE["dir"]):
+        """Remove all the docs saved for a key (see docs_key)."""
+        shutil.rmtree(Path(directory) / model, ignore_errors=True)
+
+
+def load_docs(model: str, vocab: Vocab, directory: str = DOC_CACHE["dir"]):
+    """Yield (doc, article metadata) for the docs saved for a key (see docs_key), every article once
+    (a resumed annotation may have saved the same article twice)."""
+    shards = _shards(Path(directory) / model)
+    if not shards:
+        raise FileNotFoundError(f"No Parsed Docs For {model} In {directory}.")
+    seen = set()
+    for shard in shards:
+        for doc in DocBin(store_user_data=True).from_disk(shard).get_docs(vocab):
+            metadata = doc.user_data.get(METADATA_KEY, {})
+            key = metadata.get("pmid")
+            if key is not None:
+                if key in seen:
+                    continue
+                seen.add(key)
+            yield doc, metadata
+    logging.info(f"DocCache: Loaded The Docs Of {len(seen)} Articles From {len(shards)} Shards.")
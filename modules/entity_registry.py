@@ -0,0 +1,224 @@
+import sqlite3
+import logging
+import hashlib
+import os
+
+import pandas as pd
+
+from pathlib import Path
+
+from config.clean_config import REGISTRY
+
+"""The entities and relations already cleaned (so already in the graph once loaded)
+    are kept in SQLite, so that a clean run only has to look at the raw rows written
+    since the previous one:
+        entities = stable id, CUI, canonical name (first text seen), label, normalization
+                   properties, first and last run that saw the entity
+        relations = (start id, type, end id) with their evidence count, first and last run
+        evidence = 64-bit hashes of the (start id, type, end id, pmid) already counted, so
+                   that an article counts once for a relation, whatever the runs that read it
+        pending_relations = raw relations with an endpoint that isn't an entity (yet), they
+                  are tried again by the run that registers an entity of that name
+        sources = raw output files, with the number of rows already read and a hash of
+                  their first bytes: a file that doesn't start with the same bytes anymore
+                  was rewritten (fresh annotation run), and is read again from the start
+    A clean run is one transaction: if it fails, the registry is left as it was and the
+    next run produces the same deltas. A full clean replaces the whole registry with what
+    it wrote, an incremental clean following it continues from there."""
+
+#number of values per "IN (...)" query, under the sqlite limit of bound variables
+LOOKUP_BATCH = 500
+#bytes of a raw file hashed to recognize it
+HEAD_BYTES = 65536
+
+ENTITY_PROPERTIES = ["cui", "name", "label", "normalized_name", "normalization_source", "url"]
+PENDING_COLUMNS = ["ent1", "relation", "ent2", "pmid", "pmcid", "fetching_date"]
+
+
+def _head_hash(file: str, size: int) -> str:
+    with open(file, "rb") as f:
+        return hashlib.blake2b(f.read(size), digest_size=16).hexdigest()
+
+
+class EntityRegistry:
+    def __init__(self, path: str = REGISTRY["path"]):
+        """Parameters:
+            path = sqlite file of the registry, created if missing."""
+        self.path = path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS entities (
+                id TEXT PRIMARY KEY,
+                cui TEXT,
+                name TEXT NOT NULL UNIQUE,
+                label TEXT,
+                normalized_name TEXT,
+                normalization_source TEXT,
+                url TEXT,
+                first_seen TEXT NOT NULL,
+                last_seen TEXT NOT NULL
+            )""")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS relations (
+                start_id TEXT NOT NULL,
+                type TEXT NOT NULL,
+                end_id TEXT NOT NULL,
+                evidence_count INTEGER NOT NULL,
+                first_seen TEXT NOT NULL,
+                last_seen TEXT NOT NULL,
+                PRIMARY KEY (start_id, type, end_id)
+            ) WITHOUT ROWID""")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS evidence (key INTEGER PRIMARY KEY)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pending_relations (
+                ent1 TEXT,
+                relation TEXT,
+                ent2 TEXT,
+                pmid TEXT,
+                pmcid TEXT,
+                fetching_date TEXT
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entities_first_seen ON entities (first_seen)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pending_ent1 ON pending_relations (ent1)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pending_ent2 ON pending_relations (ent2)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS sources (
+                file TEXT PRIMARY KEY,
+                rows INTEGER NOT NULL,
+                head_bytes INTEGER NOT NULL,
+                head_hash TEXT NOT NULL
+            )""")
+        logging.info(f"EntityRegistry: Opened {path}.")
+
+    def _select(self, query: str, values) -> list[tuple]:
+        """Rows of query ("... IN ({})") for all the values, LOOKUP_BATCH values at a time."""
+        values = list(dict.fromkeys(values))
+        rows = []
+        for i in range(0, len(values), LOOKUP_BATCH):
+            batch = values[i:i + LOOKUP_BATCH]
+            rows.extend(self._conn.execute(query.format(",".join("?" * len(batch))), batch).fetchall())
+        return rows
+
+    #runs
+    def begin(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+
+    def commit(self):
+        self._conn.execute("COMMIT")
+
+    def rollback(self):
+        if self._conn.in_transaction:
+            self._conn.execute("ROLLBACK")
+
+    def reset(self):
+        """Forget everything registered, before a full clean registers what it wrote."""
+        for table in ("entities", "relations", "evidence", "pending_relations", "sources"):
+            self._conn.execute(f"DELETE FROM {table}")
+
+    #raw files
+    def offset(self, file: str) -> int:
+        """Rows of file already read by a previous run, 0 if it is new or was rewritten."""
+        row = self._conn.execute("SELECT rows, head_bytes, head_hash FROM sources WHERE file = ?", (file,)).fetchone()
+        if row is None:
+            return 0
+        rows, head_bytes, head_hash = row
+        if os.path.getsize(file) < head_bytes or _head_hash(file, head_bytes) != head_hash:
+            logging.warning(f"EntityRegistry: {file} Was Rewritten, Reading It From The Start.")
+            return 0
+        return rows
+
+    def set_offset(self, file: str, rows: int):
+        head_bytes = min(os.path.getsize(file), HEAD_BYTES)
+        self._conn.execute("INSERT OR REPLACE INTO sources (file, rows, head_bytes, head_hash) VALUES (?, ?, ?, ?)",
+                           (file, rows, head_bytes, _head_hash(file, head_bytes)))
+
+    #entities
+    def entities(self, ids) -> pd.DataFrame:
+        """Registered entities among ids, indexed by id."""
+        columns = ["id"] + ENTITY_PROPERTIES + ["first_seen"]
+        rows = self._select(f"SELECT {', '.join(columns)} FROM entities WHERE id IN ({{}})", ids)
+        return pd.DataFrame(rows, columns=columns).set_index("id")
+
+    def ids_by_name(self, names) -> pd.Series:
+        """Ids of the registered entities among names, indexed by name."""
+        rows = self._select("SELECT name, id FROM entities WHERE name IN ({})", names)
+        return pd.Series([entity_id for _, entity_id in rows], index=pd.Index([name for name, _ in rows], dtype=object),
+                         dtype=object)
+
+    def add_entities(self, entities: pd.DataFrame, run: str):
+        """Register entities (id column and ENTITY_PROPERTIES) first seen by run."""
+        rows = entities[["id"] + ENTITY_PROPERTIES].astype(object)
+        rows = rows.where(rows.notna(), None)
+        self._conn.executemany(f"INSERT INTO entities (id, {', '.join(ENTITY_PROPERTIES)}, first_seen, last_seen) "
+                               f"VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                               [(*row, run, run) for row in rows.itertuples(index=False)])
+
+    def update_entities(self, entities: pd.DataFrame, run: str):
+        """Set the normalization properties of registered entities (id column)."""
+        rows = entities[["normalized_name", "normalization_source", "url", "id"]].astype(object)
+        rows = rows.where(rows.notna(), None)
+        self._conn.executemany("UPDATE entities SET normalized_name = ?, normalization_source = ?, url = ?, "
+                               "last_seen = ? WHERE id = ?",
+                               [(*row[:3], run, row[3]) for row in rows.itertuples(index=False)])
+
+    def touch_entities(self, ids, run: str):
+        self._conn.executemany("UPDATE entities SET last_seen = ? WHERE id = ?", [(run, entity_id) for entity_id in ids])
+
+    #relations
+    @staticmethod
+    def _signed(keys) -> list[int]:
+        """uint64 hashes as the signed 64-bit integers sqlite stores."""
+        return [key - (1 << 64) if key >= (1 << 63) else key for key in keys]
+
+    def known_evidence(self, keys: pd.Series) -> pd.Series:
+        """True for the evidence hashes (see key_set.hash_key) already registered."""
+        known = {key for key, in self._select("SELECT key FROM evidence WHERE key IN ({})", self._signed(keys))}
+        return pd.Series([key in known for key in self._signed(keys)], index=keys.index, dtype=bool)
+
+    def add_evidence(self, keys):
+        self._conn.executemany("INSERT OR IGNORE INTO evidence (key) VALUES (?)", [(key,) for key in self._signed(keys)])
+
+    def add_relations(self, relations: pd.DataFrame, run: str):
+        """Add the evidence counts of relations (:START_ID, :TYPE, :END_ID, evidence_count columns)."""
+        self._conn.executemany("""
+            INSERT INTO relations (start_id, type, end_id, evidence_count, first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (start_id, type, end_id) DO UPDATE SET
+                evidence_count = evidence_count + excluded.evidence_count,
+                last_seen = excluded.last_seen""",
+            [(start, reltype, end, int(count), run, run) for start, reltype, end, count
+             in zip(relations[":START_ID"], relations[":TYPE"], relations[":END_ID"], relations["evidence_count"])])
+
+    def add_pending(self, relations: pd.DataFrame):
+        """Keep raw relations (PENDING_COLUMNS, lowercased endpoints) until their entities exist."""
+        #stored as text, dates included
+        rows = relations[PENDING_COLUMNS].astype(str).where(relations[PENDING_COLUMNS].notna(), None)
+        self._conn.executemany(f"INSERT INTO pending_relations ({', '.join(PENDING_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)",
+                               list(rows.itertuples(index=False)))
+
+    def pop_pending(self, run: str) -> pd.DataFrame:
+        """Remove and return the pending relations with an endpoint named like an entity first seen by run."""
+        where = ("WHERE ent1 IN (SELECT name FROM entities WHERE first_seen = ?) "
+                 "OR ent2 IN (SELECT name FROM entities WHERE first_seen = ?)")
+        rows = self._conn.execute(f"SELECT {', '.join(PENDING_COLUMNS)} FROM pending_relations {where}", (run, run)).fetchall()
+        self._conn.execute(f"DELETE FROM pending_relations {where}", (run, run))
+        return pd.DataFrame(rows, columns=PENDING_COLUMNS)
+
+    def stats(self) -> dict:
+        return {"entities": self._conn.execute("SELECT COUNT(*) FROM entities").fetchone()[0],
+                "relations": self._conn.execute("SELECT COUNT(*) FROM relations").fetchone()[0],
+                "pending_relations": self._conn.execute("SELECT COUNT(*) FROM pending_relations").fetchone()[0]}
+
+    def close(self):
+        if self._conn is not None:
+            self.rollback()
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,195 @@
+import numpy as np
+import hashlib
+import logging
+import math
+import os
+import tempfile
+import weakref
+
+from pathlib import Path
+
+from config.nlp_config import DEDUP
+
+"""Entity and relation keys are tuples of strings (text, label, pmid, pmcid...),
+    a python set of them costs a few hundred bytes per key. The sets below only
+    keep a 64-bit hash of each key, in a numpy array:
+        - HashedKeySet: open addressing (linear probing) over a uint64 array, 8 bytes
+          per slot, grows by doubling. Two different keys sharing a 64-bit hash is
+          the only possible error (about n^2 / 2^65, negligible below billions).
+          The array can live in a memory-mapped file instead of memory.
+        - BloomKeySet: fixed size bit array sized for a capacity and an error rate
+          (about 2.4 bytes per key at 1e-4), it never grows, and once full its error
+          rate goes up. A false positive means a key is wrongly seen as a duplicate.
+    Both have the set methods used on the dedup caches: add, in, len. A memory-mapped
+    set made by make_key_set has a file of its own (sets of the same name in several
+    processes never share one), removed when the set is closed or garbage collected."""
+
+
+def hash_key(key) -> int:
+    """64-bit hash of a key (tuple of values or string), stable across processes."""
+    if not isinstance(key, str):
+        key = "\x1f".join(map(str, key))
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _allocate(size: int, dtype, path: str = None):
+    """Zeroed array of size items, memory-mapped to path if given."""
+    if path is None:
+        return np.zeros(size, dtype=dtype)
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(size,))
+
+
+def _remove(path: str):
+    for file in (path, f"{path}.resize"):
+        try:
+            os.remove(file)
+        except FileNotFoundError:
+            pass
+
+
+class HashedKeySet:
+    def __init__(self, capacity: int = DEDUP["capacity"], max_load: float = 0.7, path: str = None,
+                 delete: bool = False):
+        """Parameters:
+            capacity = expected number of keys, the table grows past it.
+            max_load = fraction of used slots that triggers a resize.
+            path = .npy file to memory-map the table to (overwritten), None to keep it in memory.
+            delete = remove the file when the set is closed or garbage collected."""
+        self.max_load = max_load
+        self.path = path
+        self._size = 1 << max(4, math.ceil(math.log2(capacity / max_load)))
+        self._slots = _allocate(self._size, np.uint64, path)
+        self._count = 0
+        self._finalizer = weakref.finalize(self, _remove, path) if path and delete else None
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def nbytes(self) -> int:
+        return self._slots.nbytes
+
+    def _probe(self, slots, size: int, h: int):
+        """Slot of h in slots, or the empty slot where it belongs."""
+        mask = size - 1
+        i = h & mask
+        while True:
+            slot = int(slots[i])
+            if slot == 0 or slot == h:
+                return i, slot
+            i = (i + 1) & mask
+
+    @staticmethod
+    def _hash(key) -> int:
+        #0 marks empty slots
+        return hash_key(key) or 1
+
+    def __contains__(self, key) -> bool:
+        return self._probe(self._slots, self._size, self._hash(key))[1] != 0
+
+    def add(self, key) -> bool:
+        """Add key, return True if it wasn't in the set."""
+        h = self._hash(key)
+        i, slot = self._probe(self._slots, self._size, h)
+        if slot != 0:
+            return False
+        self._slots[i] = h
+        self._count += 1
+        if self._count > self._size * self.max_load:
+            self._grow()
+        return True
+
+    def _grow(self):
+        size = self._size * 2
+        new_path = f"{self.path}.resize" if self.path else None
+        slots = _allocate(size, np.uint64, new_path)
+        for h in self._slots[self._slots != 0]:
+            i, _ = self._probe(slots, size, int(h))
+            slots[i] = h
+        if self.path:
+            slots.flush()
+            del self._slots
+            os.replace(new_path, self.path)
+            slots = np.load(self.path, mmap_mode="r+")
+        self._slots, self._size = slots, size
+        logging.debug(f"KeySet: Resized To {size} Slots.")
+
+    def close(self):
+        """Release the table, and remove its file if delete was set."""
+        self._slots = None
+        if self._finalizer is not None:
+            self._finalizer()
+
+
+class BloomKeySet:
+    def __init__(self, capacity: int = DEDUP["capacity"], error_rate: float = DEDUP["error_rate"],
+                 path: str = None, delete: bool = False):
+        """Parameters:
+            capacity = number of keys the error rate is guaranteed for.
+            error_rate = probability that a new key is seen as a duplicate.
+            path = .npy file to memory-map the bits to (overwritten), None to keep them in memory.
+            delete = remove the file when the set is closed or garbage collected."""
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.path = path
+        bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self._bits = 1 << max(6, math.ceil(math.log2(bits)))
+        self._hashes = max(1, round(self._bits / capacity * math.log(2)))
+        self._array = _allocate(self._bits // 8, np.uint8, path)
+        self._count = 0
+        self._finalizer = weakref.finalize(self, _remove, path) if path and delete else None
+
+    def __len__(self):
+        """Number of keys added as new (false positives are not counted)."""
+        return self._count
+
+    @property
+    def nbytes(self) -> int:
+        return self._array.nbytes
+
+    def _positions(self, key):
+        #k positions from two 32-bit halves of the hash (double hashing)
+        h = hash_key(key)
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        mask = self._bits - 1
+        return [(h1 + i * h2) & mask for i in range(self._hashes)]
+
+    def __contains__(self, key) -> bool:
+        return all(self._array[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+    def add(self, key) -> bool:
+        """Add key, return True if it probably wasn't in the set."""
+        new = False
+        for p in self._positions(key):
+            byte, bit = p >> 3, 1 << (p & 7)
+            if not self._array[byte] & bit:
+                self._array[byte] |= bit
+                new = True
+        if new:
+            self._count += 1
+            if self._count == self.capacity + 1:
+                logging.warning(f"KeySet: Bloom Filter Over Capacity ({self.capacity}), Error Rate Will Grow.")
+        return new
+
+    def close(self):
+        """Release the bits, and remove their file if delete was set."""
+        self._array = None
+        if self._finalizer is not None:
+            self._finalizer()
+
+
+def make_key_set(name: str, mode: str = DEDUP["mode"], spill_dir: str = DEDUP["spill_dir"]):
+    """Dedup set of the configured mode ("exact" or "bloom"), memory-mapped to a
+    spill_dir/<name>-<random>.npy file of its own if spill_dir is set."""
+    if mode not in ("exact", "bloom"):
+        raise ValueError(f"Unknown dedup mode: {mode}, expected 'exact' or 'bloom'.")
+    path = None
+    if spill_dir:
+        #unique per set: forked annotation workers each make their own sets of a name
+        Path(spill_dir).mkdir(parents=True, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix=f"{name}-", suffix=".npy", dir=spill_dir)
+        os.close(fd)
+    if mode == "bloom":
+        return BloomKeySet(path=path, delete=True)
+    return HashedKeySet(path=path, delete=True)
@@ -0,0 +1,232 @@
+import numpy as np
+import nmslib
+import logging
+import pickle
+import json
+import sys
+
+from pathlib import Path
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from modules.umls_api import UMLSNormalizer
+from config.nlp_config import LOCAL_LINKER
+
+"""Offline alternative to the UMLS API: entity texts are linked to the closest
+    concept alias of a local concept file, the same way scispaCy's linker does it.
+    Every alias is embedded as a TF-IDF vector of its character 3-grams and indexed
+    in an nmslib HNSW index (cosine similarity on sparse vectors), a lookup is one
+    approximate nearest neighbours query.
+
+    The index is built once from a UMLS MRCONSO.RRF subset (english rows) or a
+    scispaCy KB .jsonl file, and saved to index_dir. The concept tables (CUIs,
+    names, sources) are saved as flat numpy arrays and memory-mapped on load, so
+    they don't have to fit in memory and are shared by the processes using them
+    (nmslib can't map its index, that one is loaded with its vectors).
+
+    Results have the shape of UMLSNormalizer.normalize, hits below the similarity
+    threshold are sent to the API if a fallback normalizer is given, {} otherwise."""
+
+UMLS_CUI_URL = "https://uts-ws.nlm.nih.gov/rest/content/current/CUI/{cui}"
+
+#same index settings as scispacy's candidate generator
+HNSW_BUILD_PARAMS = {"M": 100, "indexThreadQty": 4, "efConstruction": 2000, "post": 0}
+HNSW_QUERY_PARAMS = {"efSearch": 200}
+
+#MRCONSO.RRF columns used (the file has no header)
+MRCONSO_CUI, MRCONSO_LAT, MRCONSO_TS, MRCONSO_STT, MRCONSO_ISPREF, MRCONSO_SAB, MRCONSO_STR = 0, 1, 2, 4, 6, 11, 14
+
+
+def _read_mrconso(path: str):
+    """Yield (cui, alias, source, preferred) for the english rows of MRCONSO.RRF."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            row = line.rstrip("\n").split("|")
+            if len(row) <= MRCONSO_STR or row[MRCONSO_LAT] != "ENG":
+                continue
+            preferred = row[MRCONSO_TS] == "P" and row[MRCONSO_STT] == "PF" and row[MRCONSO_ISPREF] == "Y"
+            yield row[MRCONSO_CUI], row[MRCONSO_STR], row[MRCONSO_SAB], preferred
+
+
+def _read_scispacy_kb(path: str):
+    """Yield (cui, alias, source, preferred) from a scispaCy KB .jsonl file."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            concept = json.loads(line)
+            yield concept["concept_id"], concept["canonical_name"], "scispacy", True
+            for alias in concept.get("aliases", []):
+                yield concept["concept_id"], alias, "scispacy", False
+
+
+def _save_strings(strings: list[str], directory: Path, name: str):
+    """Save strings as one utf-8 blob and their offsets, both can be memory-mapped."""
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(string) for string in encoded])
+    np.save(directory / f"{name}_offsets.npy", offsets)
+    np.save(directory / f"{name}.npy", np.frombuffer(b"".join(encoded) or b"\0", dtype=np.uint8))
+
+
+class _MappedStrings:
+    """Read only list of strings saved by _save_strings, memory-mapped."""
+    def __init__(self, directory: Path, name: str):
+        self._offsets = np.load(directory / f"{name}_offsets.npy", mmap_mode="r")
+        self._blob = np.load(directory / f"{name}.npy", mmap_mode="r")
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self._blob[self._offsets[i]:self._offsets[i + 1]].tobytes().decode("utf-8")
+
+
+class LocalUMLSLinker:
+    def __init__(self, index_dir: str = LOCAL_LINKER["index_dir"],
+                 threshold: float = LOCAL_LINKER["threshold"],
+                 k: int = LOCAL_LINKER["k"],
+                 fallback: UMLSNormalizer = None):
+        """Parameters:
+            index_dir = directory of an index made by LocalUMLSLinker.build.
+            threshold = min cosine similarity (0 to 1) of a trusted hit.
+            k = number of nearest aliases retrieved per lookup.
+            fallback = normalizer used for low confidence hits, None to drop them."""
+        directory = Path(index_dir)
+        if not (directory / "meta.json").exists():
+            raise FileNotFoundError(f"No local linker index in {index_dir}, build it with: "
+                                    f"python -m modules.local_linker <concepts file> {index_dir}")
+
+        self.threshold = threshold
+        self.k = k
+        self.fallback = fallback
+
+        with open(directory / "meta.json", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.sources = meta["sources"]
+        with open(directory / "tfidf_vectorizer.pkl", "rb") as f:
+            self.vectorizer: TfidfVectorizer = pickle.load(f)
+
+        #alias id -> concept id, concept id -> cui / preferred name / source id
+        self.alias_concepts = np.load(directory / "alias_concepts.npy", mmap_mode="r")
+        self.concept_sources = np.load(directory / "concept_sources.npy", mmap_mode="r")
+        self.concept_cuis = _MappedStrings(directory, "concept_cuis")
+        self.concept_names = _MappedStrings(directory, "concept_names")
+
+        self.index = nmslib.init(method="hnsw", space="cosinesimil_sparse",
+                                 data_type=nmslib.DataType.SPARSE_VECTOR)
+        self.index.loadIndex(str(directory / "ann_index.bin"), load_data=True)
+        self.index.setQueryTimeParams(HNSW_QUERY_PARAMS)
+        logging.info(f"LocalLinker: Loaded {len(self.concept_cuis)} Concepts, "
+                     f"{len(self.alias_concepts)} Aliases From {index_dir}.")
+
+    @staticmethod
+    def build(concepts_path: str, index_dir: str = LOCAL_LINKER["index_dir"]):
+        """Build the index of a concept file: MRCONSO.RRF (pipe separated, english
+        rows only) or a scispaCy KB .jsonl (concept_id, canonical_name, aliases)."""
+        reader = _read_scispacy_kb if concepts_path.endswith(".jsonl") else _read_mrconso
+
+        concept_ids, cuis, names, concept_sources = {}, [], [], []
+        sources, source_ids = [], {}
+        aliases, alias_concepts, named = [], [], set()
+        for cui, alias, source, preferred in reader(concepts_path):
+            if source not in source_ids:
+                source_ids[source] = len(sources)
+                sources.append(source)
+            if cui not in concept_ids:
+                concept_ids[cui] = len(cuis)
+                cuis.append(cui)
+                names.append(alias)
+                concept_sources.append(source_ids[source])
+            concept_id = concept_ids[cui]
+            #the first preferred name of the concept wins over the first name seen
+            if preferred and concept_id not in named:
+                names[concept_id] = alias
+                concept_sources[concept_id] = source_ids[source]
+                named.add(concept_id)
+
+            aliases.append(alias.lower())
+            alias_concepts.append(concept_id)
+
+        if not aliases:
+            raise ValueError(f"No concepts found in {concepts_path}.")
+
+        #deduplicate identical aliases of a concept, they would fill the k neighbours
+        unique = dict.fromkeys(zip(aliases, alias_concepts))
+        aliases = [alias for alias, _ in unique]
+        alias_concepts = [concept_id for _, concept_id in unique]
+
+        logging.info(f"LocalLinker: Building Index Of {len(cuis)} Concepts, {len(aliases)} Aliases.")
+        vectorizer = TfidfVectorizer(analyzer="char_wb", ngram_range=(3, 3), min_df=1, dtype=np.float32)
+        vectors = vectorizer.fit_transform(aliases)
+
+        index = nmslib.init(method="hnsw", space="cosinesimil_sparse",
+                            data_type=nmslib.DataType.SPARSE_VECTOR)
+        index.addDataPointBatch(vectors)
+        index.createIndex(HNSW_BUILD_PARAMS, print_progress=False)
+
+        directory = Path(index_dir)
+        directory.mkdir(parents=True, exist_ok=True)
+        index.saveIndex(str(directory / "ann_index.bin"), save_data=True)
+        with open(directory / "tfidf_vectorizer.pkl", "wb") as f:
+            pickle.dump(vectorizer, f)
+        np.save(directory / "alias_concepts.npy", np.asarray(alias_concepts, dtype=np.int32))
+        np.save(directory / "concept_sources.npy", np.asarray(concept_sources, dtype=np.int16))
+        _save_strings(cuis, directory, "concept_cuis")
+        _save_strings(names, directory, "concept_names")
+        #written last, an index without meta.json is an unfinished one
+        with open(directory / "meta.json", "w", encoding="utf-8") as f:
+            json.dump({"concepts_path": concepts_path, "sources": sources,
+                       "concepts": len(cuis), "aliases": len(aliases)}, f)
+        logging.info(f"LocalLinker: Index Saved To {index_dir}.")
+
+    def _concept(self, concept_id: int) -> dict:
+        cui = self.concept_cuis[concept_id]
+        return {"cui": cui,
+                "normalized_name": self.concept_names[concept_id],
+                "normalization_source": self.sources[self.concept_sources[concept_id]],
+                "url": UMLS_CUI_URL.format(cui=cui)}
+
+    def link_many(self, strings: list[str]) -> list[tuple]:
+        """(concept id, similarity) of the best hit of each string, (None, 0.0) if no hit."""
+        vectors = self.vectorizer.transform([string.strip().lower() for string in strings])
+        hits = self.index.knnQueryBatch(vectors, k=self.k)
+        best = []
+        for alias_ids, distances in hits:
+            if len(alias_ids) == 0:
+                best.append((None, 0.0))
+                continue
+            #cosinesimil distance is 1 - similarity, results are sorted by distance
+            best.append((int(self.alias_concepts[alias_ids[0]]), 1.0 - float(distances[0])))
+        return best
+
+    def normalize_many(self, strings: list[str]) -> dict[str, dict]:
+        """Same as UMLSNormalizer.normalize_many, low confidence hits go to the fallback."""
+        if not strings:
+            return {}
+        results, unsure = {}, []
+        for string, (concept_id, similarity) in zip(strings, self.link_many(strings)):
+            if concept_id is not None and similarity >= self.threshold:
+                results[string] = self._concept(concept_id)
+            elif self.fallback is not None:
+                unsure.append(string)
+            else:
+                results[string] = {}
+
+        if unsure:
+            logging.info(f"LocalLinker: {len(unsure)} Low Confidence Hits Sent To The Fallback.")
+            results.update(self.fallback.normalize_many(unsure))
+        return results
+
+    def normalize(self, string: str):
+        """Same as UMLSNormalizer.normalize: best match or {}."""
+        return self.normalize_many([string]).get(string, {})
+
+
+
+
+
+
+if __name__ == "__main__":
+    #usage: python -m modules.local_linker <MRCONSO.RRF or kb.jsonl> [index_dir]
+    LocalUMLSLinker.build(*sys.argv[1:3])
+    print("index built, example: ", LocalUMLSLinker(*sys.argv[2:3]).normalize("human"))
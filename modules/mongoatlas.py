@@ -67,14 +67,15 @@ class MongoAtlasConnector:
 
 
     
-    def fetch_articles_from_atlas(self, query = {}):
+    def fetch_articles_from_atlas(self, query = {}, sort = None):
         """
         query = {} to fetch all data.
+        sort = list of (field, direction), e.g. [("pmid", 1)], None for the natural order.
 
         """
         articles = []
         try: 
-            cursor = self.collection.find(query) #it returns a cursor, we must iterate through it.
+            cursor = self.collection.find(query, sort=sort) #it returns a cursor, we must iterate through it.
         except errors.PyMongoError as e: 
             logging.error(f"AtlasConnector: Unable To Fetch Docs: {e}.")
             raise
@@ -88,12 +89,13 @@ class MongoAtlasConnector:
                     article['pmcid'] = doc['pmid'] #will be null if article not available in MPCentral.
                     article['fetching_date'] = doc['fetchingdate']
 
-                    texts = []
-                    #add keywords and MeSH to texts.
+                    #MeSH and keywords are kept apart as curated terms, they are resolved
+                    #by dictionary lookup instead of going through the NER model.
                     keywords = [elt for elt in doc['keywords'] if isinstance(elt, str)]
                     mesh = [elt for elt in doc['medical_subject_headings'] if isinstance(elt, str)]
-                    texts.extend(mesh)
-                    texts.extend(keywords)
+                    article['curated_terms'] = mesh + keywords
+
+                    texts = []
                     #add abstract and title to text
                     if isinstance(doc.get('abstract'), str):
                         texts.append(doc['abstract'])
@@ -1,15 +1,16 @@
 #TODO: add logs, tqdms with desc argument, and use Google Docstring format for documentation 
 # or maybe let the documentation till I finish the whole project and document for once. 
 
-import pandas as pd
-
 from neo4j import GraphDatabase, Transaction
 from neo4j.exceptions import Neo4jError
 
 from tqdm import tqdm
 import logging
 
-from config.neo4jdb_config import NEO4J_LABELS, NEO4J_REL_TYPES
+from modules.schema import NEO4J_ENTITIES, NEO4J_RELATIONS, read_csv
+
+from config.neo4jdb_config import NEO4J_LABELS, NEO4J_REL_TYPES, NEO4J_ENTITY_LABEL
+from config.clean_config import CLEAN
 
 """to load data to neo4j, we have multiple options:
     1 - load every entity or relation independently from others. 
@@ -66,8 +67,11 @@ class Neo4jAuraConnector:
         failed_to_load = [] #will contain labels that weren't able to be loaded.
         #one session for more efficiency
         with self.driver.session() as session:
+                self._ensure_entity_label(session)
                 for label in tqdm(labels_to_load, desc=f"loading nodes"): 
                     logging.info(f"AuraConnector: Loading {label} Nodes")
+                    #schema changes can't share a transaction with writes
+                    self._ensure_id_constraint(label, session)
                     #one transaction per entity to ensure ACID propreties.
                     try:
                         with session.begin_transaction() as transaction: 
@@ -80,22 +84,26 @@ class Neo4jAuraConnector:
                 else: logging.info("AuraConnector:Loaded Successfully")
 
     
-    def load_rels_to_aura(self, reltypes_to_load : list[str], rels_clean_csv: str):
+    def load_rels_to_aura(self, reltypes_to_load : list[str], rels_clean_csv: str, add_evidence: bool = False):
         """Load entities from the cleaned rels csv to Neo4j Aura. 
         Parameters:
             labels_to_load = list of the entities recognized by the NER model
             that we want to load. (exp: 'GENE')
-            rels_clean_csv = path of the cleaned rels csv."""
+            rels_clean_csv = path of the cleaned rels csv.
+            add_evidence = add the evidence of the csv to the one of the relations in the graph
+            (delta files of the incremental clean), instead of replacing it (full clean)."""
         
         assert all(reltype in NEO4J_REL_TYPES for reltype in reltypes_to_load), f" {reltypes_to_load} contains invalid relation type(s), valid: {NEO4J_REL_TYPES}"
         failed_to_load = []
         with self.driver.session() as session:
+            self._ensure_entity_label(session)
             for reltype in tqdm(reltypes_to_load, desc=f"loading relations"): 
                 logging.info(f"AuraConnector: Loading {reltype} Relations")
                 try:
                     with session.begin_transaction() as transaction: 
                         relations_with_reltype = self._get_relations_with_type(reltype, rels_clean_csv)
-                        self._rels_batch_load(reltype,relations_list=relations_with_reltype, transaction = transaction)
+                        self._rels_batch_load(reltype,relations_list=relations_with_reltype, transaction = transaction,
+                                              add_evidence=add_evidence)
                 except Exception as e: 
                     failed_to_load.append({"reltype":reltype, "error": str(e)})
             if failed_to_load: 
@@ -105,6 +113,35 @@ class Neo4jAuraConnector:
 
 
 
+    def _ensure_id_constraint(self, label: str, session):
+        """Unique constraint on the id of the label's nodes, which also indexes it:
+        MERGE on id is then an index lookup instead of a scan of the label."""
+        try:
+            session.run(f"CREATE CONSTRAINT {label.lower()}_id IF NOT EXISTS FOR (n:{label}) REQUIRE n.id IS UNIQUE")
+        except Neo4jError as ne:
+            logging.error(f"AuraConnector: Neo4jError: {ne}")
+            raise
+
+    def _ensure_entity_label(self, session):
+        """Unique constraint on the id of the NEO4J_ENTITY_LABEL nodes, the index relations
+        look their endpoints up in. Created once: the nodes loaded before it existed are
+        given the label then, the loads after that set it on the nodes they merge."""
+        try:
+            exists = session.run("SHOW CONSTRAINTS YIELD name WHERE name = $name RETURN count(*) AS n",
+                                 name=f"{NEO4J_ENTITY_LABEL.lower()}_id").single()["n"]
+            if exists:
+                return
+            self._ensure_id_constraint(NEO4J_ENTITY_LABEL, session)
+            for label in NEO4J_LABELS:
+                session.run(f"""
+                    MATCH (n:{label}) WHERE NOT n:{NEO4J_ENTITY_LABEL}
+                    CALL {{ WITH n SET n:{NEO4J_ENTITY_LABEL} }} IN TRANSACTIONS OF {self.load_batch_size} ROWS
+                    """)
+            logging.info(f"AuraConnector: Added The {NEO4J_ENTITY_LABEL} Label To The Nodes Already Loaded.")
+        except Neo4jError as ne:
+            logging.error(f"AuraConnector: Neo4jError: {ne}")
+            raise
+
     def _ents_batch_load(self, label: str, nodes_list: list[dict], transaction : Transaction):
         """Entities (nodes) Batch load using UNWIND for optimal performance
         Parameters:
@@ -113,15 +150,25 @@ class Neo4jAuraConnector:
         transaction = neo4j transaction instance
 
         """
-        
+        #ids are derived from the entities (see clean.py), so a re-load finds the nodes
+        #it already created, they are only written if one of their properties changed
+        #(adding a label the node already has writes nothing)
         query = f"""
             UNWIND $batch AS row
             MERGE (n:{label} {{id: row.id}})
+            SET n:{NEO4J_ENTITY_LABEL}
+            WITH n, row
+            WHERE coalesce(n.name, '') <> coalesce(row.name, '')
+               OR coalesce(n.cui, '') <> coalesce(row.cui, '')
+               OR coalesce(n.normalized_name, '') <> coalesce(row.normalized_name, '')
+               OR coalesce(n.normalization_source, '') <> coalesce(row.normalization_source, '')
+               OR coalesce(n.url, '') <> coalesce(row.url, '')
             SET n += {{
                 name: row.name,
                 cui: row.cui,
                 normalized_name: row.normalized_name,
-                normalization_source: row.normalization_source
+                normalization_source: row.normalization_source,
+                url: row.url
             }}
             """
         try: 
@@ -135,29 +182,40 @@ class Neo4jAuraConnector:
             logging.error(f"AuraConnector: {e}")
             raise
         
-    def _rels_batch_load(self, relation_type: str, relations_list: list[dict], transaction : Transaction):
+    def _rels_batch_load(self, relation_type: str, relations_list: list[dict], transaction : Transaction,
+                         add_evidence: bool = False):
         """Relations Batch load using UNWIND for optimal performance
         Parameters:
         relation_type = "the relation_type for the relations to load. (exp 'GENE')
         relations_list: list containing relations to load, each is a dict.
         transaction: neo4j transaction instance
+        add_evidence: add evidence_count and pmids to the ones of the relation, instead of setting them
 
         """
-        
+        if add_evidence:
+            #pmids already there are not added twice, the list stays bounded
+            evidence = """
+            SET r.evidence_count = coalesce(r.evidence_count, 0) + row.evidence_count,
+                r.pmids = (coalesce(r.pmids, []) + [pmid IN row.pmids WHERE NOT pmid IN coalesce(r.pmids, [])])[..$max_pmids]
+            """
+        else:
+            #the full clean has the whole evidence, unchanged relations are not written again
+            evidence = """
+            WITH r, row
+            WHERE r.evidence_count IS NULL OR r.evidence_count <> row.evidence_count OR r.pmids <> row.pmids
+            SET r.evidence_count = row.evidence_count, r.pmids = row.pmids
+            """
         query = f"""
         UNWIND $batch AS row
-        MATCH (start {{id: row.start_id}})
-        MATCH (end {{id: row.end_id}})
+        MATCH (start:{NEO4J_ENTITY_LABEL} {{id: row.start_id}})
+        MATCH (end:{NEO4J_ENTITY_LABEL} {{id: row.end_id}})
         MERGE (start)-[r:{relation_type}]->(end)
-        SET r += {{
-        pmid: row.pmid,
-        pmcid: row.pmcid
-                 }}
+        {evidence}
         """
         try: 
             for i in range(0, len(relations_list), self.load_batch_size):
                 batch = relations_list[i:i + self.load_batch_size]
-                transaction.run(query, {"batch":batch})
+                transaction.run(query, {"batch":batch, "max_pmids": CLEAN["max_pmids"]})
         except Neo4jError as ne:
             logging.error(f"AuraConnector: Neo4j Error: {ne}")
             raise
@@ -176,8 +234,7 @@ class Neo4jAuraConnector:
         # Read and preprocess data
         assert label in NEO4J_LABELS, f"label argument got {label}, not one of {NEO4J_LABELS}."
         try: 
-            df = pd.read_csv(ents_clean_csv,
-                              dtype = {6:str, 7:str, 8:str, 9:str}) #to fix a DtypeWarning 
+            df = read_csv(ents_clean_csv, NEO4J_ENTITIES)
         except FileNotFoundError as e:
             logging.error(f"AuraConnector: {e}")
             raise
@@ -195,6 +252,8 @@ class Neo4jAuraConnector:
             #those will just create redundancy in the graph if kept
             to_drop = [col for col in [":LABEL", "pmid", "pmcid", "fetching_date"] if col in entities.columns]
             entities.drop(columns=to_drop, inplace=True)
+            #missing values as null (not NaN) so that they compare equal to missing properties
+            entities = entities.astype(object).where(entities.notna(), None)
             entities_dict = entities.to_dict("records")  #convert to list of dicts
             return entities_dict
         else:
@@ -211,7 +270,7 @@ class Neo4jAuraConnector:
         
         assert type in NEO4J_REL_TYPES, f"type argument got {type}, not one of {NEO4J_REL_TYPES}."
         try: 
-            df = pd.read_csv(rels_clean_csv)
+            df = read_csv(rels_clean_csv, NEO4J_RELATIONS)
         except FileNotFoundError as e:
             logging.error(f"AuraConnector: {e}")
             raise
@@ -230,6 +289,9 @@ class Neo4jAuraConnector:
             #those will just create redundancy in the graph if kept
             to_drop = [col for col in [":TYPE", "pmid", "pmcid", "fetching_date"] if col in relations.columns]
             relations.drop(columns=to_drop, inplace=True)
+            #the ";" separated pmids of the evidence as a list property
+            if "pmids" in relations.columns:
+                relations["pmids"] = relations["pmids"].fillna("").str.split(";").map(lambda pmids: [p for p in pmids if p])
             relations_dict = relations.to_dict("records")  #convert to list of dicts
             return relations_dict
         else:
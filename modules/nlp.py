@@ -1,45 +1,76 @@
-import pandas as pd
 import spacy
 import logging
-import pickle
 import hashlib
-import time
 import shutil
+import os
 
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from spacy.matcher import Matcher, DependencyMatcher
+from spacy.language import Language
+from spacy.tokens import Doc
 
 from modules.umls_api import UMLSNormalizer
-from config.nlp_config import MATCHER_PATTERNS, DEPENDENCY_MATCHER_PATTERNS
-from config.nlp_config import GENERIC_ENTITIES
+from modules.term_matcher import CuratedTermMatcher
+from modules.relation_extractor import RelationExtractor
+from modules.normalization_cache import NormalizationCache
+from modules.normalization_queue import NormalizationQueue
+from modules.variant_index import VariantIndex
+from modules.key_set import make_key_set
+from modules.writers import make_writer
+from modules.doc_cache import DocCache, model_key, profile_key
+from modules.result_cache import AnnotationResultCache, cache_model
+from modules.profiler import Profiler
+from config.nlp_config import GENERIC_ENTITIES, KNOWN_ENTITIES_PATH
+from config.nlp_config import RELATION_MAX_WINDOW
+from config.nlp_config import ENTITY_COLUMNS, OUTPUT, RESULT_CACHE
+from config.nlp_config import NER_MODEL, PIPELINE, PIPELINE_PROFILES
+
+# Entity texts never worth a UMLS lookup, built once instead of on every call
+STOPWORDS = frozenset({'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by'})
+SKIP_NORMALIZATION = frozenset(GENERIC_ENTITIES) | STOPWORDS
+# Normalization of the entities without any (skipped or failed lookup)
+EMPTY_NORMALIZATION = {"cui": "", "normalized_name": "", "normalization_source": ""}
 
 class StreamingOptimizedNLP:
     def __init__(self, normalizer: UMLSNormalizer, 
                  entities_output_path: str,
                  relations_output_path: str,
                  cache_size: int = 10000, 
-                 batch_size: int = 50, 
-                 max_workers: int = 4,
-                 buffer_size: int = 1000):
-        
-        logging.info("NLP: Loading NER Model...")
-        print("loading ner model...")
-        self.nlp_pipe = spacy.load("en_ner_bionlp13cg_md") 
-        self.nlp_pipe.add_pipe("merge_entities", after="ner")
-        
-        # Initialize matchers with model vocab
-        self.matcher = Matcher(self.nlp_pipe.vocab)
-        self.dep_matcher = DependencyMatcher(self.nlp_pipe.vocab)
+                 buffer_size: int = 1000,
+                 known_entities_path: str = KNOWN_ENTITIES_PATH,
+                 max_window: int = RELATION_MAX_WINDOW,
+                 output_format: str = OUTPUT["format"],
+                 compression: str = OUTPUT["compression"],
+                 rotate_bytes: int = OUTPUT["rotate_bytes"],
+                 resume_outputs: dict = None,
+                 nlp_pipe: Language = None,
+                 doc_cache: DocCache = None,
+                 use_result_cache: bool = RESULT_CACHE["enabled"],
+                 profiler: Profiler = None):
+        
+        # A pipeline loaded by the caller is used as is (e.g. shared by forked workers)
+        self.nlp_pipe = nlp_pipe if nlp_pipe is not None else self.load_pipeline()
+        
+        # Stage timings and counters of the run (see config PROFILER)
+        self.profiler = profiler if profiler is not None else Profiler()
+        
+        # Parsed docs are saved there if given, to re-run the relation patterns later
+        self.doc_cache = doc_cache
+        
+        # Entities and relations of the texts already annotated with this model and these patterns
+        self.result_cache = None
+        if use_result_cache:
+            self.result_cache = AnnotationResultCache(cache_model(self.nlp_pipe))
+        
+        # Dictionary lookup for MeSH headings and keywords (tokenizer only, no NER)
+        self.term_matcher = CuratedTermMatcher(self.nlp_pipe, known_entities_path)
         
         # Initialize the normalizer
         self.normalizer = normalizer
         
         # Performance optimization settings
         self.cache_size = cache_size
-        self.batch_size = batch_size
-        self.max_workers = max_workers
         self.buffer_size = buffer_size
+        self.max_window = max_window
         
         # Output paths for streaming
         self.entities_output_path = entities_output_path
@@ -47,221 +78,186 @@ class StreamingOptimizedNLP:
         
 
         
-        # Streaming buffers
+        # Streaming buffer
         self._entities_buffer = []
-        self._relations_buffer = []
-        
-        # Track if CSV headers have been written
-        self._entities_header_written = False
-        self._relations_header_written = False
         
         # Caching and deduplication
-        self._normalization_cache = {}
-        self._entity_cache = set()
-        self._relation_cache = set()
+        self._normalization_cache = NormalizationCache(cache_size=cache_size)
+        # Keys already written, as 64-bit hashes (see config DEDUP)
+        self._entity_cache = make_key_set("entity_keys")
         self._load_cache()
-        
-        # Initialize streaming CSV files
-
-        self._initialize_streaming_files()
-        
-        # Add patterns to matchers
-        for label, patterns in MATCHER_PATTERNS.items():
-            self.matcher.add(label, patterns)
-
-        for label, patterns in DEPENDENCY_MATCHER_PATTERNS.items():
-            self.dep_matcher.add(label, patterns)
+        # Plural, hyphenation and greek letter variants of known texts skip the normalizer
+        self.variant_index = VariantIndex.from_sources(self._normalization_cache, known_entities_path)
+        # New entity texts are normalized in the background, rows are joined at flush
+        self.normalization_queue = NormalizationQueue(normalizer, self._normalization_cache, self.variant_index)
+        
+        # Long lived writers with fixed columns, they replace the previous outputs
+        # except the committed files of a resumed run (see commit_outputs)
+        resume_outputs = resume_outputs or {}
+        self._entities_writer = make_writer(entities_output_path, ENTITY_COLUMNS, format=output_format,
+                                            compression=compression, rotate_bytes=rotate_bytes,
+                                            keep=resume_outputs.get("entities"))
+        
+        # Relation patterns, matchers and the relations output
+        self.relation_extractor = RelationExtractor(self.nlp_pipe.vocab, relations_output_path,
+                                                    buffer_size=buffer_size, max_window=max_window,
+                                                    output_format=output_format, compression=compression,
+                                                    rotate_bytes=rotate_bytes,
+                                                    resume_outputs=resume_outputs.get("relations"),
+                                                    profiler=self.profiler)
+        self._closed = False
     
-    def _initialize_streaming_files(self):
-        """Initialize CSV files for streaming output."""
-        # Ensure directory exists
-        Path(self.entities_output_path).parent.mkdir(parents=True, exist_ok=True)
-        # Create/truncate the file
-        with open(self.entities_output_path, 'w', newline='', encoding='utf-8'):
-            pass  # Just create/truncate the file
-        
-        Path(self.relations_output_path).parent.mkdir(parents=True, exist_ok=True)
-        with open(self.relations_output_path, 'w', newline='', encoding='utf-8'):
-            pass
+    @staticmethod
+    def load_pipeline(profile: str = PIPELINE["profile"], pipelines_dir: str = PIPELINE["dir"]) -> Language:
+        """Load the NER model with the components of a profile (see PIPELINE_PROFILES),
+        entities merged into single tokens. The assembled pipeline is saved the first
+        time, and loaded from there afterwards (the key of the profile changes with its
+        settings, an edited profile is assembled again)."""
+        path = Path(pipelines_dir) / f"{model_key()}.{profile_key(profile)}"
+        if path.is_dir():
+            logging.info(f"NLP: Loading {profile} Pipeline From {path}...")
+            return spacy.load(path)
+        
+        logging.info(f"NLP: Loading NER Model ({profile} Profile)...")
+        print("loading ner model...")
+        settings = PIPELINE_PROFILES[profile]
+        # Excluded components are never loaded, nor run
+        nlp_pipe = spacy.load(NER_MODEL, exclude=settings["exclude"])
+        if settings["sentencizer"]:
+            nlp_pipe.add_pipe("sentencizer", first=True)
+        nlp_pipe.add_pipe("merge_entities", after="ner")
+        # Saved next to its final place then renamed, a half saved pipeline is never loaded
+        tmp_path = path.with_name(path.name + ".tmp")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        tmp_path.parent.mkdir(parents=True, exist_ok=True)
+        nlp_pipe.to_disk(tmp_path)
+        os.replace(tmp_path, path)
+        logging.info(f"NLP: Saved The {profile} Pipeline To {path}.")
+        return nlp_pipe
     
-    def _stream_entities_to_csv(self, entities_batch: list[dict]):
-        """Stream a batch of entities directly to CSV."""
+    def _stream_entities(self, entities_batch: list[dict]):
+        """Stream a batch of entities to the entities output."""
         if not entities_batch:
             return
         
         try:
-            # Convert to DataFrame for easy CSV writing
-            df = pd.DataFrame(entities_batch)
-            
-            # Write header only once
-            write_header = not self._entities_header_written
-            mode = 'w' if write_header else 'a'
-            
-            df.to_csv(self.entities_output_path, mode=mode, header=write_header, index=False)
-            
-            if write_header:
-                self._entities_header_written = True
-            
-            logging.debug(f"NLP: Streamed {len(entities_batch)} entities to CSV")
+            with self.profiler.stage("write"):
+                self._entities_writer.write_rows(entities_batch)
+            logging.debug(f"NLP: Streamed {len(entities_batch)} entities to {self._entities_writer.path}")
             
         except Exception as e:
-            logging.error(f"NLP: Failed to stream entities to CSV: {e}")
-    
-    def _stream_relations_to_csv(self, relations_batch: list[dict]):
-        """Stream a batch of relations directly to CSV."""
-        if not relations_batch:
-            return
-        
-        try:
-            df = pd.DataFrame(relations_batch)
-            
-            write_header = not self._relations_header_written
-            mode = 'w' if write_header else 'a'
-            
-            df.to_csv(self.relations_output_path, mode=mode, header=write_header, index=False)
-            
-            if write_header:
-                self._relations_header_written = True
-            
-            logging.debug(f"NLP: Streamed {len(relations_batch)} relations to CSV")
-            
-        except Exception as e:
-            logging.error(f"NLP: Failed to stream relations to CSV: {e}")
+            logging.error(f"NLP: Failed to stream entities: {e}")
     
     def _flush_entities_buffer(self, force: bool = False):
         """Flush entities buffer to CSV when it reaches buffer_size or force=True."""
         if (len(self._entities_buffer) >= self.buffer_size or force) and self._entities_buffer:
-            self._stream_entities_to_csv(self._entities_buffer)
+            self._join_normalizations(self._entities_buffer)
+            self._stream_entities(self._entities_buffer)
             
             self._entities_buffer.clear()
     
-    def _flush_relations_buffer(self, force: bool = False):
-        """Flush relations buffer to CSV when it reaches buffer_size or force=True."""
-        if (len(self._relations_buffer) >= self.buffer_size or force) and self._relations_buffer:
-            self._stream_relations_to_csv(self._relations_buffer)
-            
-            self._relations_buffer.clear()
-    
     def _generate_cache_key(self, text: str) -> str:
         """Generate a MD5 hash key (id) for caching normalized entities."""
         return hashlib.md5(text.lower().strip().encode()).hexdigest()
     
     def _load_cache(self):
-        """Load normalization cache from disk if it exists."""
-        try:
-            with open('cache/normalization_cache.pkl', 'rb') as f:
-                self._normalization_cache = pickle.load(f)
-            logging.info(f"NLP: Loaded {len(self._normalization_cache)} cached normalizations")
-        except FileNotFoundError:
-            logging.info("NLP: No existing cache found, starting fresh")
-    
-    def _save_cache(self):
-        """Save normalization cache to disk."""
-        try:
-            with open('cache/normalization_cache.pkl', 'wb') as f:
-                pickle.dump(self._normalization_cache, f)
-            logging.info(f"NLP: Saved {len(self._normalization_cache)} normalizations to cache")
-        except Exception as e:
-            logging.error(f"NLP: Failed to save cache: {e}")
+        """Import the old pickled cache into the SQLite one, the first time only."""
+        if len(self._normalization_cache) == 0:
+            self._normalization_cache.import_pickle()
+        logging.info(f"NLP: {len(self._normalization_cache)} cached normalizations available")
     
     def _should_normalize(self, text: str) -> bool:
         """Determine if entity should be normalized (skip very short/common ones)."""
         text = text.strip().lower()
-        skip_patterns = GENERIC_ENTITIES | {'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by'}
-        return len(text) >= 1 and text not in skip_patterns
+        return len(text) >= 1 and text not in SKIP_NORMALIZATION
     
-    def _batch_normalize_entities(self, entity_texts: list[str]) -> dict[str, dict]:
-        """Normalize entities in batches to reduce API calls."""
-        results = {}
-        to_normalize = []
-        
-        # Check cache first
-        for text in entity_texts:
-            cache_key = self._generate_cache_key(text)
-            if cache_key in self._normalization_cache:
-                results[text] = self._normalization_cache[cache_key]
-            elif self._should_normalize(text):
-                to_normalize.append(text)
-            else:
-                results[text] = {"cui": "", "normalized_name": "", "normalization_source": ""}
-        
-        if not to_normalize:
-            return results
-        
-        logging.info(f"NLP: Normalizing {len(to_normalize)} new entities via UMLS API")
-        
-        # Process in smaller batches to avoid overwhelming the API
-        for i in range(0, len(to_normalize), self.batch_size):
-            batch = to_normalize[i:i + self.batch_size]
-            
-            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                future_to_text = {
-                    executor.submit(self.normalizer.normalize, text): text 
-                    for text in batch
-                }
-                
-                for future in as_completed(future_to_text):
-                    text = future_to_text[future]
-                    try:
-                        normalization_result = future.result()
-                        cache_key = self._generate_cache_key(text)
-                        
-                        self._normalization_cache[cache_key] = normalization_result
-                        results[text] = normalization_result
-                        
-                    except Exception as e:
-                        results[text] = {"cui": "", "normalized_name": "", "normalization_source": ""}
-            
-            if i + self.batch_size < len(to_normalize):
-                time.sleep(0.5)
-        
-        if len(self._normalization_cache) % 100 == 0:
-            self._save_cache()
-        
-        return results
+    def _queue_normalization(self, text: str) -> str:
+        """Submit the text to the normalization queue if it is worth a lookup,
+        return its normalization key."""
+        cache_key = self._generate_cache_key(text)
+        if self._should_normalize(text):
+            self.normalization_queue.submit(cache_key, text)
+        return cache_key
     
-    def extract_and_normalize_entities(self, text: str, article_metadata: dict):
-        """Extract recognized entities from text with 
-        optimized normalization and streaming."""
-        doc = self.nlp_pipe(text)
-        
-        if not doc.ents:
-            return self
-        
-        entity_texts_to_normalize = set()
-        extracted_entities = []
+    def _join_normalizations(self, rows: list[dict]):
+        """Replace the normalization key of the rows by its normalization, waiting
+        for the keys the queue hasn't resolved yet."""
+        keys = {row["normalization_key"] for row in rows if "normalization_key" in row}
+        if not keys:
+            return
         
+        with self.profiler.stage("normalization_wait"):
+            self.normalization_queue.wait(keys)
+        normalizations = self.normalization_queue.results(keys)
+        for row in rows:
+            if "normalization_key" not in row:
+                continue
+            normalization = normalizations[row.pop("normalization_key")] or EMPTY_NORMALIZATION
+            row.update(normalization)
+            # The CUI is now known for curated terms lookup too
+            self.term_matcher.add(row["text"], row["label"], normalization)
+    
+    @staticmethod
+    def _index_entities(doc) -> dict:
+        """Index the entities of a doc in a single pass: (lemma, label) -> first span.
+        Lemmas are stripped and lowercased, generic entities (e.g. cancer, tumor...) are left out."""
+        entity_index = {}
         for ent in doc.ents:
             lemma = ent.lemma_.strip().lower()
-            #we have nothing to do with generic entities (e.g. cancer, tumor...)
             if lemma not in GENERIC_ENTITIES:
-                if __name__ == "__main__": 
-                    print(f"entity: {lemma} --- label: {ent.label_}\n ******* ")
-                
-                
-                entity_dict = {
-                    "text": lemma,
-                    "label": ent.label_,
-                    **article_metadata
-                }
-                
-                extracted_entities.append(entity_dict)
-                entity_texts_to_normalize.add(lemma)
+                entity_index.setdefault((lemma, ent.label_), ent)
+        return entity_index
+    
+    def parse(self, text: str, article_metadata: dict = None) -> Doc:
+        """Run the pipeline over text, once for both entities and relations.
+        The doc is saved to the doc cache with its article metadata, if any."""
+        doc = self.profiler.run_pipeline(self.nlp_pipe, text)
+        if self.doc_cache is not None and article_metadata is not None:
+            self.doc_cache.add(doc, article_metadata)
+        return doc
+    
+    def _as_doc(self, text) -> Doc:
+        """Text or already parsed doc -> doc."""
+        return text if isinstance(text, Doc) else self.parse(text)
+    
+    def extract_and_normalize_entities(self, text: str | Doc, article_metadata: dict):
+        """Extract recognized entities from text (or its parsed doc) with 
+        optimized normalization and streaming."""
+        doc = self._as_doc(text)
+        self._add_entities(self._find_entities(doc), article_metadata)
+        return self
+    
+    def _find_entities(self, doc: Doc) -> list[tuple]:
+        """(lemma, label) of the entities of a doc, each once."""
+        if not doc.ents:
+            return []
+        # One pass over the entities, (lemma, label) -> first span
+        return list(self._index_entities(doc))
+    
+    def _add_entities(self, entities: list[tuple], article_metadata: dict):
+        """Queue the normalization of the (lemma, label) entities of an article
+        and buffer the new ones."""
+        if not entities:
+            return
+        self.profiler.count("entities", len(entities))
         
-        # Batch normalize all unique entity texts
-        normalization_results = self._batch_normalize_entities(list(entity_texts_to_normalize))
+        # Normalization is queued, rows carry the key of their text until flushed
+        normalization_keys = {lemma: self._queue_normalization(lemma) for lemma, _ in entities}
         
-        # Apply normalization results to entities
         final_entities = []
-        for entity_dict in extracted_entities:
-            original_text = None
-            for ent in doc.ents:
-                if ent.lemma_.strip().lower() == entity_dict["text"]:
-                    original_text = ent.lemma_.strip()
-                    break
+        for lemma, label in entities:
+            if __name__ == "__main__": 
+                print(f"entity: {lemma} --- label: {label}\n ******* ")
+            
+            entity_dict = {
+                "text": lemma,
+                "label": label,
+                **article_metadata,
+                "normalization_key": normalization_keys[lemma]
+            }
             
-            if original_text and original_text in normalization_results:
-                entity_dict.update(normalization_results[original_text])
+            # Entities found in the text become known names for curated terms lookup
+            self.term_matcher.add(lemma, label)
             
             entity_key = (
                 entity_dict["text"], 
@@ -270,8 +266,7 @@ class StreamingOptimizedNLP:
                 entity_dict.get("pmcid", "")
             )
             
-            if entity_key not in self._entity_cache:
-                self._entity_cache.add(entity_key)
+            if self._entity_cache.add(entity_key):
                 final_entities.append(entity_dict)
         
         # Add to buffer instead of directly to entities list
@@ -281,97 +276,83 @@ class StreamingOptimizedNLP:
         self._flush_entities_buffer()
         
         logging.info(f"NLP: Added {len(final_entities)} new unique entities to buffer")
-        
-        return self
     
-    def extract_relations(self, text: str, article_metadata: dict):
-        """Extract relations with optimized deduplication and streaming."""
-        doc = self.nlp_pipe(text)
-        
-        matches = self.matcher(doc)
-        dep_matches = self.dep_matcher(doc)
-        
-        new_relations = []
-        
-        # Matcher-based relations
-        for match_id, start, end in matches:
-            entities_in_span = [ent for ent in doc.ents if ent.start >= start and ent.end <= end]
-            
-            if len(entities_in_span) == 2:
-                ent1, ent2 = entities_in_span
-                relation_label = self.nlp_pipe.vocab.strings[match_id]
-                
-                if __name__ == "__main__":
-                    print(f"{ent1.lemma_} -[{relation_label}]-> {ent2.lemma_}\n*******")
-                
-                rel_dict = {
-                    "ent1": ent1.lemma_.strip().lower(),
-                    "relation": relation_label,
-                    "ent2": ent2.lemma_.strip().lower(),
-                    **article_metadata
-                }
-                
-                relation_key = (
-                    rel_dict["ent1"],
-                    rel_dict["relation"],
-                    rel_dict["ent2"],
-                    rel_dict.get("pmid", ""),
-                    rel_dict.get("pmcid", "")
-                )
-                
-                if relation_key not in self._relation_cache:
-                    self._relation_cache.add(relation_key)
-                    new_relations.append(rel_dict)
+    def extract_curated_entities(self, terms: list[str], article_metadata: dict):
+        """Resolve MeSH headings and keywords by dictionary lookup, without NER
+        nor UMLS calls, labels and CUIs come from the already known entities."""
+        if not terms:
+            return self
         
-        # Dependency-matcher-based relations
-        for match_id, token_ids in dep_matches:
-            relation_label = self.nlp_pipe.vocab.strings[match_id]
-            ent1 = doc[token_ids[0]]
-            ent2 = doc[token_ids[-1]]
-            
-            if __name__ == "__main__":
-                print(f"{ent1.lemma_} -[{relation_label}]-> {ent2.lemma_}\n*******")
-            
-            rel_dict = {
-                "ent1": ent1.lemma_.strip().lower(),
-                "relation": relation_label,
-                "ent2": ent2.lemma_.strip().lower(),
-                **article_metadata
+        new_entities = []
+        for entry in self.term_matcher.match(terms):
+            entity_dict = {
+                "text": entry.pop("text"),
+                "label": entry.pop("label"),
+                **article_metadata,
+                **entry
             }
+            # Names known from this run only get their CUI when the rows are flushed
+            if not entity_dict.get("cui"):
+                entity_dict["normalization_key"] = self._generate_cache_key(entity_dict["text"])
             
-            relation_key = (
-                rel_dict["ent1"],
-                rel_dict["relation"],
-                rel_dict["ent2"],
-                rel_dict.get("pmid", ""),
-                rel_dict.get("pmcid", "")
+            entity_key = (
+                entity_dict["text"], 
+                entity_dict["label"], 
+                entity_dict.get("pmid", ""), 
+                entity_dict.get("pmcid", "")
             )
             
-            if relation_key not in self._relation_cache:
-                self._relation_cache.add(relation_key)
-                new_relations.append(rel_dict)
-        
-        # Add to buffer instead of directly to relations list
-        self._relations_buffer.extend(new_relations)
+            if self._entity_cache.add(entity_key):
+                new_entities.append(entity_dict)
         
-        # Flush buffer if it's full
-        self._flush_relations_buffer()
+        self._entities_buffer.extend(new_entities)
+        self._flush_entities_buffer()
         
-        logging.info(f"NLP: Added {len(new_relations)} new unique relations to buffer")
+        logging.info(f"NLP: Added {len(new_entities)} new unique curated entities to buffer")
         
         return self
     
+    def extract_relations(self, text: str | Doc, article_metadata: dict):
+        """Extract relations from text (or its parsed doc) with optimized deduplication and streaming."""
+        doc = self._as_doc(text)
+        self.relation_extractor.extract_relations(doc, article_metadata)
+        return self
+    
+    def extract_entities_and_relations(self, text: str, article_metadata: dict):
+        """Extract the entities and relations of an article text. A text already
+        annotated with the same model and patterns is taken from the result cache
+        instead of being parsed (unless docs are being saved, they need the parse)."""
+        self.profiler.article_done()
+        if self.result_cache is None:
+            doc = self.parse(text, article_metadata)
+            return self.extract_and_normalize_entities(doc, article_metadata).extract_relations(doc, article_metadata)
+        
+        key = self.result_cache.key(text)
+        cached = self.result_cache.get(key) if self.doc_cache is None else None
+        if cached is not None:
+            self.profiler.count("cached_articles")
+            entities, relations = cached
+        else:
+            doc = self.parse(text, article_metadata)
+            entities, relations = self._find_entities(doc), self.relation_extractor.find_relations(doc)
+            self.result_cache.set(key, entities, relations)
+        
+        self._add_entities(entities, article_metadata)
+        self.relation_extractor.add_relations(relations, article_metadata)
+        return self
+    
     def process_articles_batch(self, articles: list[dict]) -> 'StreamingOptimizedNLP':
         """Process multiple articles efficiently with streaming."""
         logging.info(f"NLP: Processing batch of {len(articles)} articles")
         
         for article in articles:
             text = article.get('text', '')
-            metadata = {k: v for k, v in article.items() if k != 'text'}
+            terms = article.get('curated_terms', [])
+            metadata = {k: v for k, v in article.items() if k not in ('text', 'curated_terms')}
             
             if text:
-                self.extract_and_normalize_entities(text, metadata)
-                self.extract_relations(text, metadata)
+                self.extract_entities_and_relations(text, metadata)
+            self.extract_curated_entities(terms, metadata)
         
         # Force flush buffers after processing batch
         self.flush_all_buffers()
@@ -379,30 +360,71 @@ class StreamingOptimizedNLP:
         return self
     
     def flush_all_buffers(self):
-        """Force flush all buffers to CSV files."""
+        """Force flush all buffers to the output files, once the queued normalizations are resolved."""
+        with self.profiler.stage("normalization_wait"):
+            self.normalization_queue.wait()
         self._flush_entities_buffer(force=True)
-        self._flush_relations_buffer(force=True)
-        logging.info("NLP: Flushed all buffers to CSV files")
+        self.relation_extractor.flush(force=True)
+        logging.info("NLP: Flushed all buffers to output files")
     
 
+    def commit_outputs(self) -> dict:
+        """Write out everything annotated so far and make it durable, return the
+        output files with their committed size, for a checkpoint."""
+        self.flush_all_buffers()
+        self._normalization_cache.sync()
+        if self.doc_cache is not None:
+            self.doc_cache.flush()
+        if self.result_cache is not None:
+            self.result_cache.sync()
+        return {"entities": self._entities_writer.commit(),
+                "relations": self.relation_extractor.commit_outputs()}
+    
     def get_info(self) -> dict:
         """Get processing statistics."""
+        relations = self.relation_extractor.get_info()
         return {
-            "total_entities": len(self.entities) + len(self._entities_buffer),
-            "total_relations": len(self.relations) + len(self._relations_buffer),
+            "total_entities": self._entities_writer.rows_written + len(self._entities_buffer),
+            "total_relations": relations["total_relations"],
             "cached_normalizations": len(self._normalization_cache),
+            "pending_normalizations": len(self.normalization_queue),
+            "normalization": self.normalization_queue.stats(),
+            "variant_index": self.variant_index.stats(),
+            "result_cache": self.result_cache.stats() if self.result_cache is not None else None,
             "unique_entity_texts": len(self._entity_cache),
-            "unique_relations": len(self._relation_cache),
+            "unique_relations": relations["unique_relations"],
             "entities_in_buffer": len(self._entities_buffer),
-            "relations_in_buffer": len(self._relations_buffer),
+            "relations_in_buffer": relations["relations_in_buffer"],
         }
     
+    def write_profile(self, path: str):
+        """Write the profiler report of the run, with the processing statistics and the
+        latencies of the normalizer API calls (if it makes any)."""
+        latency = getattr(self.normalizer, "latency", None)
+        if latency is None:
+            #local linker, with or without UMLS API fallback
+            latency = getattr(getattr(self.normalizer, "fallback", None), "latency", None)
+        self.profiler.write(path, info=self.get_info(),
+                            api_latency=latency.to_dict() if latency is not None else None)
+    
+    def close(self):
+        """Flush buffers, then stop the queue and close the output files and the cache."""
+        if getattr(self, '_closed', True):
+            return
+        self._closed = True
+        self.flush_all_buffers()
+        self.normalization_queue.close()
+        if self.doc_cache is not None:
+            self.doc_cache.flush()
+        self._entities_writer.close()
+        self.relation_extractor.close()
+        self._normalization_cache.close()
+        self._entity_cache.close()
+        if self.result_cache is not None:
+            self.result_cache.close()
+    
     def __del__(self):
-        """Save cache and flush buffers when object is destroyed."""
-        if hasattr(self, '_normalization_cache') and self._normalization_cache:
-            self._save_cache()
-        
-        if hasattr(self, '_entities_buffer') or hasattr(self, '_relations_buffer'):
-            self.flush_all_buffers()
+        """Close everything when object is destroyed."""
+        self.close()
 
 
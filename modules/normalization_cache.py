@@ -0,0 +1,181 @@
+import sqlite3
+import logging
+import pickle
+import json
+import time
+import threading
+
+from collections import OrderedDict
+from pathlib import Path
+
+from modules.variant_index import canonicalize
+from config.nlp_config import NORMALIZATION_CACHE
+
+"""UMLS normalizations are cached on disk in SQLite (WAL mode), one row per entity
+    text, written as soon as the result is known. WAL lets several annotator processes
+    read and write the same cache file at once, and nothing is lost if the process
+    dies before the end of the run.
+    A bounded in-memory LRU sits in front of it (cache_size entries), so startup
+    doesn't load the whole cache and memory doesn't grow with it.
+    Negative results (no CUI found) expire after negative_ttl seconds, so they get
+    another chance against newer UMLS releases.
+    Every row also has the canonical form of its text (see variant_index), indexed,
+    so that the normalizations of the variants of a text are a query away."""
+
+
+def _canonical(text: str):
+    """Canonical form stored for a text, None if it has none."""
+    return canonicalize(text) or None if isinstance(text, str) else None
+
+
+class NormalizationCache:
+    def __init__(self, path: str = NORMALIZATION_CACHE["path"],
+                 cache_size: int = 10000,
+                 negative_ttl: float = NORMALIZATION_CACHE["negative_ttl"]):
+        """Parameters:
+            path = sqlite file of the cache, created if missing.
+            cache_size = max number of entries kept in memory.
+            negative_ttl = seconds after which a result without CUI is considered missing."""
+        self.path = path
+        self.cache_size = cache_size
+        self.negative_ttl = negative_ttl
+
+        # cache key -> (result, expiry time or None)
+        self._lru = OrderedDict()
+        # one connection shared by the normalizer threads of this process
+        self._lock = threading.Lock()
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS normalizations (
+                key TEXT PRIMARY KEY,
+                text TEXT,
+                result TEXT NOT NULL,
+                negative INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                canonical TEXT
+            )""")
+        if "canonical" not in {column[1] for column in self._conn.execute("PRAGMA table_info(normalizations)")}:
+            self._add_canonical_column()
+        # only the positive results are ever looked up by canonical form
+        self._conn.execute("CREATE INDEX IF NOT EXISTS normalizations_canonical "
+                           "ON normalizations (canonical) WHERE negative = 0")
+        logging.info(f"NormalizationCache: Opened {path}.")
+
+    def _add_canonical_column(self, batch_size: int = 10000):
+        """Add the canonical column to a cache created before it, filled from the texts."""
+        logging.info(f"NormalizationCache: Adding The Canonical Forms To {self.path}...")
+        self._conn.execute("BEGIN IMMEDIATE")
+        if "canonical" in {column[1] for column in self._conn.execute("PRAGMA table_info(normalizations)")}:
+            #added by another process in the meantime
+            self._conn.execute("COMMIT")
+            return
+        self._conn.execute("ALTER TABLE normalizations ADD COLUMN canonical TEXT")
+        rows = self._conn.execute("SELECT key, text FROM normalizations WHERE text IS NOT NULL")
+        while True:
+            batch = rows.fetchmany(batch_size)
+            if not batch:
+                break
+            self._conn.executemany("UPDATE normalizations SET canonical = ? WHERE key = ?",
+                                   [(_canonical(text), key) for key, text in batch])
+        self._conn.execute("COMMIT")
+
+    @staticmethod
+    def _is_negative(result: dict) -> bool:
+        return not result.get("cui")
+
+    def _expiry(self, negative: bool, updated_at: float):
+        return updated_at + self.negative_ttl if negative else None
+
+    def _remember(self, key: str, result: dict, expires_at):
+        self._lru[key] = (result, expires_at)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.cache_size:
+            self._lru.popitem(last=False)
+
+    def get(self, key: str, text: str = None):
+        """Return the cached result for key, None if missing or expired.
+        text = text of key, stored if the row doesn't have it (rows imported from
+        the pickled cache only have their key)."""
+        with self._lock:
+            if key in self._lru:
+                result, expires_at = self._lru[key]
+                if expires_at is None or expires_at > time.time():
+                    self._lru.move_to_end(key)
+                    return result
+                del self._lru[key]
+                return None
+
+            row = self._conn.execute(
+                "SELECT result, negative, updated_at, text FROM normalizations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            result, negative, updated_at = json.loads(row[0]), bool(row[1]), row[2]
+            if row[3] is None and text is not None:
+                self._conn.execute("UPDATE normalizations SET text = ?, canonical = ? WHERE key = ?",
+                                   (text, _canonical(text), key))
+            expires_at = self._expiry(negative, updated_at)
+            if expires_at is not None and expires_at <= time.time():
+                return None
+            self._remember(key, result, expires_at)
+            return result
+
+    def set(self, key: str, text: str, result: dict):
+        """Store the result for key right away (one autocommitted row)."""
+        negative = self._is_negative(result)
+        updated_at = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO normalizations (key, text, result, negative, updated_at, canonical) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, text, json.dumps(result), int(negative), updated_at, _canonical(text)))
+            self._remember(key, result, self._expiry(negative, updated_at))
+
+    def __contains__(self, key: str):
+        return self.get(key) is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM normalizations").fetchone()[0]
+
+    def with_canonical(self, canonical: str) -> list[dict]:
+        """Results with a CUI of the texts of that canonical form."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT result FROM normalizations WHERE canonical = ? AND negative = 0", (canonical,)
+            ).fetchall()
+        return [json.loads(result) for result, in rows]
+
+    def import_pickle(self, pickle_path: str = NORMALIZATION_CACHE["legacy_pickle"]) -> int:
+        """One time import of the old pickled {key: result} cache, existing keys win."""
+        try:
+            with open(pickle_path, "rb") as f:
+                legacy = pickle.load(f)
+        except FileNotFoundError:
+            return 0
+
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO normalizations (key, text, result, negative, updated_at) VALUES (?, NULL, ?, ?, ?)",
+                    ((key, json.dumps(result), int(self._is_negative(result)), now) for key, result in legacy.items()))
+        logging.info(f"NormalizationCache: Imported {len(legacy)} Entries From {pickle_path}.")
+        return len(legacy)
+
+    def sync(self):
+        """Move the WAL content into the database file (what isn't in use by a reader)."""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
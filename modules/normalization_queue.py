@@ -0,0 +1,163 @@
+import logging
+import threading
+import time
+
+from collections import Counter
+from itertools import islice
+
+from modules.umls_api import UMLSNormalizer
+from modules.normalization_cache import NormalizationCache
+from modules.variant_index import VariantIndex
+from config.nlp_config import NORMALIZATION_QUEUE
+
+"""Normalization runs as its own stage, next to annotation instead of inside it.
+    Annotation submits the new entity texts and moves on, the entity rows only
+    carry the normalization key of their text. A background thread collects the
+    submitted texts of all the articles, drops the ones already cached or already
+    queued, and resolves them with the normalizer in large batches, the results
+    go to the normalization cache. The rows are joined with their normalization
+    when they are flushed, waiting only for the keys that are still pending.
+    Texts that are a variant of a known one (see VariantIndex) are resolved on
+    submit, they never reach the normalizer."""
+
+
+class NormalizationQueue:
+    def __init__(self, normalizer: UMLSNormalizer, cache: NormalizationCache,
+                 variants: VariantIndex = None,
+                 batch_size: int = NORMALIZATION_QUEUE["batch_size"],
+                 max_wait: float = NORMALIZATION_QUEUE["max_wait"]):
+        """Parameters:
+            normalizer = anything with normalize_many(texts) -> {text: result}.
+            cache = where the results are stored, and looked up before queueing.
+            variants = known variants, looked up after the cache, None to disable.
+            batch_size = max number of texts sent to the normalizer at once.
+            max_wait = seconds a batch may wait to fill up, unless someone waits on it."""
+        self.normalizer = normalizer
+        self.cache = cache
+        self.variants = variants
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+
+        #key -> text, submitted and not picked by the worker yet
+        self._waiting = {}
+        #keys submitted and not resolved yet (waiting or being normalized)
+        self._pending = set()
+        #number of threads blocked in wait(), the worker doesn't let batches fill up meanwhile
+        self._waiters = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        #submitted texts by outcome: cached, variant, queued (or already pending)
+        self.counters = Counter()
+
+        self._thread = threading.Thread(target=self._run, name="normalization-queue", daemon=True)
+        self._thread.start()
+        logging.info("NormalizationQueue: Started.")
+
+    def __len__(self):
+        """Number of keys not resolved yet."""
+        with self._cond:
+            return len(self._pending)
+
+    def submit(self, key: str, text: str):
+        """Queue a text for normalization, unless it is cached, already queued
+        or a variant of a known text."""
+        self.counters["submitted"] += 1
+        with self._cond:
+            if key in self._pending:
+                self.counters["pending"] += 1
+                return
+        if self.cache.get(key, text) is not None:
+            self.counters["cached"] += 1
+            return
+        if self.variants is not None:
+            normalization = self.variants.lookup(text)
+            if normalization is not None:
+                self.cache.set(key, text, normalization)
+                self.counters["variant"] += 1
+                return
+        with self._cond:
+            if key in self._pending or self._closed:
+                self.counters["pending"] += 1
+                return
+            self.counters["queued"] += 1
+            self._waiting[key] = text
+            self._pending.add(key)
+            self._cond.notify_all()
+
+    def wait(self, keys=None):
+        """Block until the given keys (all the queued ones if None) are resolved."""
+        with self._cond:
+            self._waiters += 1
+            self._cond.notify_all()
+            try:
+                while self._pending if keys is None else self._pending.intersection(keys):
+                    if not self._thread.is_alive():
+                        logging.error("NormalizationQueue: Worker Stopped, Giving Up On Pending Keys.")
+                        break
+                    self._cond.wait(timeout=1)
+            finally:
+                self._waiters -= 1
+
+    def stats(self) -> dict:
+        """Submitted texts by outcome, hit_rate = share resolved without the normalizer."""
+        submitted = self.counters["submitted"]
+        hits = self.counters["cached"] + self.counters["variant"]
+        return {**self.counters, "hit_rate": round(hits / submitted, 4) if submitted else 0.0}
+
+    def results(self, keys) -> dict:
+        """key -> cached normalization, None for keys without any (failed or never queued)."""
+        return {key: self.cache.get(key) for key in keys}
+
+    def _next_batch(self) -> dict:
+        """Wait for a batch to send, an empty dict means the queue is closed and drained."""
+        with self._cond:
+            while not self._waiting and not self._closed:
+                self._cond.wait()
+
+            deadline = time.monotonic() + self.max_wait
+            while len(self._waiting) < self.batch_size and not self._waiters and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = dict(islice(self._waiting.items(), self.batch_size))
+            for key in batch:
+                del self._waiting[key]
+            return batch
+
+    def _resolve(self, batch: dict):
+        texts = list(batch.values())
+        try:
+            normalized = self.normalizer.normalize_many(texts)
+        except Exception as e:
+            logging.error(f"NormalizationQueue: Batch Of {len(texts)} Failed: {e}")
+            normalized = {}
+
+        for key, text in batch.items():
+            if text in normalized:
+                #the cached text is a known variant from now on (see VariantIndex)
+                self.cache.set(key, text, normalized[text])
+        logging.info(f"NormalizationQueue: Resolved {len(normalized)}/{len(texts)} Texts.")
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            try:
+                self._resolve(batch)
+            finally:
+                with self._cond:
+                    self._pending.difference_update(batch)
+                    self._cond.notify_all()
+
+    def close(self):
+        """Resolve what is queued and stop the worker."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        if self.variants is not None:
+            logging.info(f"NormalizationQueue: Variant Index: {self.variants.stats()}")
+        logging.info("NormalizationQueue: Stopped.")
@@ -0,0 +1,154 @@
+import logging
+import json
+import threading
+import time
+
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from spacy.language import Language
+from spacy.tokens import Doc
+
+from config.nlp_config import PROFILER
+
+"""Where does the annotation time go? The profiler times named stages (wall time,
+    and CPU time of the calling thread), counts things (articles, docs, tokens,
+    entities, relations...) and writes it all as a JSON report at the end of a run.
+    Stages of the annotator:
+        pipeline.<component> = each spaCy component (tokenizer, ner, merge_entities...),
+            the pipeline is run component by component, as Language.__call__ does
+        relation_candidates, matcher, dependency_matcher = relation extraction
+        normalization_wait = time spent waiting for the normalization queue
+        write = writing rows to the outputs
+    LatencyHistogram keeps the latencies of the UMLS API calls in fixed buckets."""
+
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class LatencyHistogram:
+    def __init__(self, buckets_ms: tuple = LATENCY_BUCKETS_MS):
+        """Parameters:
+            buckets_ms = upper bounds of the buckets in ms, sorted, one more bucket above the last."""
+        self.buckets_ms = buckets_ms
+        self.counts = [0] * (len(buckets_ms) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        #recorded from the normalizer threads
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        ms = seconds * 1000
+        with self._lock:
+            self.counts[bisect_left(self.buckets_ms, ms)] += 1
+            self.count += 1
+            self.total += ms
+            self.max = max(self.max, ms)
+
+    def quantile(self, q: float):
+        """Upper bound (ms) of the bucket holding the q quantile, max for the last bucket."""
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return self.buckets_ms[i] if i < len(self.buckets_ms) else round(self.max, 1)
+        return round(self.max, 1)
+
+    def to_dict(self) -> dict:
+        labels = [f"<={bound}ms" for bound in self.buckets_ms] + [f">{self.buckets_ms[-1]}ms"]
+        return {"count": self.count,
+                "mean_ms": round(self.total / self.count, 1) if self.count else None,
+                "max_ms": round(self.max, 1),
+                "p50_ms": self.quantile(0.5),
+                "p95_ms": self.quantile(0.95),
+                "p99_ms": self.quantile(0.99),
+                "buckets": {label: count for label, count in zip(labels, self.counts) if count}}
+
+
+class Profiler:
+    def __init__(self, enabled: bool = PROFILER["enabled"], log_every: int = PROFILER["log_every"]):
+        """Parameters:
+            enabled = False makes every method a no-op (and the pipeline run as one call).
+            log_every = log a progress line every log_every articles, None or 0 to never log."""
+        self.enabled = enabled
+        self.log_every = log_every
+        #stage -> [calls, wall seconds, cpu seconds]
+        self.stages = {}
+        self.counters = Counter()
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time the block under the name of a stage."""
+        if not self.enabled:
+            yield
+            return
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            timing = self.stages.setdefault(name, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += time.perf_counter() - wall
+            timing[2] += time.thread_time() - cpu
+
+    def count(self, name: str, n: int = 1):
+        if self.enabled:
+            self.counters[name] += n
+
+    def run_pipeline(self, nlp_pipe: Language, text: str) -> Doc:
+        """nlp_pipe(text), with the tokenizer and every component timed."""
+        if not self.enabled:
+            return nlp_pipe(text)
+        with self.stage("pipeline.tokenizer"):
+            doc = nlp_pipe.make_doc(text)
+        for name, component in nlp_pipe.pipeline:
+            with self.stage(f"pipeline.{name}"):
+                doc = component(doc)
+        self.counters["docs_parsed"] += 1
+        self.counters["tokens"] += len(doc)
+        return doc
+
+    def article_done(self):
+        """Count an article, and log the progress every log_every articles."""
+        if not self.enabled:
+            return
+        self.counters["articles"] += 1
+        if self.log_every and self.counters["articles"] % self.log_every == 0:
+            report = self.report()
+            top = ", ".join(f"{name} {timing['wall_share']:.0%}" for name, timing in list(report["stages"].items())[:3])
+            logging.info(f"Profiler: {report['articles']} Articles, {report['articles_per_s']} Articles/s, "
+                         f"{report['tokens_per_s']} Tokens/s, Top Stages: {top}.")
+
+    def report(self, **extra) -> dict:
+        """Timings and throughput so far, extra = more sections of the report."""
+        elapsed = time.perf_counter() - self._wall_start
+        articles, parsed = self.counters["articles"], self.counters["docs_parsed"]
+        staged = sum(wall for _, wall, _ in self.stages.values()) or 1
+        stages = {name: {"calls": calls, "wall_s": round(wall, 4), "cpu_s": round(cpu, 4),
+                         "wall_share": round(wall / staged, 4)}
+                  for name, (calls, wall, cpu) in sorted(self.stages.items(), key=lambda item: -item[1][1])}
+        return {"elapsed_s": round(elapsed, 3),
+                "cpu_s": round(time.process_time() - self._cpu_start, 3),
+                "articles": articles,
+                "articles_per_s": round(articles / elapsed, 2) if elapsed else None,
+                "docs_per_s": round(parsed / elapsed, 2) if elapsed else None,
+                "tokens_per_s": round(self.counters["tokens"] / elapsed, 1) if elapsed else None,
+                "entities_per_article": round(self.counters["entities"] / articles, 2) if articles else None,
+                "relations_per_article": round(self.counters["relations"] / articles, 2) if articles else None,
+                "counters": dict(self.counters),
+                "stages": stages,
+                **extra}
+
+    def write(self, path: str, **extra):
+        """Write the report as JSON."""
+        if not self.enabled:
+            return
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(**extra), f, indent=2)
+        logging.info(f"Profiler: Report Written To {path}.")
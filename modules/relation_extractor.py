@@ -0,0 +1,241 @@
+import logging
+
+from bisect import bisect_left
+from spacy.tokens import Doc
+from spacy.vocab import Vocab
+from spacy.matcher import Matcher, DependencyMatcher
+
+from modules.relation_index import RelationPatternIndex
+from modules.key_set import make_key_set
+from modules.writers import make_writer
+from modules.profiler import Profiler
+from config.nlp_config import MATCHER_PATTERNS, DEPENDENCY_MATCHER_PATTERNS
+from config.nlp_config import RELATION_MAX_WINDOW, RELATION_COLUMNS, OUTPUT
+
+"""Relation extraction on its own: the relation patterns, their matchers and the
+    relations output, built from a vocab only. The annotator uses it for the relations
+    of the docs it parses, and the relations only re-run over the parsed docs uses it
+    alone, without NER model, normalizer, normalization cache nor curated terms."""
+
+
+class RelationExtractor:
+    def __init__(self, vocab: Vocab,
+                 relations_output_path: str,
+                 buffer_size: int = 1000,
+                 max_window: int = RELATION_MAX_WINDOW,
+                 output_format: str = OUTPUT["format"],
+                 compression: str = OUTPUT["compression"],
+                 rotate_bytes: int = OUTPUT["rotate_bytes"],
+                 resume_outputs: list[str] = None,
+                 profiler: Profiler = None):
+        """Parameters:
+            vocab = vocab of the pipeline (or of the saved docs) the matchers run on.
+            relations_output_path = relations output, replaced except the resume_outputs files.
+            buffer_size = number of relations buffered before they are written.
+            max_window = max number of tokens of a token pattern match.
+            resume_outputs = complete relations files of a resumed run, kept."""
+        self.vocab = vocab
+        self.buffer_size = buffer_size
+        self.max_window = max_window
+        self.profiler = profiler if profiler is not None else Profiler()
+        self.relations_output_path = relations_output_path
+
+        # Triggers and entity label pairs compatibility table, used to skip sentences
+        # that can't hold a relation and to dispatch only the patterns that can
+        self.relation_index = RelationPatternIndex(MATCHER_PATTERNS, DEPENDENCY_MATCHER_PATTERNS)
+
+        # One matcher per compiled pattern (with model vocab), keyed by pattern id
+        self.matchers = {}
+        for pattern_id, compiled in enumerate(self.relation_index.patterns):
+            if compiled["kind"] == "token":
+                matcher = Matcher(vocab)
+            else:
+                matcher = DependencyMatcher(vocab)
+            matcher.add(compiled["relation"], [compiled["pattern"]])
+            self.matchers[pattern_id] = matcher
+
+        # Relation keys already written, as 64-bit hashes (see config DEDUP)
+        self._relation_cache = make_key_set("relation_keys")
+        self._relations_buffer = []
+        self._relations_writer = make_writer(relations_output_path, RELATION_COLUMNS, format=output_format,
+                                             compression=compression, rotate_bytes=rotate_bytes,
+                                             keep=resume_outputs)
+        self._closed = False
+
+    def _sentence_windows(self, sent):
+        """Split a sentence into spans of at most 2*max_window tokens overlapping by
+        max_window tokens, so any match of up to max_window tokens fits in one of them."""
+        if len(sent) <= 2 * self.max_window:
+            return [sent]
+        doc = sent.doc
+        return [doc[start:min(start + 2 * self.max_window, sent.end)]
+                for start in range(sent.start, sent.end - self.max_window, self.max_window)]
+
+    @staticmethod
+    def _entities_in_span(ents: tuple, ent_starts: list[int], start: int, end: int) -> list:
+        """Entities fully inside doc[start:end], ents must be sorted by start (doc.ents is).
+        Stops after 3 entities since only spans with exactly 2 make a relation."""
+        found = []
+        i = bisect_left(ent_starts, start)
+        while i < len(ents) and ents[i].start < end and len(found) <= 2:
+            if ents[i].end <= end:
+                found.append(ents[i])
+            i += 1
+        return found
+
+    def extract_relations(self, doc: Doc, article_metadata: dict):
+        """Extract the relations of a parsed doc and buffer the new ones."""
+        self.add_relations(self.find_relations(doc), article_metadata)
+        return self
+
+    def find_relations(self, doc: Doc) -> list[tuple]:
+        """(ent1, relation, ent2) of the pattern matches of a doc, in match order."""
+        # Only sentences with a trigger word and a compatible entity pair are matched,
+        # and only against the patterns they can possibly satisfy
+        candidates = []
+        with self.profiler.stage("relation_candidates"):
+            for sent in doc.sents:
+                pattern_ids = self.relation_index.candidate_patterns(sent)
+                if pattern_ids:
+                    candidates.append((sent, pattern_ids))
+
+        if not candidates:
+            logging.debug("NLP: No candidate sentences for relation matching")
+            return []
+
+        # Bounded windows keep the OP:* wildcards from exploding on long sentences
+        matches = set()
+        # (candidate sentence, its dependency pattern ids)
+        dep_candidates = []
+        with self.profiler.stage("matcher"):
+            for sent, pattern_ids in candidates:
+                token_patterns = [pattern_id for pattern_id in pattern_ids
+                                  if self.relation_index.patterns[pattern_id]["kind"] == "token"]
+                if len(token_patterns) < len(pattern_ids):
+                    dep_candidates.append((sent, pattern_ids.difference(token_patterns)))
+                if not token_patterns:
+                    continue
+                for window in self._sentence_windows(sent):
+                    for pattern_id in token_patterns:
+                        # matches over a span are relative to the span start
+                        matches.update((match_id, window.start + start, window.start + end)
+                                       for match_id, start, end in self.matchers[pattern_id](window)
+                                       if end - start <= self.max_window)
+        matches = sorted(matches, key=lambda match: (match[1], match[2]))
+
+        # Sorted entity starts, to find the entities of a match with a bisection
+        ents = doc.ents
+        ent_starts = [ent.start for ent in ents]
+
+        # dependency trees never cross sentences, the matchers only walk the trees of
+        # the candidate sentences, docs parsed without parser (see PIPELINE_PROFILES)
+        # have no tree to match
+        dep_matches = []
+        if not doc.has_annotation("DEP"):
+            dep_candidates = []
+        with self.profiler.stage("dependency_matcher"):
+            for sent, pattern_ids in dep_candidates:
+                for pattern_id in sorted(pattern_ids):
+                    # token ids of a match over a span are relative to the span start
+                    dep_matches.extend((match_id, [sent.start + token_id for token_id in token_ids])
+                                       for match_id, token_ids in self.matchers[pattern_id](sent))
+
+        relations = []
+
+        # Matcher-based relations
+        for match_id, start, end in matches:
+            entities_in_span = self._entities_in_span(ents, ent_starts, start, end)
+
+            if len(entities_in_span) == 2:
+                ent1, ent2 = entities_in_span
+                relation_label = self.vocab.strings[match_id]
+
+                if __name__ == "__main__":
+                    print(f"{ent1.lemma_} -[{relation_label}]-> {ent2.lemma_}\n*******")
+
+                relations.append((ent1.lemma_.strip().lower(), relation_label, ent2.lemma_.strip().lower()))
+
+        # Dependency-matcher-based relations
+        for match_id, token_ids in dep_matches:
+            relation_label = self.vocab.strings[match_id]
+            ent1 = doc[token_ids[0]]
+            ent2 = doc[token_ids[-1]]
+
+            if __name__ == "__main__":
+                print(f"{ent1.lemma_} -[{relation_label}]-> {ent2.lemma_}\n*******")
+
+            relations.append((ent1.lemma_.strip().lower(), relation_label, ent2.lemma_.strip().lower()))
+
+        return relations
+
+    def add_relations(self, relations: list[tuple], article_metadata: dict):
+        """Buffer the new (ent1, relation, ent2) relations of an article."""
+        if not relations:
+            return
+        self.profiler.count("relations", len(relations))
+
+        new_relations = []
+        for ent1, relation_label, ent2 in relations:
+            rel_dict = {
+                "ent1": ent1,
+                "relation": relation_label,
+                "ent2": ent2,
+                **article_metadata
+            }
+
+            relation_key = (
+                rel_dict["ent1"],
+                rel_dict["relation"],
+                rel_dict["ent2"],
+                rel_dict.get("pmid", ""),
+                rel_dict.get("pmcid", "")
+            )
+
+            if self._relation_cache.add(relation_key):
+                new_relations.append(rel_dict)
+
+        # Add to buffer instead of directly to relations list
+        self._relations_buffer.extend(new_relations)
+
+        # Flush buffer if it's full
+        self.flush()
+
+        logging.info(f"NLP: Added {len(new_relations)} new unique relations to buffer")
+
+    def flush(self, force: bool = False):
+        """Write the buffered relations when there are buffer_size of them or force=True."""
+        if (len(self._relations_buffer) >= self.buffer_size or force) and self._relations_buffer:
+            try:
+                with self.profiler.stage("write"):
+                    self._relations_writer.write_rows(self._relations_buffer)
+                logging.debug(f"NLP: Streamed {len(self._relations_buffer)} relations to {self._relations_writer.path}")
+            except Exception as e:
+                logging.error(f"NLP: Failed to stream relations: {e}")
+
+            self._relations_buffer.clear()
+
+    def commit_outputs(self) -> list[dict]:
+        """Write out the buffered relations and make them durable, return the
+        relations files with their committed size, for a checkpoint."""
+        self.flush(force=True)
+        return self._relations_writer.commit()
+
+    def get_info(self) -> dict:
+        return {"total_relations": self._relations_writer.rows_written + len(self._relations_buffer),
+                "unique_relations": len(self._relation_cache),
+                "relations_in_buffer": len(self._relations_buffer)}
+
+    def close(self):
+        """Flush the buffer and close the relations output."""
+        if getattr(self, '_closed', True):
+            return
+        self._closed = True
+        self.flush(force=True)
+        self._relations_writer.close()
+        self._relation_cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
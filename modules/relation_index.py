@@ -0,0 +1,123 @@
+from spacy.tokens import Span
+
+"""Almost every relation pattern in config/nlp_config needs a trigger word
+    ('produce', 'bind', 'part of'...) between two entities of given labels.
+    Instead of running every pattern over every sentence, the patterns are compiled
+    once at startup into:
+        - an index of trigger words (LEMMA and LOWER) per relation type,
+        - a compatibility table of the (ENTITY1, ENTITY2) label pairs each pattern accepts.
+    A pattern is only dispatched to the matchers for sentences that contain its trigger
+    and an entity pair it accepts.
+
+    The trigger of a pattern is its first token constrained by LEMMA or LOWER
+    (the content word, 'part' in 'part of'), for dependency patterns it is the
+    first node that is not an entity (the verb or the adjective)."""
+
+TRIGGER_ATTRS = ("LEMMA", "LOWER")
+
+
+def _attr_values(value) -> set[str]:
+    """{"LEMMA": "bind"} and {"LEMMA": {"IN": ["bind", "interact"]}} -> set of values."""
+    if isinstance(value, str):
+        return {value}
+    if isinstance(value, dict) and "IN" in value:
+        return set(value["IN"])
+    return set()
+
+
+def _token_trigger(token_attrs: dict):
+    """Return (attr, values) if the token is a trigger slot, None otherwise."""
+    if "ENT_TYPE" in token_attrs:
+        return None
+    for attr in TRIGGER_ATTRS:
+        if attr in token_attrs:
+            return attr, _attr_values(token_attrs[attr])
+    return None
+
+
+class RelationPatternIndex:
+    def __init__(self, matcher_patterns: dict, dependency_patterns: dict):
+        """Parameters:
+            matcher_patterns = MATCHER_PATTERNS, relation type -> token patterns.
+            dependency_patterns = DEPENDENCY_MATCHER_PATTERNS, relation type -> dependency patterns."""
+        # compiled patterns, the position in the list is the pattern id
+        self.patterns = []
+        # relation type -> {"LEMMA": set, "LOWER": set} of trigger words
+        self.triggers = {}
+        # relation type -> (ENTITY1, ENTITY2) label pairs it accepts
+        self.type_pairs = {}
+        # (ENTITY1, ENTITY2) -> ids of the patterns accepting that pair
+        self._patterns_by_pair = {}
+        # trigger word -> ids of the patterns it triggers, one index per attribute
+        self._patterns_by_trigger = {attr: {} for attr in TRIGGER_ATTRS}
+        # patterns without any trigger word can't be skipped on that basis
+        self._untriggered = set()
+
+        for relation, patterns in matcher_patterns.items():
+            for pattern in patterns:
+                self._compile(relation, "token", pattern, pattern)
+
+        for relation, patterns in dependency_patterns.items():
+            for pattern in patterns:
+                self._compile(relation, "dependency", pattern, [node["RIGHT_ATTRS"] for node in pattern])
+
+    def _compile(self, relation: str, kind: str, pattern: list, tokens_attrs: list[dict]):
+        pattern_id = len(self.patterns)
+        entity_slots = [_attr_values(attrs["ENT_TYPE"]) for attrs in tokens_attrs if "ENT_TYPE" in attrs]
+        trigger = next(filter(None, map(_token_trigger, tokens_attrs)), None)
+        self.patterns.append({"relation": relation, "kind": kind, "pattern": pattern})
+
+        triggers = self.triggers.setdefault(relation, {attr: set() for attr in TRIGGER_ATTRS})
+        if trigger:
+            attr, values = trigger
+            triggers[attr].update(values)
+            for value in values:
+                self._patterns_by_trigger[attr].setdefault(value, set()).add(pattern_id)
+        else:
+            self._untriggered.add(pattern_id)
+
+        # the first entity slot is the head of the relation, the last one its tail
+        pairs = {(head, tail) for head in entity_slots[0] for tail in entity_slots[-1]} if entity_slots else set()
+        self.type_pairs.setdefault(relation, set()).update(pairs)
+        for pair in pairs:
+            self._patterns_by_pair.setdefault(pair, set()).add(pattern_id)
+
+    @staticmethod
+    def _label_pairs(ents) -> set[tuple]:
+        """(label1, label2) pairs that two distinct entities of the sentence can form."""
+        counts = {}
+        for ent in ents:
+            counts[ent.label_] = counts.get(ent.label_, 0) + 1
+        return {(label1, label2) for label1 in counts for label2 in counts
+                if label1 != label2 or counts[label1] >= 2}
+
+    def _triggered_patterns(self, sent: Span) -> set[int]:
+        """Ids of the patterns having their trigger word in the sentence."""
+        by_lemma = self._patterns_by_trigger["LEMMA"]
+        by_lower = self._patterns_by_trigger["LOWER"]
+        pattern_ids = set(self._untriggered)
+        for token in sent:
+            if token.lemma_ in by_lemma:
+                pattern_ids |= by_lemma[token.lemma_]
+            if token.lower_ in by_lower:
+                pattern_ids |= by_lower[token.lower_]
+        return pattern_ids
+
+    def candidate_patterns(self, sent: Span) -> set[int]:
+        """Ids of the patterns worth matching in the sentence: the entity labels of
+        the sentence form a pair the pattern accepts, and its trigger is present."""
+        ents = sent.ents
+        if len(ents) < 2:
+            return set()
+
+        compatible = set()
+        for pair in self._label_pairs(ents):
+            compatible |= self._patterns_by_pair.get(pair, set())
+        if not compatible:
+            return set()
+
+        return compatible & self._triggered_patterns(sent)
+
+    def candidate_relations(self, sent: Span) -> set[str]:
+        """Relation types that can possibly be found in the sentence."""
+        return {self.patterns[pattern_id]["relation"] for pattern_id in self.candidate_patterns(sent)}
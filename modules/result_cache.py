@@ -0,0 +1,121 @@
+import sqlite3
+import logging
+import hashlib
+import json
+import zlib
+import threading
+
+from pathlib import Path
+from spacy.language import Language
+
+from modules.doc_cache import model_key
+from config.nlp_config import RESULT_CACHE, MATCHER_PATTERNS, DEPENDENCY_MATCHER_PATTERNS
+from config.nlp_config import GENERIC_ENTITIES, RELATION_MAX_WINDOW
+
+"""Most articles of a run were already annotated by a previous one, with the same
+    model and the same patterns. Their extracted entities and relations are cached
+    in SQLite (WAL mode, like the normalization cache), one row per article text:
+        key = hash of (model name and version, hash of the pattern config, text)
+        rows = zlib compressed json of the entities [lemma, label] and relations
+               [ent1, relation, ent2] of the text, without article metadata
+        version = hash of the model and the pattern config the rows were extracted with
+    Changing the model or the patterns changes every key, the old rows are never read
+    again and prune() removes them. A cached article costs a hash and a lookup instead
+    of a NLP pass."""
+
+
+def cache_model(nlp_pipe: Language) -> str:
+    """Model of the cache for a pipeline: its model key and its components (another
+    profile may find other entities)."""
+    return f"{model_key(nlp_pipe)}:{','.join(nlp_pipe.pipe_names)}"
+
+
+def patterns_hash() -> str:
+    """Hash of everything besides the model that the extracted rows depend on."""
+    config = {"matcher": MATCHER_PATTERNS,
+              "dependency_matcher": DEPENDENCY_MATCHER_PATTERNS,
+              "max_window": RELATION_MAX_WINDOW,
+              "generic_entities": sorted(GENERIC_ENTITIES)}
+    return hashlib.blake2b(json.dumps(config, sort_keys=True).encode("utf-8"), digest_size=16).hexdigest()
+
+
+class AnnotationResultCache:
+    def __init__(self, model: str, path: str = RESULT_CACHE["path"]):
+        """Parameters:
+            model = model key of the parsing pipeline (see doc_cache.model_key).
+            path = sqlite file of the cache, created if missing."""
+        self.model = model
+        self.path = path
+        self._prefix = f"{model}\x1f{patterns_hash()}\x1f".encode("utf-8")
+        self.version = hashlib.blake2b(self._prefix, digest_size=8).hexdigest()
+        self.lookups = 0
+        self.hits = 0
+
+        self._lock = threading.Lock()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                key BLOB PRIMARY KEY,
+                rows BLOB NOT NULL,
+                version TEXT
+            )""")
+        if "version" not in {column[1] for column in self._conn.execute("PRAGMA table_info(results)")}:
+            #the rows written before it have no version, prune removes them
+            try:
+                self._conn.execute("ALTER TABLE results ADD COLUMN version TEXT")
+            except sqlite3.OperationalError:
+                #added by another process in the meantime
+                pass
+        logging.info(f"ResultCache: Opened {path}.")
+
+    def key(self, text: str) -> bytes:
+        """Cache key of an article text, for the model and the patterns of this cache."""
+        return hashlib.blake2b(self._prefix + text.encode("utf-8"), digest_size=16).digest()
+
+    def get(self, key: bytes):
+        """(entities, relations) cached for key, as lists of tuples, None if missing."""
+        self.lookups += 1
+        with self._lock:
+            row = self._conn.execute("SELECT rows FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self.hits += 1
+        entities, relations = json.loads(zlib.decompress(row[0]))
+        return [tuple(entity) for entity in entities], [tuple(relation) for relation in relations]
+
+    def set(self, key: bytes, entities: list[tuple], relations: list[tuple]):
+        """Store the entities and relations extracted for key."""
+        rows = zlib.compress(json.dumps([entities, relations], separators=(",", ":")).encode("utf-8"))
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO results (key, rows, version) VALUES (?, ?, ?)",
+                               (key, rows, self.version))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def prune(self) -> int:
+        """Remove the rows of other models or patterns (never read by this cache), return
+        their number. The file only shrinks once vacuumed, the space is reused meanwhile."""
+        with self._lock:
+            removed = self._conn.execute("DELETE FROM results WHERE version IS NOT ?", (self.version,)).rowcount
+        logging.info(f"ResultCache: Pruned {removed} Rows Of Other Models Or Patterns.")
+        return removed
+
+    def stats(self) -> dict:
+        hit_rate = self.hits / self.lookups if self.lookups else 0.0
+        return {"lookups": self.lookups, "hits": self.hits, "hit_rate": round(hit_rate, 4)}
+
+    def sync(self):
+        """Move the WAL content into the database file (what isn't in use by a reader)."""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
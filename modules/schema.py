@@ -0,0 +1,59 @@
+import pandas as pd
+
+from config.nlp_config import ENTITY_COLUMNS, RELATION_COLUMNS
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+"""Dtypes of the files passed between the stages: the raw annotation outputs (annotate ->
+    clean) and the cleaned entities and relations (clean -> load, and annotate, which
+    reads the known entities back). Read with the default dtypes, every value is a
+    python object, and pandas guesses the type of every column, chunk by chunk.
+        - text columns are pandas strings, backed by pyarrow when it is installed
+          (one contiguous buffer per column instead of a python str per value)
+        - low cardinality columns (labels, relation types, normalization sources)
+          are categoricals: one small int per row and each value stored once
+        - fetching_date is parsed once, as ISO 8601, when the file is read
+    A schema is a dict column -> dtype, columns missing from a file are ignored."""
+
+STRING = pd.StringDtype("pyarrow") if pyarrow is not None else pd.StringDtype("python")
+CATEGORY = "category"
+DATE = "datetime64[ns]"
+
+_RAW_TYPES = {"label": CATEGORY, "relation": CATEGORY, "normalization_source": CATEGORY, "fetching_date": DATE}
+RAW_ENTITIES = {column: _RAW_TYPES.get(column, STRING) for column in ENTITY_COLUMNS}
+RAW_RELATIONS = {column: _RAW_TYPES.get(column, STRING) for column in RELATION_COLUMNS}
+
+NEO4J_ENTITIES = {":ID": STRING, "name": STRING, ":LABEL": CATEGORY, "pmid": STRING, "pmcid": STRING,
+                  "fetching_date": DATE, "cui": STRING, "normalized_name": STRING,
+                  "normalization_source": CATEGORY, "url": STRING}
+NEO4J_RELATIONS = {":START_ID": STRING, ":END_ID": STRING, ":TYPE": CATEGORY, "evidence_count": "int64",
+                   "pmids": STRING}
+
+
+def read_kwargs(schema: dict) -> dict:
+    """pd.read_csv arguments reading the columns of schema with their dtypes (dates as strings,
+    see parse_dates)."""
+    return {"dtype": {column: STRING if dtype == DATE else dtype for column, dtype in schema.items()}}
+
+
+def parse_dates(frame: pd.DataFrame, schema: dict) -> pd.DataFrame:
+    """Parse the date columns of schema, values that aren't ISO 8601 dates become NaT."""
+    for column, dtype in schema.items():
+        if dtype == DATE and column in frame.columns and not pd.api.types.is_datetime64_any_dtype(frame[column]):
+            frame[column] = pd.to_datetime(frame[column], format="ISO8601", errors="coerce")
+    return frame
+
+
+def apply_schema(frame: pd.DataFrame, schema: dict) -> pd.DataFrame:
+    """frame with the dtypes of schema, for frames not read by read_csv (parquet, sqlite...)."""
+    dtypes = read_kwargs(schema)["dtype"]
+    frame = frame.astype({column: dtype for column, dtype in dtypes.items() if column in frame.columns})
+    return parse_dates(frame, schema)
+
+
+def read_csv(path: str, schema: dict, **read_csv_kwargs) -> pd.DataFrame:
+    """pd.read_csv with the dtypes of schema."""
+    return parse_dates(pd.read_csv(path, **read_kwargs(schema), **read_csv_kwargs), schema)
@@ -0,0 +1,95 @@
+import pandas as pd
+import logging
+
+from spacy.language import Language
+from spacy.matcher import PhraseMatcher
+from spacy.util import filter_spans
+
+from modules.schema import NEO4J_ENTITIES, read_csv
+
+from config.nlp_config import GENERIC_ENTITIES
+
+"""MeSH headings and author keywords are curated by humans, each one is already
+    a complete entity name, so there is no point in asking the NER model to find
+    entities in them again. Instead, every term is tokenized on its own (no tagger,
+    parser or ner) and looked up in a PhraseMatcher built over the entity names
+    we already know, which gives us the label and the CUI directly."""
+
+NORMALIZATION_FIELDS = ["cui", "normalized_name", "normalization_source", "url"]
+
+
+class CuratedTermMatcher:
+    def __init__(self, nlp: Language, known_entities_path: str = None):
+        """Parameters:
+            nlp = the spacy pipeline, only its tokenizer (make_doc) is used.
+            known_entities_path = cleaned entities csv used to seed the dictionary."""
+        self.nlp = nlp
+        self.matcher = PhraseMatcher(nlp.vocab, attr="LOWER")
+        #lowercased name -> {"text", "label", and normalization fields if any}
+        self._entries = {}
+
+        if known_entities_path:
+            self.load_known_entities(known_entities_path)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, name: str):
+        return name.strip().lower() in self._entries
+
+    def add(self, name: str, label: str, normalization: dict = None):
+        """Add a known entity to the dictionary. Existing names are left untouched,
+        except that a missing CUI is filled in once we get one."""
+        key = name.strip().lower()
+        if not key or key in GENERIC_ENTITIES or not isinstance(label, str):
+            return
+
+        fields = {k: v for k, v in (normalization or {}).items()
+                  if k in NORMALIZATION_FIELDS and isinstance(v, str) and v}
+
+        entry = self._entries.get(key)
+        if entry is None:
+            self._entries[key] = {"text": key, "label": label, **fields}
+            self.matcher.add(key, [self.nlp.make_doc(key)])
+        elif fields.get("cui") and not entry.get("cui"):
+            entry.update(fields)
+
+    def load_known_entities(self, path: str):
+        """Seed the dictionary from the cleaned entities csv (name, :LABEL, cui...)."""
+        try:
+            known = read_csv(path, NEO4J_ENTITIES, usecols=lambda col: col in ["name", ":LABEL", *NORMALIZATION_FIELDS])
+        except FileNotFoundError:
+            logging.info(f"TermMatcher: No Known Entities At {path}, Starting With An Empty Dictionary.")
+            return
+        except (ValueError, pd.errors.EmptyDataError) as e:
+            logging.error(f"TermMatcher: Unable To Read Known Entities From {path}: {e}")
+            return
+
+        if "name" not in known.columns or ":LABEL" not in known.columns:
+            logging.error(f"TermMatcher: {path} Must Contain 'name' And ':LABEL' Columns.")
+            return
+
+        for row in known.to_dict("records"):
+            name, label = row.pop("name"), row.pop(":LABEL")
+            if isinstance(name, str):
+                self.add(name, label, normalization=row)
+        logging.info(f"TermMatcher: Loaded {len(self._entries)} Known Entities From {path}.")
+
+    def match(self, terms: list[str]) -> list[dict]:
+        """Return one entity dict per known entity found in the curated terms.
+        Every term is matched on its own, so no match can span two terms."""
+        found = []
+        unmatched = 0
+        for term in terms:
+            if not isinstance(term, str) or not term.strip():
+                continue
+            doc = self.nlp.make_doc(term)
+            #keep the longest non overlapping matches, 'breast cancer' over 'cancer'
+            spans = filter_spans(self.matcher(doc, as_spans=True))
+            if not spans:
+                unmatched += 1
+            for span in spans:
+                found.append(dict(self._entries[span.label_]))
+
+        logging.debug(f"TermMatcher: {len(found)} Entities Found, {unmatched} Terms Unmatched.")
+        return found
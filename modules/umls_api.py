@@ -1,44 +1,90 @@
 import requests as rq
 
+import asyncio
 import logging
-import time 
+import threading
+import time
 
-from config.apis_config import UMLS_API_SLEEP_TIME
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+from modules.profiler import LatencyHistogram
+from config.apis_config import UMLS_REQUESTS_PER_SECOND, UMLS_MAX_IN_FLIGHT
 from config.secrets import UMLS_API_KEY
 
 
+"""Normalization used to sleep 0.06s inside each call while holding its thread, so
+    it ran well below the 20req/s quota. Now every request goes through one shared
+    connection pool and one rate limiter that only spaces out the *starts* of the
+    requests: up to max_in_flight requests are pending at once and the quota is the
+    only limit. Concurrent lookups of the same string share a single pending future.
+    The HTTP calls themselves are blocking (requests), they run in a thread pool
+    owned by the normalizer and are awaited from asyncio."""
+
+
+class RateLimiter:
+    def __init__(self, requests_per_second: float):
+        """Hands out request slots at most requests_per_second times per second,
+        shared by every coroutine (and thread) using this normalizer."""
+        self.interval = 1 / requests_per_second
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Reserve the next slot, return how long to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+            return slot - now
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
 
 
 class UMLSNormalizer:
-    def __init__(self):
+    def __init__(self, requests_per_second: float = UMLS_REQUESTS_PER_SECOND,
+                 max_in_flight: int = UMLS_MAX_IN_FLIGHT):
         self.key = UMLS_API_KEY
         self.base_url = "https://uts-ws.nlm.nih.gov/rest"
-        logging.info("Normalizer: Initialized.")
+        self.max_in_flight = max_in_flight
 
+        #one connection pool for all requests, sized for the requests in flight
+        self.session = rq.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight))
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="umls")
+        self._rate_limiter = RateLimiter(requests_per_second)
+        #string -> pending future, so concurrent lookups of a string make one request
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        #latencies of the requests, for the annotation profile
+        self.latency = LatencyHistogram()
+        logging.info("Normalizer: Initialized.")
 
 
-    def normalize(self, string: str):
+    def _search(self, string: str):
+        """Blocking call to the UMLS search endpoint, returns the best match or {}."""
         search_url = f"{self.base_url}/search/current"
         params = {
             "apiKey" : self.key,
         #I don't lower because that might affect the search, especially for drugs and mutations
-            "string" : string.strip() 
+            "string" : string
                   }
-        
-        
-        response = rq.get(search_url, params= params)
+
+        started = time.perf_counter()
+        response = self.session.get(search_url, params= params)
+        self.latency.record(time.perf_counter() - started)
         status_code = response.status_code
-        #waiting 0.06 between calls. 
-        logging.info(f"Normalizer: UMLS API: Sleeping For {UMLS_API_SLEEP_TIME}s.")
-        time.sleep(UMLS_API_SLEEP_TIME)
 
-        if status_code == 200: 
+        if status_code == 200:
             logging.info("Normalizer: UMLS API: Response OK.")
             json_output = response.json()
             results = json_output['result']['results']
             #return None if results = [] or no CUI for the term (CUI is a universal id)
             if not results or results[0][ "ui"] == "NONE":
-                
+
                 return {}
             else:
                 best_match : dict = results[0]
@@ -48,17 +94,81 @@ class UMLSNormalizer:
                 best_match['normalization_source'] = best_match.pop('rootSource')
                 best_match['url'] = best_match.pop('uri')
                 return best_match
-        else: 
+        else:
             logging.error(f"Normalizer: UMLS API: Response Not OK: {status_code}.")
             return {}
 
 
+    async def anormalize(self, string: str):
+        """Normalize a string, waiting for a request slot. If the same string is
+        already being looked up, wait for that request instead of sending another."""
+        string = string.strip()
+        loop = asyncio.get_running_loop()
+        pending = self._in_flight.get(string)
+        while pending is not None and pending.get_loop() is loop:
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                #the lookup that sent the request was cancelled, not this one: look again
+                if not pending.cancelled():
+                    raise
+            pending = self._in_flight.get(string)
+
+        future = loop.create_future()
+        self._in_flight[string] = future
+        try:
+            await self._rate_limiter.acquire()
+            result = await loop.run_in_executor(self._executor, self._search, string)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            #releases the waiters, they send the request themselves
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            #the waiters get it, don't warn about an exception nobody retrieved
+            future.exception()
+            raise
+        finally:
+            #the sync entry points run one event loop per call: a lookup on another
+            #loop (thread) may have taken the entry over, it is its own to remove
+            with self._in_flight_lock:
+                if self._in_flight.get(string) is future:
+                    del self._in_flight[string]
+
+
+    async def anormalize_many(self, strings: list[str]) -> dict[str, dict]:
+        """Normalize all strings concurrently, at the quota rate.
+        Strings whose lookup failed are left out of the returned dict."""
+        results = await asyncio.gather(*(self.anormalize(string) for string in strings),
+                                       return_exceptions=True)
+        normalized = {}
+        for string, result in zip(strings, results):
+            if isinstance(result, Exception):
+                logging.error(f"Normalizer: UMLS API: Failed To Normalize '{string}': {result}")
+            else:
+                normalized[string] = result
+        return normalized
+
+
+    def normalize_many(self, strings: list[str]) -> dict[str, dict]:
+        """Synchronous entry point for a batch of strings."""
+        if not strings:
+            return {}
+        return asyncio.run(self.anormalize_many(strings))
+
+
+    def normalize(self, string: str):
+        """Synchronous normalization of a single string."""
+        return asyncio.run(self.anormalize(string))
+
+
+
 
-            
-        
 
 
 if __name__ == "__main__":
     normalizer = UMLSNormalizer()
     #example wssf
-    print("this is an example: ", normalizer.normalize("human "))
\ No newline at end of file
+    print("this is an example: ", normalizer.normalize("human "))
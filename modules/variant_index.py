@@ -0,0 +1,133 @@
+import pandas as pd
+import unicodedata
+import logging
+import re
+
+from modules.term_matcher import NORMALIZATION_FIELDS
+from modules.schema import NEO4J_ENTITIES, read_csv
+
+"""Most new entity texts are variants of texts we already normalized: plurals
+    (cancers), hyphenation (erbb-2, erbb2), greek letters (tnf-α, tnf alpha) or
+    casing. Every known text is reduced to a canonical form, and the canonical form
+    points to the CUI of the text. A new text whose canonical form is known gets
+    that normalization directly, without any API call.
+    The normalization cache stores the canonical form of its texts in an indexed
+    column and is queried at lookup time, only the cleaned entities csv is indexed
+    in memory.
+
+    canonical form: greek letters spelled out, accents removed, lowercased, every
+    word singularized (rule based, the texts are mostly lemmas already), then
+    everything that isn't a letter or a digit removed (spaces and hyphens too).
+    A canonical form shared by texts of different CUIs is ambiguous and never used."""
+
+GREEK_LETTERS = {
+    "α": "alpha", "β": "beta", "γ": "gamma", "δ": "delta", "ε": "epsilon", "ζ": "zeta",
+    "η": "eta", "θ": "theta", "ι": "iota", "κ": "kappa", "λ": "lambda", "μ": "mu",
+    "ν": "nu", "ξ": "xi", "ο": "omicron", "π": "pi", "ρ": "rho", "σ": "sigma", "ς": "sigma",
+    "τ": "tau", "υ": "upsilon", "φ": "phi", "χ": "chi", "ψ": "psi", "ω": "omega",
+}
+_GREEK = re.compile("|".join(GREEK_LETTERS))
+_WORD = re.compile(r"[a-z0-9]+")
+_NOT_ALNUM = re.compile(r"[^a-z0-9]+")
+
+#words ending with s that aren't plurals
+_SINGULAR_ENDINGS = ("ss", "us", "is", "os", "as", "ys")
+#marks a canonical form shared by different CUIs
+_AMBIGUOUS = None
+
+
+def _singular(word: str) -> str:
+    if len(word) <= 3 or word.isdigit() or not word.endswith("s") or word.endswith(_SINGULAR_ENDINGS):
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("ches", "shes", "xes", "sses")):
+        return word[:-2]
+    return word[:-1]
+
+
+def canonicalize(text: str) -> str:
+    """Canonical form of an entity text, '' if nothing is left of it."""
+    text = _GREEK.sub(lambda m: f" {GREEK_LETTERS[m.group(0)]} ", text.lower())
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    words = [_singular(word) for word in _WORD.findall(text)]
+    return _NOT_ALNUM.sub("", "".join(words))
+
+
+class VariantIndex:
+    def __init__(self, cache=None):
+        """Parameters:
+            cache = NormalizationCache whose texts are known variants, None for none."""
+        self.cache = cache
+        #canonical form -> normalization (cui...), _AMBIGUOUS if CUIs disagree
+        self._variants = {}
+        self.lookups = 0
+        self.hits = 0
+
+    def __len__(self):
+        """Number of canonical forms indexed in memory (the cache ones are not counted)."""
+        return len(self._variants)
+
+    def add(self, text: str, normalization: dict):
+        """Index a normalized text, texts without CUI are ignored."""
+        if not isinstance(text, str) or not normalization or not normalization.get("cui"):
+            return
+        canonical = canonicalize(text)
+        if not canonical:
+            return
+        if canonical not in self._variants:
+            self._variants[canonical] = {k: normalization[k] for k in NORMALIZATION_FIELDS if k in normalization}
+        else:
+            known = self._variants[canonical]
+            if known is not _AMBIGUOUS and known["cui"] != normalization["cui"]:
+                self._variants[canonical] = _AMBIGUOUS
+
+    def lookup(self, text: str):
+        """Normalization of a known variant of text, None if there is none."""
+        self.lookups += 1
+        canonical = canonicalize(text)
+        if not canonical:
+            return None
+        normalizations = [self._variants[canonical]] if canonical in self._variants else []
+        if self.cache is not None:
+            normalizations.extend(self.cache.with_canonical(canonical))
+        if not normalizations or _AMBIGUOUS in normalizations:
+            return None
+        if len({normalization["cui"] for normalization in normalizations}) > 1:
+            return None
+        self.hits += 1
+        return {k: normalizations[0][k] for k in NORMALIZATION_FIELDS if k in normalizations[0]}
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def stats(self) -> dict:
+        return {"variants": len(self), "lookups": self.lookups, "hits": self.hits, "hit_rate": round(self.hit_rate, 4)}
+
+    def add_entities_csv(self, path: str):
+        """Index the cleaned entities csv (name, cui, normalized_name...)."""
+        try:
+            entities = read_csv(path, NEO4J_ENTITIES, usecols=lambda col: col in ["name", *NORMALIZATION_FIELDS])
+        except FileNotFoundError:
+            logging.info(f"VariantIndex: No Entities At {path}.")
+            return
+        except (ValueError, pd.errors.EmptyDataError) as e:
+            logging.error(f"VariantIndex: Unable To Read Entities From {path}: {e}")
+            return
+        if "name" not in entities.columns or "cui" not in entities.columns:
+            logging.error(f"VariantIndex: {path} Must Contain 'name' And 'cui' Columns.")
+            return
+
+        for row in entities.dropna(subset=["cui"]).to_dict("records"):
+            name = row.pop("name")
+            self.add(name, {k: v for k, v in row.items() if isinstance(v, str)})
+
+    @classmethod
+    def from_sources(cls, cache=None, entities_path: str = None) -> "VariantIndex":
+        """Index over the normalization cache and the cleaned entities csv."""
+        index = cls(cache)
+        if entities_path:
+            index.add_entities_csv(entities_path)
+        logging.info(f"VariantIndex: {len(index)} Canonical Forms Indexed.")
+        return index
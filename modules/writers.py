@@ -0,0 +1,345 @@
+import pandas as pd
+import logging
+import gzip
+import csv
+import io
+import os
+import re
+
+from pathlib import Path
+
+from config.nlp_config import OUTPUT
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+"""Annotation outputs are written through long lived writers with a fixed list of
+    columns: every row is written in the same column order whatever keys it has,
+    missing values are left empty. A writer keeps its file open for the whole run,
+    a flush is a write and a flush of the handle.
+    Backends: CSV (csv.writer, optionally gzip or zstd compressed) and Parquet (one
+    row group per write, compressed by pyarrow). Past rotate_bytes, a writer starts
+    a new file: base.csv, base.1.csv, base.2.csv... read_output reads them all back.
+    commit() makes what was written durable (flush and fsync) and returns the files
+    with their size and number of rows, for a checkpoint. A writer resumed from them
+    truncates its last file back to that size and goes on appending to it. Files
+    that can't be appended to once committed (Parquet needs its footer, a zstd frame
+    can't be reopened) are closed at commit instead, the next rows go to a new file.
+    Gzip files are committed by ending the gzip member, a new one follows it.
+    rotate() closes the current file on demand."""
+
+EXTENSIONS = {"csv": ".csv", "parquet": ".parquet"}
+CSV_COMPRESSION_EXTENSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+_OUTPUT_FILE = r"(?:\.(\d+))?\.(?:csv(?:\.gz|\.zst)?|parquet)$"
+
+
+def _stem(path: str) -> Path:
+    """The path without its output extensions: data/entities.csv.gz -> data/entities."""
+    path = Path(path)
+    for suffix in (".gz", ".zst", ".csv", ".parquet"):
+        if path.name.endswith(suffix):
+            path = path.with_name(path.name[:-len(suffix)])
+    return path
+
+
+def output_files(path: str) -> list[str]:
+    """Files written for the output path, whatever their format, in writing order."""
+    stem = _stem(path)
+    if not stem.parent.is_dir():
+        return []
+    pattern = re.compile(re.escape(stem.name) + _OUTPUT_FILE)
+    found = []
+    for name in os.listdir(stem.parent):
+        match = pattern.fullmatch(name)
+        if match:
+            found.append((int(match.group(1) or 0), str(stem.parent / name)))
+    return [file for _, file in sorted(found)]
+
+
+def read_output(path: str, **read_csv_kwargs) -> pd.DataFrame:
+    """Read all the files written for an output path into one DataFrame."""
+    files = output_files(path)
+    if not files:
+        raise FileNotFoundError(f"No output files for {path}.")
+    frames = [pd.read_parquet(file) if file.endswith(".parquet") else pd.read_csv(file, **read_csv_kwargs)
+              for file in files]
+    return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+
+def iter_output(path: str, chunksize: int, **read_csv_kwargs):
+    """DataFrames of at most chunksize rows, over all the files written for an output path."""
+    files = output_files(path)
+    if not files:
+        raise FileNotFoundError(f"No output files for {path}.")
+    for file in files:
+        yield from iter_file(file, chunksize, **read_csv_kwargs)
+
+
+def iter_file(file: str, chunksize: int, skip_rows: int = 0, **read_csv_kwargs):
+    """DataFrames of at most chunksize rows of one output file, after its first skip_rows rows."""
+    if file.endswith(".parquet"):
+        if pq is None:
+            raise ImportError("Parquet outputs need the pyarrow package.")
+        for batch in pq.ParquetFile(file).iter_batches(batch_size=chunksize):
+            if skip_rows >= batch.num_rows:
+                skip_rows -= batch.num_rows
+                continue
+            yield batch.slice(skip_rows).to_pandas()
+            skip_rows = 0
+    else:
+        #the header is kept, the rows after it are skipped without being parsed
+        skip = range(1, skip_rows + 1) if skip_rows else None
+        yield from pd.read_csv(file, chunksize=chunksize, skiprows=skip, **read_csv_kwargs)
+
+
+class RowWriter:
+    format = None
+
+    def __init__(self, path: str, columns: list[str], compression: str = None, rotate_bytes: int = None,
+                 keep: list[str] = None):
+        """Parameters:
+            path = output path, its extension is replaced by the one of the format.
+            columns = the fixed columns of the rows, keys not in columns are dropped.
+            compression = None, "gzip" or "zstd".
+            rotate_bytes = size after which the next write goes to a new file, None to never rotate.
+            keep = files of a previous run to keep (see commit), paths of complete files or
+                   {"path", "bytes", "rows"} of committed ones. Writing goes on in the last
+                   one if it can be appended to, in a new file after them otherwise."""
+        self.columns = list(columns)
+        self.compression = compression
+        self.rotate_bytes = rotate_bytes
+        self._stem = _stem(path)
+        self._file_index = 0
+        self.paths = []
+        self.rows_written = 0
+        #rows written to the current file
+        self._file_rows = 0
+        #rows of the files written before the current one
+        self._rows = {}
+
+        self._stem.parent.mkdir(parents=True, exist_ok=True)
+        #a new run replaces the outputs of the previous one, shards and other formats included,
+        #a resumed one only keeps the given files, as they were when committed
+        keep = [{"path": file} if isinstance(file, str) else file for file in keep or []]
+        existing = output_files(path)
+        kept = [file for file in keep if file["path"] in existing]
+        for previous in existing:
+            if previous not in [file["path"] for file in kept]:
+                os.remove(previous)
+        for file in kept:
+            if "bytes" in file and os.path.getsize(file["path"]) > file["bytes"]:
+                os.truncate(file["path"], file["bytes"])
+            self._rows[file["path"]] = file.get("rows", 0)
+        self.paths = [file["path"] for file in kept]
+        self._file_index = len(kept)
+        if kept and "bytes" in kept[-1] and self._can_append(kept[-1]["path"]):
+            self._file_rows = self._rows.pop(self.path)
+            self._open(self.path, append=True)
+            logging.debug(f"Writer: Appending To {self.path}.")
+        else:
+            self._open_next()
+
+    def _next_path(self) -> str:
+        suffix = f".{self._file_index}" if self._file_index else ""
+        return f"{self._stem}{suffix}{self.extension}"
+
+    @property
+    def extension(self) -> str:
+        return EXTENSIONS[self.format]
+
+    @property
+    def path(self) -> str:
+        """File currently written."""
+        return self.paths[-1]
+
+    def _open_next(self):
+        if self._file_rows:
+            self._rows[self.path] = self._file_rows
+        self.paths.append(self._next_path())
+        self._file_index += 1
+        self._file_rows = 0
+        self._open(self.path)
+        logging.debug(f"Writer: Writing To {self.path}.")
+
+    def rotate(self) -> list[str]:
+        """Close the current file and continue in a new one (unless nothing was
+        written to it yet), return the files that are complete."""
+        if self._file_rows:
+            self._close()
+            self._open_next()
+        return self.paths[:-1]
+
+    def commit(self) -> list[dict]:
+        """Make the rows written so far durable, return {"path", "bytes", "rows"} of the
+        files holding them, for a checkpoint (see keep)."""
+        size = self._sync() if self._file_rows else None
+        if self._file_rows and size is None:
+            #the format can't go on in a committed file
+            self._close()
+            self._open_next()
+        files = [{"path": path, "bytes": os.path.getsize(path), "rows": self._rows[path]} for path in self.paths[:-1]]
+        if self._file_rows:
+            files.append({"path": self.path, "bytes": size, "rows": self._file_rows})
+        return files
+
+    def write_rows(self, rows: list[dict]):
+        """Write rows (dicts) in the fixed column order and flush them."""
+        if not rows:
+            return
+        if self.rotate_bytes and self._file_rows and os.path.getsize(self.path) >= self.rotate_bytes:
+            self._close()
+            self._open_next()
+        self._write(rows)
+        self.rows_written += len(rows)
+        self._file_rows += len(rows)
+
+    def close(self):
+        self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    #backend methods
+    def _open(self, path: str, append: bool = False):
+        raise NotImplementedError
+
+    def _can_append(self, path: str) -> bool:
+        """True if writing can go on at the end of a committed file."""
+        return False
+
+    def _sync(self):
+        """Flush and fsync the current file so that it can be appended to after a
+        resume, return its size, None if the format can't do it (the file is
+        closed instead)."""
+        return None
+
+    def _write(self, rows: list[dict]):
+        raise NotImplementedError
+
+    def _close(self):
+        raise NotImplementedError
+
+
+class CSVRowWriter(RowWriter):
+    format = "csv"
+
+    @property
+    def extension(self) -> str:
+        return EXTENSIONS["csv"] + CSV_COMPRESSION_EXTENSIONS[self.compression]
+
+    def _open(self, path: str, append: bool = False):
+        if self.compression == "zstd" and zstandard is None:
+            raise ImportError("zstd compressed CSV needs the zstandard package.")
+        self._file = open(path, "ab" if append else "wb")
+        self._open_stream()
+        if not append:
+            self._writer.writerow(self.columns)
+
+    def _open_stream(self):
+        """Text stream over the open file, compressed if needed."""
+        if self.compression == "gzip":
+            #a new gzip member, at the end of the file
+            stream = gzip.GzipFile(fileobj=self._file, mode="ab")
+        elif self.compression == "zstd":
+            stream = zstandard.ZstdCompressor().stream_writer(self._file)
+        else:
+            stream = self._file
+        self._handle = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+        self._writer = csv.writer(self._handle)
+
+    def _write(self, rows: list[dict]):
+        self._writer.writerows([[row.get(column) for column in self.columns] for row in rows])
+        self._handle.flush()
+
+    def _can_append(self, path: str) -> bool:
+        return self.compression != "zstd" and path.endswith(self.extension)
+
+    def _sync(self):
+        if self.compression == "zstd":
+            return None
+        self._handle.flush()
+        if self.compression == "gzip":
+            #ends the member, the file is left open for the next one
+            self._handle.detach().close()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        size = self._file.tell()
+        if self.compression == "gzip":
+            #its header is written right away, after the committed size
+            self._open_stream()
+        return size
+
+    def _close(self):
+        if self._handle is not None and not self._handle.closed:
+            self._handle.close()
+        #a gzip member doesn't close the file under it
+        self._file.close()
+
+
+class ParquetRowWriter(RowWriter):
+    format = "parquet"
+
+    def _open(self, path: str, append: bool = False):
+        if pa is None:
+            raise ImportError("Parquet outputs need the pyarrow package.")
+        #every column is a nullable string, empty values are nulls
+        self._schema = pa.schema([(column, pa.string()) for column in self.columns])
+        self._writer = pq.ParquetWriter(path, self._schema, compression=self.compression or "none")
+
+    def _write(self, rows: list[dict]):
+        columns = {column: [None if row.get(column) in (None, "") else str(row[column]) for row in rows]
+                   for column in self.columns}
+        self._writer.write_table(pa.table(columns, schema=self._schema))
+
+    def _close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def _read_rows(file: str, chunksize: int):
+    """Rows of an output file as lists of dicts, chunksize rows at a time, values as written."""
+    if file.endswith(".parquet"):
+        if pq is None:
+            raise ImportError("Parquet outputs need the pyarrow package.")
+        for batch in pq.ParquetFile(file).iter_batches(batch_size=chunksize):
+            yield batch.to_pylist()
+    else:
+        for chunk in pd.read_csv(file, dtype=str, keep_default_na=False, chunksize=chunksize):
+            yield chunk.to_dict("records")
+
+
+def merge_outputs(sources: list[str], path: str, columns: list[str], chunksize: int = 100_000, **writer_options) -> list[str]:
+    """Write the rows of all the files of the source outputs, in order, to the output
+    path, then remove the source files. Return the files written."""
+    with make_writer(path, columns, **writer_options) as writer:
+        for source in sources:
+            for file in output_files(source):
+                for rows in _read_rows(file, chunksize):
+                    writer.write_rows(rows)
+    for source in sources:
+        for file in output_files(source):
+            os.remove(file)
+    logging.info(f"Writer: Merged {len(sources)} Outputs Into {path}, {writer.rows_written} Rows.")
+    return writer.paths
+
+
+def make_writer(path: str, columns: list[str], format: str = OUTPUT["format"],
+                compression: str = OUTPUT["compression"], rotate_bytes: int = OUTPUT["rotate_bytes"],
+                keep: list[str] = None) -> RowWriter:
+    """Writer of the given format ("csv" or "parquet") for path, keep = files of a resumed run."""
+    writers = {"csv": CSVRowWriter, "parquet": ParquetRowWriter}
+    if format not in writers:
+        raise ValueError(f"Unknown output format: {format}, expected 'csv' or 'parquet'.")
+    return writers[format](path, columns, compression=compression, rotate_bytes=rotate_bytes, keep=keep)
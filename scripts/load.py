@@ -13,7 +13,8 @@ def load_to_aura(labels_to_load:Optional[list[str]] = None,
                 reltypes_to_load:Optional[list[str]] = None,
                 rels_clean_csv:Optional[str] = None,
 
-                load_batch_size = 1000):
+                load_batch_size = 1000,
+                add_evidence = False):
     
         nodes_args_provided = bool(labels_to_load) and bool(ents_clean_csv)
         rels_args_provided = bool(reltypes_to_load) and bool(rels_clean_csv) 
@@ -30,7 +31,7 @@ def load_to_aura(labels_to_load:Optional[list[str]] = None,
                     connector.load_ents_to_aura(labels_to_load, ents_clean_csv)
                 
                 if rels_args_provided: 
-                    connector.load_rels_to_aura(reltypes_to_load, rels_clean_csv)
+                    connector.load_rels_to_aura(reltypes_to_load, rels_clean_csv, add_evidence=add_evidence)
         
         except KeyboardInterrupt:
             logging.error("Load Process Interrupted Manually.")
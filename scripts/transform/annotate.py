@@ -1,40 +1,230 @@
+import multiprocessing
 import logging
+import spacy
 
+from pathlib import Path
 from tqdm import tqdm
 
 from modules.mongoatlas import MongoAtlasConnector
 from modules.umls_api import UMLSNormalizer
+from modules.local_linker import LocalUMLSLinker
 from modules.nlp import StreamingOptimizedNLP
+from modules.relation_extractor import RelationExtractor
+from modules.checkpoint import AnnotationCheckpoint
+from modules.writers import merge_outputs
+from modules.doc_cache import DocCache, docs_key, load_docs
+from modules.result_cache import AnnotationResultCache, cache_model
 
 from config.secrets import MONGO_CONNECTION_STR
+from config.apis_config import UMLS_REQUESTS_PER_SECOND, UMLS_MAX_IN_FLIGHT
+from config.nlp_config import NORMALIZER_BACKEND, LOCAL_LINKER, CHECKPOINT, DOC_CACHE, PROFILER, RESULT_CACHE
+from config.nlp_config import ENTITY_COLUMNS, RELATION_COLUMNS
 
 
 
 
-def annotate_mongo_articles(ents_path ="data/extracted_entities.csv", rels_path = "data/extracted_relations.csv"):
-    
+def get_normalizer(api_share: int = 1):
+    """Normalizer of the configured backend, the UMLS API or the offline local linker.
+    api_share = number of processes sharing the UMLS API quota."""
+    def umls_normalizer():
+        return UMLSNormalizer(requests_per_second=UMLS_REQUESTS_PER_SECOND / api_share,
+                              max_in_flight=max(1, UMLS_MAX_IN_FLIGHT // api_share))
+    if NORMALIZER_BACKEND == "local":
+        fallback = umls_normalizer() if LOCAL_LINKER["api_fallback"] else None
+        return LocalUMLSLinker(fallback=fallback)
+    return umls_normalizer()
+
+
+
+
+def prune_result_cache(nlp_pipe):
+    """Remove the cached results of other models or patterns, they are never read again."""
+    result_cache = AnnotationResultCache(cache_model(nlp_pipe))
+    try:
+        result_cache.prune()
+    finally:
+        result_cache.close()
+
+
+
+
+def worker_path(path: str, worker: int) -> str:
+    """Output or checkpoint path of a worker: data/entities.csv -> data/entities.worker0.csv"""
+    path = Path(path)
+    return str(path.with_name(f"{path.stem}.worker{worker}{path.suffix}"))
+
+
+def partition_query(worker: int, workers: int) -> dict:
+    """Mongo filter of the articles of a worker: pmid modulo the number of workers."""
+    return {"$expr": {"$eq": [{"$mod": [{"$toLong": "$pmid"}, workers]}, worker]}}
+
+
+def check_resume_workers(checkpoint_path: str, workers: int):
+    """Raise a ValueError if a checkpoint left by the interrupted run was saved with another
+    number of workers: its last key is the one of another partition, resuming from it would
+    skip some articles and annotate others twice."""
+    path = Path(checkpoint_path)
+    for saved_path in [path, *sorted(path.parent.glob(f"{path.stem}.worker*{path.suffix}"))]:
+        state = AnnotationCheckpoint(saved_path).load()
+        if state is None:
+            continue
+        #checkpoints saved before the number of workers was: the run checkpoint is a single process one
+        saved = state.get("workers", 1 if saved_path == path else None)
+        if saved is None:
+            logging.warning(f"Annotation: {saved_path} Has No Number Of Workers, It Can't Be Checked.")
+        elif saved != workers:
+            raise ValueError(f"Annotation: {saved_path} Was Saved By A Run With {saved} Worker(s), "
+                             f"Resume With --workers {saved} Or Start Over Without --resume.")
+
+
+
+
+def annotate_mongo_articles(ents_path ="data/extracted_entities.csv", rels_path = "data/extracted_relations.csv",
+                            resume = False, checkpoint_every = CHECKPOINT["every"], checkpoint_path = CHECKPOINT["path"],
+                            workers = 1, cache_docs = DOC_CACHE["enabled"], profile_path = PROFILER["report_path"]):
+    """resume = go on after the last checkpoint instead of starting from scratch.
+    checkpoint_every = number of articles between two checkpoints.
+    checkpoint_path = json file of the progress.
+    workers = number of annotation processes, each one annotates its own partition.
+    cache_docs = save the parsed docs, for extract_relations_from_docs.
+    profile_path = json report of the timings and throughput of the run, one per worker."""
+    if resume:
+        #the partitions (pmid % workers) must be the ones the checkpoints were saved for
+        check_resume_workers(checkpoint_path, workers)
+    #the model is loaded once, the forked workers share its memory (copy on write)
+    nlp_pipe = StreamingOptimizedNLP.load_pipeline()
+    if cache_docs and not resume:
+        #the docs of a previous run are replaced, like its outputs
+        DocCache.clear(docs_key(nlp_pipe))
+    if RESULT_CACHE["enabled"] and RESULT_CACHE["prune"]:
+        #once, before the workers start
+        prune_result_cache(nlp_pipe)
+
+    if workers <= 1:
+        annotate_partition(ents_path, rels_path, resume, checkpoint_every, checkpoint_path,
+                           nlp_pipe=nlp_pipe, cache_docs=cache_docs, profile_path=profile_path)
+        return
+
+    context = multiprocessing.get_context("fork")
+    processes = []
+    for worker in range(workers):
+        process = context.Process(
+            target=annotate_partition,
+            name=f"annotate-worker{worker}",
+            args=(worker_path(ents_path, worker), worker_path(rels_path, worker), resume,
+                  checkpoint_every, worker_path(checkpoint_path, worker)),
+            kwargs={"partition": (worker, workers), "nlp_pipe": nlp_pipe, "cache_docs": cache_docs,
+                    "profile_path": worker_path(profile_path, worker)})
+        process.start()
+        processes.append(process)
+    logging.info(f"Annotation: Started {workers} Workers.")
+
+    for process in processes:
+        process.join()
+    failed = [process.name for process in processes if process.exitcode != 0]
+    if failed:
+        #the outputs of the workers are left as they are, for --resume
+        raise RuntimeError(f"Annotation Workers Failed: {failed}, Run Again With --resume.")
+
+    #one entities file and one relations file for the clean stage
+    merge_outputs([worker_path(ents_path, worker) for worker in range(workers)], ents_path, ENTITY_COLUMNS)
+    merge_outputs([worker_path(rels_path, worker) for worker in range(workers)], rels_path, RELATION_COLUMNS)
+    #the worker outputs are gone, their progress can't be resumed anymore
+    for worker in range(workers):
+        AnnotationCheckpoint(worker_path(checkpoint_path, worker)).clear()
+    logging.info(f"Annotation: Merged The Outputs Of {workers} Workers.")
+
+
+
+
+def annotate_partition(ents_path, rels_path, resume = False, checkpoint_every = CHECKPOINT["every"],
+                       checkpoint_path = CHECKPOINT["path"], partition = None, nlp_pipe = None,
+                       cache_docs = False, profile_path = PROFILER["report_path"]):
+    """Annotate the articles of a partition, all of them if partition is None.
+    partition = (worker, workers), the articles whose pmid % workers == worker.
+    nlp_pipe = already loaded pipeline, loaded here if None.
+    cache_docs = save the parsed docs, in shards of their own for a worker.
+    profile_path = where the profiler report is written at the end of the run."""
+    checkpoint = AnnotationCheckpoint(checkpoint_path)
+    state = checkpoint.load() if resume else None
+    if resume and state is None:
+        logging.warning("Annotation: No Checkpoint To Resume From, Starting From Scratch.")
+    if state is None:
+        checkpoint.clear()
+
     connector = MongoAtlasConnector(connection_str=MONGO_CONNECTION_STR)
-    #list[dict] each dict is an article
-    articles = connector.fetch_articles_from_atlas(query={})
+    #list[dict] each dict is an article, in pmid order so that a run can resume after the last one
+    query = {"pmid": {"$gt": state["last_key"]}} if state else {}
+    if partition is not None:
+        query = {"$and": [query, partition_query(*partition)]}
+    articles = connector.fetch_articles_from_atlas(query=query, sort=[("pmid", 1)])
         
     #one for all so entities and relations could be saved in the class attr.
-    normalizer = UMLSNormalizer()
+    #workers share the UMLS API quota
+    normalizer = get_normalizer(api_share=partition[1] if partition else 1)
+    if nlp_pipe is None:
+        nlp_pipe = StreamingOptimizedNLP.load_pipeline()
+    doc_cache = None
+    if cache_docs:
+        doc_cache = DocCache(docs_key(nlp_pipe), name=f"docs.worker{partition[0]}" if partition else "docs")
     annotator = StreamingOptimizedNLP(
         normalizer=normalizer,
         entities_output_path=ents_path,
         relations_output_path=rels_path,
+        #output files committed by the resumed run, what follows is rewritten
+        resume_outputs=state["outputs"] if state else None,
+        nlp_pipe=nlp_pipe,
+        doc_cache=doc_cache,
     )
 
-
+    workers = partition[1] if partition else 1
+    done = state["articles"] if state else 0
+    last_key = state["last_key"] if state else None
     logging.info("Annotation Process Started.")
     try:
         for article in tqdm(articles, desc="Applying NLP over Mongo docs:"):
             text = article.pop('text')
-            #we are able to chain methods as we return self from each one
-            (annotator.extract_and_normalize_entities(text, article_metadata= article)
-                    .extract_relations(text, article_metadata= article))    
+            #MeSH and keywords are looked up in a dictionary, they don't go through NER
+            terms = article.pop('curated_terms', [])
+            #we are able to chain methods as we return self from each one,
+            #the text is parsed once for both entities and relations, unless its results are cached
+            (annotator.extract_entities_and_relations(text, article_metadata= article)
+                    .extract_curated_entities(terms, article_metadata= article))    
+            
+            done += 1
+            last_key = article['pmid']
+            if done % checkpoint_every == 0:
+                checkpoint.save(last_key, done, annotator.commit_outputs(), workers)
+        
+        #the outputs are complete, the last checkpoint covers the whole run
+        checkpoint.save(last_key, done, annotator.commit_outputs(), workers)
+        annotator.write_profile(profile_path)
         
     except KeyboardInterrupt: 
+        #what was annotated after the last checkpoint is redone on resume
         logging.error("Annotation Process Interrupted Manually.")
         raise
-    
\ No newline at end of file
+    finally:
+        #flush what was annotated and close the output files, even when interrupted
+        annotator.close()
+
+
+
+
+def extract_relations_from_docs(rels_path = "data/extracted_relations.csv", model = None):
+    """Re-run the relation patterns over the docs parsed by a previous annotation
+    (saved with cache_docs), without the NER model. Only the relations output is
+    rewritten, the entities output is left as it is.
+    model = key of the docs (see docs_key), the installed NER model with the configured
+            profile if None."""
+    model = model or docs_key()
+    #the docs carry their strings, the vocab of a blank pipeline of the same language is enough
+    #for the matchers, no model, normalizer nor result cache (the patterns are being changed)
+    vocab = spacy.blank("en").vocab
+    extractor = RelationExtractor(vocab, rels_path)
+    logging.info(f"Annotation: Extracting Relations From The Docs Parsed By {model}.")
+    try:
+        for doc, article in tqdm(load_docs(model, vocab), desc="Applying relation patterns over parsed docs:"):
+            extractor.extract_relations(doc, article_metadata= article)
+    finally:
+        extractor.close()
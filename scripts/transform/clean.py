@@ -1,97 +1,562 @@
 import pandas as pd 
+import numpy as np
 
-import uuid
+import itertools
 import logging
+import shlex
+import shutil
+import json
+import gzip
 import os
+
+from datetime import datetime, timezone
+
+from modules.writers import iter_file, output_files
+from modules.key_set import make_key_set, hash_key
+from modules.entity_registry import EntityRegistry
+from modules.schema import RAW_ENTITIES, RAW_RELATIONS, NEO4J_ENTITIES, NEO4J_RELATIONS, read_kwargs, apply_schema
+
+from config.nlp_config import ENTITY_COLUMNS
+from config.clean_config import CLEAN, REGISTRY, BULK_EXPORT
+from config.neo4jdb_config import NEO4J_ENTITY_LABEL
+
+#the raw files are read chunk by chunk, twice for entities:
+#	pass 1: rows with CUI, the first row of each CUI is kept, then the first row of each text
+#		(this is for cases like: cancer cancers etc...)
+#	pass 2: rows without CUI (they can't be deduplicated by CUI), the first row of each text
+#		not taken yet is kept
+#which gives the same rows as deduplicating the whole file by CUI then by text. Only hashes of
+#the CUIs and texts seen and a name -> id map are kept in memory, rows are written as they come.
+#Entity ids are derived from their content: the CUI, or the label and the lowercased text for
+#entities without CUI. The same entity gets the same id on every run, so loading a re-cleaned
+#file into Neo4j (MERGE on id) updates the existing nodes instead of duplicating them.
+#Relation endpoints are resolved in one vectorized lookup per chunk (Index.get_indexer on the
+#entity names), relations whose entities were dropped are written to a report, not lost.
+#The cleaned files can also be exported for neo4j-admin (offline import, much faster for a first
+#build of the graph than the transactional loader), see export_for_neo4j_admin.
+#Relations are aggregated by (start, type, end): evidence_count = number of articles (pmids)
+#supporting the relation, pmids = the first max_pmids of them, ";" separated.
+#The incremental clean does the same over the raw rows written since its previous run only,
+#the entities and relations cleaned before are looked up in the registry (modules/entity_registry.py)
+#instead of the key sets, and only what the graph doesn't have yet goes to the delta files.
+#The full clean resets the registry to what it wrote (entities, relations, evidence, unresolved
+#relations and rows read of each raw file), so an incremental clean can follow it.
+
 #TODO: consider removing the pmid, pmcid and fetching date from entities before cleaning them
 # because of them we will have redudent entities bla fayda. (keep pmid and pmcid for relations)
-def prepare_data_for_neo4j(raw_ents_path, raw_rels_path, saving_dir):
+
+#column names for Neo4j
+NEO4J_ENTITY_COLUMNS = [":ID"] + [{"text": "name", "label": ":LABEL"}.get(column, column) for column in ENTITY_COLUMNS]
+NEO4J_RELATION_COLUMNS = [":START_ID", ":END_ID", ":TYPE", "evidence_count", "pmids"]
+RELATION_KEY = [":START_ID", ":TYPE", ":END_ID"]
+UNRESOLVED_COLUMNS = ["ent1", "relation", "ent2", "pmid", "pmcid", "missing"]
+#entity properties that make a known entity "changed" when a new row has other values
+CHANGING_PROPERTIES = ["normalized_name", "normalization_source", "url"]
+#neo4j-admin headers: properties of the nodes (the ones the loader sets) and of the relationships,
+#with their types, the label and the type of a file are given in the import command
+ADMIN_NODE_HEADER = {":ID": "id:ID", "name": "name", "cui": "cui", "normalized_name": "normalized_name",
+					 "normalization_source": "normalization_source", "url": "url"}
+ADMIN_RELATIONSHIP_HEADER = {":START_ID": ":START_ID", ":END_ID": ":END_ID", "evidence_count": "evidence_count:int",
+							 "pmids": "pmids:string[]"}
+#two 64-bit hashes of the id key make a 128-bit id (32 hex chars, like the uuids used before),
+#changing these keys changes every id of the graph
+ENTITY_ID_HASH_KEYS = ("cancergraph-id-1", "cancergraph-id-2")
+
+
+def _read_chunks(path: str, chunksize: int, schema: dict, rows_read: dict = None):
+	"""Raw rows chunk by chunk, with the dtypes of schema (the dtypes of a chunk don't depend on its content).
+	rows_read[file] = rows of the file, once it is read."""
+	files = output_files(path)
+	if not files:
+		raise FileNotFoundError(f"No output files for {path}.")
+	for file in files:
+		read = 0
+		for chunk in iter_file(file, chunksize, **read_kwargs(schema)):
+			read += len(chunk)
+			yield apply_schema(chunk.drop(columns=['Unnamed: 0'], errors='ignore'), schema)
+		if rows_read is not None:
+			rows_read[file] = read
+
+
+def _append_csv(frame: pd.DataFrame, path: str):
+	frame.to_csv(path, mode="a", header=False, index=False)
+
+
+def _entity_ids(cui: pd.Series, label: pd.Series, text: pd.Series) -> np.ndarray:
+	"""Stable ids of entities: hash of the CUI, or of the label and text when there is no CUI."""
+	#hashed as python strings, the ids don't depend on the dtypes of the columns
+	cui, label, text = cui.astype(object), label.astype(object), text.astype(object)
+	keys = ("cui\x1f" + cui).where(cui.notna(), "text\x1f" + label.fillna("") + "\x1f" + text.fillna(""))
+	if keys.empty:
+		return np.array([], dtype=object)
+	halves = [pd.util.hash_pandas_object(keys, index=False, hash_key=hash_key).to_numpy()
+			  for hash_key in ENTITY_ID_HASH_KEYS]
+	return np.char.add(np.char.mod("%016x", halves[0]), np.char.mod("%016x", halves[1])).astype(object)
+
+
+def _clean_entities(raw_ents_path: str, ents_path: str, chunksize: int, registry: EntityRegistry, run: str) -> pd.Series:
+	"""Write the deduplicated entities with an id and register them, return their ids indexed by name."""
+	seen_cuis = make_key_set("clean_cuis")
+	seen_texts = make_key_set("clean_texts")
+	names, ids = [], []
+	before = 0
+	rows_read = {}
+	pd.DataFrame(columns=NEO4J_ENTITY_COLUMNS).to_csv(ents_path, index=False)
+
+	for with_cui in (True, False):
+		for chunk in _read_chunks(raw_ents_path, chunksize, RAW_ENTITIES, rows_read):
+			if with_cui:
+				before += len(chunk)
+			chunk = chunk.reindex(columns=ENTITY_COLUMNS)
+			chunk = chunk[chunk['cui'].notna() if with_cui else chunk['cui'].isna()].copy()
+			chunk['text'] = chunk['text'].str.lower()
+			#a row dropped for its CUI doesn't take its text
+			keys = zip(chunk['cui'], chunk['text'].fillna(""))
+			keep = [(not with_cui or seen_cuis.add(cui)) and seen_texts.add(text) for cui, text in keys]
+			chunk = chunk[keep]
+			if chunk.empty:
+				continue
+
+			#adding an id column
+			chunk.insert(loc=0, column=":ID", value=_entity_ids(chunk['cui'], chunk['label'], chunk['text']))
+			names.extend(chunk['text'])
+			ids.extend(chunk[':ID'])
+			chunk.columns = NEO4J_ENTITY_COLUMNS
+			_append_csv(chunk, ents_path)
+			#like the incremental clean, a missing text is the empty name
+			registry.add_entities(chunk.rename(columns={":ID": "id", ":LABEL": "label"}).fillna({"name": ""}), run)
+
+	for file, rows in rows_read.items():
+		registry.set_offset(file, rows)
+	print("entities records before:", before)
+	logging.info(f"Entities: Before Cleaning: {before}")
+	print("entities records after:", len(ids))
+	logging.info(f"Entities: Drop CUI Then ['text'] Duplicates, After Cleaning: {len(ids)}")
+	#names are unique (deduplicated by text)
+	return pd.Series(np.array(ids, dtype=object), index=pd.Index(names, dtype=object))
+
+
+def _resolve(entity_ids: pd.Series, endpoints: pd.Series) -> np.ndarray:
+	"""Ids of the endpoint names, None for names that aren't entities."""
+	if entity_ids.empty:
+		return np.full(len(endpoints), None, dtype=object)
+	positions = entity_ids.index.get_indexer(endpoints)
+	return np.where(positions >= 0, entity_ids.to_numpy()[positions], None)
+
+
+def _map_relations(chunk: pd.DataFrame, ent1: pd.Series, ent2: pd.Series, entity_ids: pd.Series):
+	"""Evidence rows (start id, type, end id, pmid) of a raw chunk, mapped to the ids of their
+	(lowercased) endpoints, and the relations with an endpoint that isn't an entity, with the missing side."""
+	start, end = _resolve(entity_ids, ent1), _resolve(entity_ids, ent2)
+	start_missing, end_missing = pd.isna(start), pd.isna(end)
+	resolved = ~(start_missing | end_missing)
+	evidence = pd.DataFrame({
+		":START_ID": start[resolved],
+		":TYPE": chunk['relation'][resolved].to_numpy(),
+		":END_ID": end[resolved],
+		"pmid": chunk['pmid'][resolved].to_numpy(),
+	})
+	missing = np.select([start_missing & end_missing, start_missing], ["both", "start"], default="end")
+	dropped = pd.DataFrame({"ent1": ent1, "relation": chunk['relation'], "ent2": ent2,
+							"pmid": chunk['pmid'], "pmcid": chunk['pmcid'], "missing": missing})[~resolved]
+	return evidence, dropped
+
+
+def _evidence_keys(evidence: pd.DataFrame) -> pd.Series:
+	"""64-bit hashes of the (start id, type, end id, pmid) of evidence rows, as the registry keeps them."""
+	return pd.Series([hash_key(key) for key in zip(*(evidence[column].fillna("") for column in RELATION_KEY + ["pmid"]))],
+					 index=evidence.index, dtype=object)
+
+
+class _EvidenceAggregator:
+	"""Relations aggregated by (start, type, end) over chunks of deduplicated evidence rows:
+	a count per relation, and its first max_pmids pmids. Each chunk is grouped on its own and
+	added to dicts keyed by relation, the relations already seen are never grouped again."""
+	def __init__(self, max_pmids: int):
+		self.max_pmids = max_pmids
+		#insertion ordered: relations in the order they were first seen
+		self.counts = {}
+		self.pmids = {}
+
+	def add(self, evidence: pd.DataFrame):
+		if evidence.empty:
+			return
+		for key, count in evidence.groupby(RELATION_KEY, sort=False).size().items():
+			self.counts[key] = self.counts.get(key, 0) + int(count)
+		pmids = evidence[evidence['pmid'].notna()].groupby(RELATION_KEY, sort=False).head(self.max_pmids)
+		for start, reltype, end, pmid in zip(*(pmids[column] for column in RELATION_KEY + ["pmid"])):
+			kept = self.pmids.setdefault((start, reltype, end), [])
+			if len(kept) < self.max_pmids:
+				kept.append(pmid)
+
+	def __len__(self):
+		return len(self.counts)
+
+	def relations(self) -> pd.DataFrame:
+		"""One row per relation, in the order they were first seen, NEO4J_RELATION_COLUMNS."""
+		if not self.counts:
+			return pd.DataFrame(columns=NEO4J_RELATION_COLUMNS)
+		relations = pd.DataFrame(list(self.counts), columns=RELATION_KEY)
+		relations["evidence_count"] = np.fromiter(self.counts.values(), dtype="int64", count=len(self.counts))
+		relations["pmids"] = [";".join(self.pmids[key]) if key in self.pmids else None for key in self.counts]
+		return relations[NEO4J_RELATION_COLUMNS]
+
+
+def _report_unresolved(dropped: pd.DataFrame, unresolved: dict, unresolved_path: str):
+	"""Count the dropped relations by missing side and append them to the report."""
+	if dropped.empty:
+		return
+	for side, count in dropped['missing'].value_counts().items():
+		unresolved[side] += int(count)
+	_append_csv(dropped, unresolved_path)
+
+
+def _log_unresolved(unresolved: dict, unresolved_path: str):
+	if any(unresolved.values()):
+		print("relations with unresolved entities:", unresolved)
+		logging.warning(f"Relations: {sum(unresolved.values())} Relations With Unresolved Entities "
+						f"(Missing Start: {unresolved['start']}, End: {unresolved['end']}, Both: {unresolved['both']}), "
+						f"See {unresolved_path}.")
+
+
+def _clean_relations(raw_rels_path: str, rels_path: str, unresolved_path: str, entity_ids: pd.Series, chunksize: int,
+					 max_pmids: int, registry: EntityRegistry, run: str):
+	"""Write the relations, mapped to the ids of their entities and aggregated with their
+	evidence, and the ones with an endpoint that isn't an entity to unresolved_path. The
+	relations, their evidence and the unresolved ones (as pending) are registered."""
+	#a relation found several times in an article is one piece of evidence
+	seen_evidence = make_key_set("clean_relation_evidence")
+	aggregator = _EvidenceAggregator(max_pmids)
+	before = 0
+	unresolved = {"start": 0, "end": 0, "both": 0}
+	rows_read = {}
+	pd.DataFrame(columns=UNRESOLVED_COLUMNS).to_csv(unresolved_path, index=False)
+
+	for chunk in _read_chunks(raw_rels_path, chunksize, RAW_RELATIONS, rows_read):
+		before += len(chunk)
+		ent1, ent2 = chunk['ent1'].str.lower(), chunk['ent2'].str.lower()
+		keys = zip(ent1.fillna(""), chunk['relation'].astype(object).fillna(""), ent2.fillna(""), chunk['pmid'].fillna(""))
+		keep = [seen_evidence.add(key) for key in keys]
+		chunk, ent1, ent2 = chunk[keep], ent1[keep], ent2[keep]
+
+		evidence, dropped = _map_relations(chunk, ent1, ent2, entity_ids)
+		aggregator.add(evidence)
+		registry.add_evidence(_evidence_keys(evidence))
+		_report_unresolved(dropped, unresolved, unresolved_path)
+		if not dropped.empty:
+			registry.add_pending(chunk.loc[dropped.index].assign(ent1=dropped['ent1'], ent2=dropped['ent2']))
+
+	relations = aggregator.relations()
+	relations.to_csv(rels_path, index=False)
+	registry.add_relations(relations, run)
+	for file, rows in rows_read.items():
+		registry.set_offset(file, rows)
+	print("relations records before:", before)
+	logging.info(f"Relations: Before Cleaning: {before}")
+	print("relations records after:", len(aggregator))
+	logging.info(f"Relations: Map To Entities & Aggregate By (Start, Type, End), After Cleaning: {len(aggregator)}")
+	_log_unresolved(unresolved, unresolved_path)
+	return unresolved
+
+
+def prepare_data_for_neo4j(raw_ents_path, raw_rels_path, saving_dir, chunksize = CLEAN["chunksize"],
+						   max_pmids = CLEAN["max_pmids"], registry_path = REGISTRY["path"]):
 	"""Parameters: 
 	raw_ents_path = path to the raw extracted entities csv
 	raw_rels_path = path to raw extracted relations csv
-	saving_dir = path of the directory to which cleaned data will be saved"""
-	entities = pd.read_csv(raw_ents_path)
-	relations = pd.read_csv(raw_rels_path)
-
-	if 'Unnamed: 0' in entities.columns: entities.drop(columns=['Unnamed: 0'], inplace=True)
-	if 'Unnamed: 0' in relations.columns: relations.drop(columns=['Unnamed: 0'], inplace=True)
-
-
-	#entities cleaning
-	print("entities records before:", entities.shape[0])
-	logging.info(f"Entities: Before Cleaning: {len(entities)}")
-	#separate rows without CUI, because we will be deduplicating using CUI column as subset,
-	#  which will cause to lose them as pandas will consider them duplicates.
-	rows_with_cui_missing = entities[entities['cui'].isna()]
-	rows_with_cui = entities.dropna(subset=['cui'], ignore_index=True)
-
-	#drop CUI duplicates, this is for cases like: cancer cancers etc...
-	unique_cui_rows = rows_with_cui.drop_duplicates(subset=['cui'], ignore_index=True)
-	logging.info("Entities: Drop CUI duplicates.")
-	#combine back unique CUI rows with all missing CUI rows
-	entities = pd.concat([unique_cui_rows, rows_with_cui_missing], ignore_index=True)
-
-	#drop duplicates by text
-	entities['text'] = entities['text'].str.lower()
-	entities.drop_duplicates(subset=['text'],inplace=True, ignore_index=True)
-	logging.info("Entities: Drop ['text'] Duplicates.")
-	print("entities records after:", entities.shape[0])
-	logging.info(f"Entities: After Cleaning: {len(entities)}")
-	#relations cleaning
-	print("relations records before:", relations.shape[0])
-	logging.info(f"Relations: Before Cleaning: {len(relations)}")
-	#drop duplicates by ent1 & ent2, I assume here that two entities can only have one relation per direction
-	relations['ent1'] = relations['ent1'].str.lower()
-	relations['ent2'] = relations['ent2'].str.lower()
-	relations.drop_duplicates(subset=['ent1', 'ent2'], inplace=True, ignore_index=True)
-	logging.info("Relations: Drop ['ent1', 'ent2'] Duplicates.")
-	print("relations records after:", relations.shape[0])
-	logging.info(f"Relations: After Cleaning: {len(relations)}")
-
-
-	#renaming columns for Neo4j
-	entities.columns = ['name', ':LABEL', 'pmid', 'pmcid', 'fetching_date', 'cui', 'normalized_name', 'normalization_source', 'url']
-	#adding an id column 
-	entities.insert(
-		loc = 0, 
-		column= ":ID",
-		value= [str(uuid.uuid4()) for _ in range(len(entities))]
-		)
-	logging.info("Entities: Rename Columns & Add UUID.")
-	#mapping relations to names
-	#select * from relations r join entities e on r.ent1 = a.name 
-	
-	relations = relations.merge(entities,
-								left_on='ent1', #on which column of the relations
-								right_on= 'name', #on which column of entities
-								)
-	#select * from relations r join entities e on r.ent2 = a.name 
-	relations = relations.merge(entities, 
-								left_on= "ent2", 
-								right_on = "name", 
-								#now we will have cui_start cui_end, id_start id_end, etc.. 
-								suffixes= ("_start", "_end") 
-								)
-
-	#rename columns for Neo4j
-	relations = relations.rename(columns={
-		":ID_start": ":START_ID",
-		":ID_end": ":END_ID",
-		"relation": ":TYPE"
-	})
-	logging.info("Relations: Map To Entities & Rename Columns.")
-	#now keep only relation related columns.
-	relations = relations[[":START_ID", ":END_ID", ":TYPE", "pmid", "pmcid", "fetching_date"]]
-
-	#export again:
-	try: 
-		os.makedirs(name=saving_dir, exist_ok=True)
-		ents_path = f"{saving_dir}/entities4neo4j.csv"
-		rels_path = f"{saving_dir}/relations4neo4j.csv"
-		entities.to_csv(ents_path, index=False)
-		relations.to_csv(rels_path, index = False)
-		logging.info(f"Cleaning & Preparation Process Completed. Repo: {saving_dir}.")
-	except Exception as e: 
-		logging.error(f"Cleaning & Preparation Process Failed: {e}")
-
-	return ents_path, rels_path
\ No newline at end of file
+	saving_dir = path of the directory to which cleaned data will be saved
+	chunksize = number of raw rows read at once
+	max_pmids = number of pmids kept per relation
+	registry_path = sqlite file of the registry, reset to the cleaned data: the next
+	incremental clean only reads the raw rows written after this run"""
+	#the annotation outputs can be csv (compressed or not) or parquet, in one or several files
+	os.makedirs(name=saving_dir, exist_ok=True)
+	ents_path = f"{saving_dir}/entities4neo4j.csv"
+	rels_path = f"{saving_dir}/relations4neo4j.csv"
+	#relations dropped because an endpoint isn't an entity, with the missing side
+	unresolved_path = f"{saving_dir}/unresolved_relations.csv"
+
+	run = datetime.now(timezone.utc).isoformat()
+
+	with EntityRegistry(registry_path) as registry:
+		#one transaction, a failed run leaves the registry as it was
+		registry.begin()
+		try: 
+			registry.reset()
+			entity_ids = _clean_entities(raw_ents_path, ents_path, chunksize, registry, run)
+			_clean_relations(raw_rels_path, rels_path, unresolved_path, entity_ids, chunksize, max_pmids, registry, run)
+			registry.commit()
+			logging.info(f"Cleaning & Preparation Process Completed, Registry: {registry.stats()}. Repo: {saving_dir}.")
+		except Exception as e: 
+			registry.rollback()
+			logging.error(f"Cleaning & Preparation Process Failed: {e}")
+			raise
+
+	return ents_path, rels_path
+
+
+def _new_raw_chunks(registry: EntityRegistry, raw_path: str, chunksize: int, rows_read: dict, schema: dict):
+	"""Raw rows written since the previous incremental run, chunk by chunk, with the dtypes of schema.
+	rows_read[file] = rows already read + rows read now, once the file is done."""
+	files = output_files(raw_path)
+	if not files:
+		raise FileNotFoundError(f"No output files for {raw_path}.")
+	for file in files:
+		offset = registry.offset(file)
+		read = 0
+		for chunk in iter_file(file, chunksize, skip_rows=offset, **read_kwargs(schema)):
+			read += len(chunk)
+			yield apply_schema(chunk.drop(columns=['Unnamed: 0'], errors='ignore'), schema)
+		rows_read[file] = offset + read
+
+
+def _update_entities(registry: EntityRegistry, raw_ents_path: str, new_path: str, changed_path: str, run: str,
+					 chunksize: int):
+	"""Register the entities of the new raw rows, write the ones the registry didn't have to
+	new_path and the known ones whose normalization changed to changed_path (latest row wins)."""
+	counts = {"rows": 0, "new": 0, "changed": 0}
+	rows_read = {}
+	#ids of this run dropped because their text was taken, their next rows are dropped too
+	dropped_ids = make_key_set("registry_dropped_ids")
+	pd.DataFrame(columns=NEO4J_ENTITY_COLUMNS).to_csv(new_path, index=False)
+	pd.DataFrame(columns=NEO4J_ENTITY_COLUMNS).to_csv(changed_path, index=False)
+
+	for with_cui in (True, False):
+		for chunk in _new_raw_chunks(registry, raw_ents_path, chunksize, rows_read, RAW_ENTITIES):
+			if with_cui:
+				counts["rows"] += len(chunk)
+			chunk = chunk.reindex(columns=ENTITY_COLUMNS)
+			chunk = chunk[chunk['cui'].notna() if with_cui else chunk['cui'].isna()].copy()
+			if chunk.empty:
+				continue
+			#like the key sets of the full clean, a missing text is the empty text
+			chunk['text'] = chunk['text'].str.lower().fillna("")
+			chunk.insert(loc=0, column="id", value=_entity_ids(chunk['cui'], chunk['label'], chunk['text']))
+			chunk = chunk.drop_duplicates("id")
+			chunk = chunk[[entity_id not in dropped_ids for entity_id in chunk['id']]]
+			known = registry.entities(chunk['id'])
+			is_known = chunk['id'].isin(known.index)
+
+			#entities seen before: only the ones registered by a previous run can change
+			seen = chunk[is_known]
+			if not seen.empty:
+				before = known.loc[seen['id']]
+				differs = (seen[CHANGING_PROPERTIES].astype(object).fillna("").to_numpy()
+						   != before[CHANGING_PROPERTIES].fillna("").to_numpy()).any(axis=1)
+				differs &= (before['first_seen'] != run).to_numpy()
+				#changed entities keep the name and label they have in the graph
+				changed = seen[differs].assign(text=before['name'].to_numpy()[differs], label=before['label'].to_numpy()[differs])
+				registry.update_entities(changed, run)
+				registry.touch_entities(seen['id'][~differs], run)
+				counts["changed"] += len(changed)
+				_append_csv(changed.set_axis(NEO4J_ENTITY_COLUMNS, axis=1), changed_path)
+
+			#new entities, unless their text is taken (same rule as the full clean)
+			new = chunk[~is_known]
+			taken = new['text'].isin(registry.ids_by_name(new['text']).index) | new['text'].duplicated()
+			for entity_id in new['id'][taken]:
+				dropped_ids.add(entity_id)
+			new = new[~taken]
+			if new.empty:
+				continue
+			registry.add_entities(new.rename(columns={"text": "name"}), run)
+			counts["new"] += len(new)
+			_append_csv(new.set_axis(NEO4J_ENTITY_COLUMNS, axis=1), new_path)
+
+	for file, rows in rows_read.items():
+		registry.set_offset(file, rows)
+	print("new entities records:", counts["rows"])
+	logging.info(f"Entities: {counts['rows']} New Raw Rows, {counts['new']} New Entities, {counts['changed']} Changed Entities.")
+	return counts
+
+
+def _update_relations(registry: EntityRegistry, raw_rels_path: str, new_path: str, unresolved_path: str, run: str,
+					  chunksize: int, max_pmids: int):
+	"""Register the evidence of the new raw rows, mapped to the registered entities, and write
+	the evidence the registry didn't have, aggregated by relation, to new_path (new relations,
+	and new evidence of known ones). Relations with an endpoint that isn't an entity are reported
+	and kept in the registry until it is one."""
+	counts = {"rows": 0}
+	unresolved = {"start": 0, "end": 0, "both": 0}
+	rows_read = {}
+	aggregator = _EvidenceAggregator(max_pmids)
+	pd.DataFrame(columns=UNRESOLVED_COLUMNS).to_csv(unresolved_path, index=False)
+
+	#relations of previous runs whose missing entity was just registered, then the new raw rows
+	pending = registry.pop_pending(run)
+	counts["retried"] = len(pending)
+	for chunk in itertools.chain([pending], _new_raw_chunks(registry, raw_rels_path, chunksize, rows_read, RAW_RELATIONS)):
+		counts["rows"] += len(chunk)
+		ent1, ent2 = chunk['ent1'].str.lower(), chunk['ent2'].str.lower()
+		entity_ids = registry.ids_by_name(pd.concat([ent1, ent2]).dropna())
+		evidence, dropped = _map_relations(chunk, ent1, ent2, entity_ids)
+		_report_unresolved(dropped, unresolved, unresolved_path)
+		if not dropped.empty:
+			registry.add_pending(chunk.loc[dropped.index].assign(ent1=dropped['ent1'], ent2=dropped['ent2']))
+
+		#evidence already counted by this run or a previous one is dropped
+		keys = _evidence_keys(evidence)
+		new = ~keys.duplicated() & ~registry.known_evidence(keys)
+		registry.add_evidence(keys[new])
+		aggregator.add(evidence[new])
+
+	relations = aggregator.relations()
+	registry.add_relations(relations, run)
+	relations.to_csv(new_path, index=False)
+	for file, rows in rows_read.items():
+		registry.set_offset(file, rows)
+	print("new relations records:", counts["rows"] - counts["retried"])
+	logging.info(f"Relations: {counts['rows'] - counts['retried']} New Raw Rows, {counts['retried']} Pending Relations Retried, "
+				 f"{len(relations)} Relations With New Evidence.")
+	_log_unresolved(unresolved, unresolved_path)
+	return counts
+
+
+def prepare_incremental_data_for_neo4j(raw_ents_path, raw_rels_path, saving_dir, registry_path = REGISTRY["path"],
+									   chunksize = CLEAN["chunksize"], max_pmids = CLEAN["max_pmids"]):
+	"""Clean only the raw rows written since the previous incremental run, against the registry
+	of the entities and relations cleaned before. Return the paths of the delta files: new
+	entities, changed entities and new relations (with the new evidence of known ones), to load
+	on top of the graph.
+	Parameters:
+	raw_ents_path = path to the raw extracted entities csv
+	raw_rels_path = path to raw extracted relations csv
+	saving_dir = path of the directory to which the delta files will be saved
+	registry_path = sqlite file of the registry, created on the first run
+	chunksize = number of raw rows read at once
+	max_pmids = number of pmids kept per relation"""
+	os.makedirs(name=saving_dir, exist_ok=True)
+	new_ents_path = f"{saving_dir}/new_entities4neo4j.csv"
+	changed_ents_path = f"{saving_dir}/changed_entities4neo4j.csv"
+	new_rels_path = f"{saving_dir}/new_relations4neo4j.csv"
+	unresolved_path = f"{saving_dir}/unresolved_relations.csv"
+	run = datetime.now(timezone.utc).isoformat()
+
+	with EntityRegistry(registry_path) as registry:
+		#the whole run is one transaction, a failed run leaves the registry as it was
+		registry.begin()
+		try:
+			_update_entities(registry, raw_ents_path, new_ents_path, changed_ents_path, run, chunksize)
+			_update_relations(registry, raw_rels_path, new_rels_path, unresolved_path, run, chunksize, max_pmids)
+			registry.commit()
+			logging.info(f"Incremental Cleaning Completed, Registry: {registry.stats()}. Repo: {saving_dir}.")
+		except Exception as e:
+			registry.rollback()
+			logging.error(f"Incremental Cleaning Failed: {e}")
+			raise
+
+	return new_ents_path, changed_ents_path, new_rels_path
+
+
+class _ShardedCsv:
+	"""Header file and gzipped csv shards of at most shard_rows rows, in directory."""
+	def __init__(self, directory: str, header: list[str], shard_rows: int):
+		self.directory = directory
+		self.shard_rows = shard_rows
+		self.files = []
+		self.rows = 0
+		self._handle = None
+		self._shard_rows = 0
+		os.makedirs(directory, exist_ok=True)
+		self.header = f"{directory}/header.csv"
+		pd.DataFrame(columns=header).to_csv(self.header, index=False)
+
+	def write(self, frame: pd.DataFrame):
+		while not frame.empty:
+			if self._handle is None or self._shard_rows >= self.shard_rows:
+				self._open_next()
+			part = frame.iloc[:self.shard_rows - self._shard_rows]
+			part.to_csv(self._handle, header=False, index=False)
+			self._shard_rows += len(part)
+			self.rows += len(part)
+			frame = frame.iloc[len(part):]
+
+	def _open_next(self):
+		self.close()
+		self.files.append(f"{self.directory}/part-{len(self.files):05d}.csv.gz")
+		self._handle = gzip.open(self.files[-1], "wt", newline="", encoding="utf-8")
+		self._shard_rows = 0
+
+	def close(self):
+		if self._handle is not None:
+			self._handle.close()
+			self._handle = None
+
+
+def _export_groups(path: str, schema: dict, group_column: str, header: dict, directory: str, shard_rows: int,
+				   chunksize: int) -> dict:
+	"""Write the rows of a cleaned file to sharded csv files per value of group_column
+	(label or type), with the columns of header only. Return the writers by value."""
+	shards = {}
+	try:
+		for chunk in pd.read_csv(path, chunksize=chunksize, **read_kwargs(schema)):
+			chunk = apply_schema(chunk, schema).reindex(columns=[group_column, *header])
+			#neo4j-admin reads one record per line by default
+			for column in chunk.columns[1:]:
+				if chunk[column].dtype == object or pd.api.types.is_string_dtype(chunk[column]):
+					chunk[column] = chunk[column].str.replace(r"[\r\n]+", " ", regex=True)
+			for value, rows in chunk.groupby(group_column, observed=True, sort=False):
+				if value not in shards:
+					shards[value] = _ShardedCsv(f"{directory}/{value}", list(header.values()), shard_rows)
+				shards[value].write(rows[list(header)])
+	finally:
+		for writer in shards.values():
+			writer.close()
+	return shards
+
+
+def export_for_neo4j_admin(ents_path, rels_path, export_dir = BULK_EXPORT["dir"], shard_rows = BULK_EXPORT["shard_rows"],
+						   database = BULK_EXPORT["database"], chunksize = CLEAN["chunksize"]):
+	"""Export the cleaned entities and relations as neo4j-admin import files: per label and per
+	relation type, a header file with the property types and gzipped csv shards. Write the
+	manifest (files, rows, command) and import.sh, the import command. Return the manifest path.
+	Parameters:
+	ents_path, rels_path = cleaned entities and relations (see prepare_data_for_neo4j)
+	export_dir = directory of the import files, its nodes/ and relationships/ are replaced
+	shard_rows = max number of rows per shard
+	database = database the import command builds (overwritten)
+	chunksize = number of cleaned rows read at once"""
+	for subdir in ("nodes", "relationships"):
+		shutil.rmtree(f"{export_dir}/{subdir}", ignore_errors=True)
+
+	try:
+		nodes = _export_groups(ents_path, NEO4J_ENTITIES, ":LABEL", ADMIN_NODE_HEADER, f"{export_dir}/nodes",
+							   shard_rows, chunksize)
+		relationships = _export_groups(rels_path, NEO4J_RELATIONS, ":TYPE", ADMIN_RELATIONSHIP_HEADER,
+									   f"{export_dir}/relationships", shard_rows, chunksize)
+	except Exception as e:
+		logging.error(f"Bulk Export Failed: {e}")
+		raise
+
+	def files(writer: _ShardedCsv) -> list[str]:
+		return [os.path.relpath(file, export_dir) for file in [writer.header, *writer.files]]
+
+	#paths are relative to export_dir, import.sh runs from there
+	command = ["neo4j-admin", "database", "import", "full", database,
+			   "--id-type=string", "--array-delimiter=;", "--ignore-empty-strings=true", "--overwrite-destination=true"]
+	#every node also gets the shared entity label the loader matches relation endpoints on
+	command += [f"--nodes={label}:{NEO4J_ENTITY_LABEL}={','.join(files(writer))}" for label, writer in nodes.items()]
+	command += [f"--relationships={reltype}={','.join(files(writer))}" for reltype, writer in relationships.items()]
+
+	manifest = {"created": datetime.now(timezone.utc).isoformat(),
+				"source": {"entities": ents_path, "relations": rels_path},
+				"database": database,
+				"nodes": {label: {"rows": writer.rows, "files": files(writer)} for label, writer in nodes.items()},
+				"relationships": {reltype: {"rows": writer.rows, "files": files(writer)}
+								  for reltype, writer in relationships.items()},
+				"command": shlex.join(command)}
+	manifest_path = f"{export_dir}/manifest.json"
+	with open(manifest_path, "w", encoding="utf-8") as f:
+		json.dump(manifest, f, indent=2)
+	script_path = f"{export_dir}/import.sh"
+	with open(script_path, "w", encoding="utf-8") as f:
+		f.write("#!/bin/sh\n"
+				f"#neo4j-admin import of {ents_path} and {rels_path}, stop the database first: it is overwritten\n"
+				f"cd \"$(dirname \"$0\")\" && exec {shlex.join(command)}\n")
+	os.chmod(script_path, 0o755)
+
+	node_rows, relationship_rows = sum(w.rows for w in nodes.values()), sum(w.rows for w in relationships.values())
+	print(f"bulk import files: {node_rows} nodes, {relationship_rows} relationships, command in {script_path}")
+	logging.info(f"Bulk Export: {node_rows} Nodes ({len(nodes)} Labels), {relationship_rows} Relationships "
+				 f"({len(relationships)} Types) Written To {export_dir}, Import Command In {script_path}.")
+	return manifest_path
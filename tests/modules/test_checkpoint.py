@@ -0,0 +1,42 @@
+import pytest
+import json
+
+from modules.checkpoint import AnnotationCheckpoint
+
+# ------------------------
+# Fixtures
+# ------------------------
+@pytest.fixture
+def checkpoint(tmp_path):
+    return AnnotationCheckpoint(str(tmp_path / "cache" / "annotation_checkpoint.json"))
+
+OUTPUTS = {"entities": ["data/extracted_entities.csv"], "relations": ["data/extracted_relations.csv"]}
+
+# ------------------------
+# Tests
+# ------------------------
+def test_load_without_checkpoint(checkpoint):
+    assert checkpoint.load() is None
+
+def test_save_and_load(checkpoint):
+    checkpoint.save("12345", 200, OUTPUTS)
+    state = checkpoint.load()
+    assert state["last_key"] == "12345"
+    assert state["articles"] == 200
+    assert state["outputs"] == OUTPUTS
+    assert state["workers"] == 1
+    # no temporary file left behind
+    assert [path.name for path in checkpoint.path.parent.iterdir()] == ["annotation_checkpoint.json"]
+
+def test_save_replaces_previous(checkpoint):
+    checkpoint.save("1", 1, OUTPUTS)
+    checkpoint.save("2", 2, OUTPUTS)
+    with open(checkpoint.path) as f:
+        assert json.load(f)["last_key"] == "2"
+
+def test_clear(checkpoint):
+    checkpoint.save("1", 1, OUTPUTS)
+    checkpoint.clear()
+    assert checkpoint.load() is None
+    # clearing twice is fine
+    checkpoint.clear()
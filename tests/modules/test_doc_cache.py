@@ -0,0 +1,75 @@
+import datetime
+import pytest
+import spacy
+
+from spacy.tokens import Span
+from unittest.mock import patch
+
+from modules.doc_cache import DocCache, load_docs, model_key, docs_key
+
+# ------------------------
+# Fixtures
+# ------------------------
+@pytest.fixture
+def nlp():
+    nlp = spacy.blank("en")
+    nlp.add_pipe("sentencizer")
+    return nlp
+
+def parse(nlp, text):
+    doc = nlp(text)
+    for token in doc:
+        token.lemma_ = token.lower_.rstrip("s")
+    doc.ents = [Span(doc, 0, 1, label="GENE_OR_GENE_PRODUCT")]
+    return doc
+
+# ------------------------
+# Tests
+# ------------------------
+def test_model_key(nlp):
+    assert model_key(nlp) == "en_pipeline-0.0.0"
+
+def test_docs_key_depends_on_profile_settings(nlp):
+    full, no_parser = docs_key(nlp, "full"), docs_key(nlp, "no_parser")
+    assert full.startswith("en_pipeline-0.0.0.full-") and no_parser.startswith("en_pipeline-0.0.0.no_parser-")
+    # docs of an edited profile go elsewhere
+    with patch.dict("modules.doc_cache.PIPELINE_PROFILES", {"full": {"exclude": ["lemmatizer"], "sentencizer": False}}):
+        assert docs_key(nlp, "full") != full
+    with pytest.raises(ValueError):
+        docs_key(nlp, "tiny")
+
+def test_docs_round_trip(tmp_path, nlp):
+    cache = DocCache("model-1", directory=str(tmp_path), shard_size=2)
+    fetched = datetime.datetime(2025, 1, 2, tzinfo=datetime.timezone.utc)
+    for pmid in ["1", "2", "3"]:
+        cache.add(parse(nlp, "TP53 binds oxygen. It regulates cells."), {"pmid": pmid, "pmcid": None, "fetching_date": fetched})
+    cache.flush()
+    assert sorted(path.name for path in (tmp_path / "model-1").iterdir()) == ["docs.00000.spacy", "docs.00001.spacy"]
+
+    loaded = list(load_docs("model-1", spacy.blank("en").vocab, directory=str(tmp_path)))
+    assert [article["pmid"] for _, article in loaded] == ["1", "2", "3"]
+    doc, article = loaded[0]
+    assert article == {"pmid": "1", "pmcid": None, "fetching_date": fetched.isoformat()}
+    assert [token.lemma_ for token in doc][:3] == ["tp53", "bind", "oxygen"]
+    assert [(ent.text, ent.label_) for ent in doc.ents] == [("TP53", "GENE_OR_GENE_PRODUCT")]
+    assert len(list(doc.sents)) == 2
+
+def test_new_cache_goes_on_after_existing_shards(tmp_path, nlp):
+    cache = DocCache("model-1", directory=str(tmp_path))
+    cache.add(parse(nlp, "TP53 binds oxygen."), {"pmid": "1"})
+    cache.flush()
+    # a resumed run saves the same article again, it is loaded once
+    cache = DocCache("model-1", directory=str(tmp_path))
+    cache.add(parse(nlp, "TP53 binds oxygen."), {"pmid": "1"})
+    cache.add(parse(nlp, "BRCA1 binds oxygen."), {"pmid": "2"})
+    cache.flush()
+    assert (tmp_path / "model-1" / "docs.00001.spacy").exists()
+    assert [article["pmid"] for _, article in load_docs("model-1", nlp.vocab, directory=str(tmp_path))] == ["1", "2"]
+
+def test_clear_and_missing_docs(tmp_path, nlp):
+    cache = DocCache("model-1", directory=str(tmp_path))
+    cache.add(parse(nlp, "TP53 binds oxygen."), {"pmid": "1"})
+    cache.flush()
+    DocCache.clear("model-1", directory=str(tmp_path))
+    with pytest.raises(FileNotFoundError):
+        list(load_docs("model-1", nlp.vocab, directory=str(tmp_path)))
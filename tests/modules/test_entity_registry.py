@@ -0,0 +1,68 @@
+import pandas as pd
+import pytest
+
+from modules.entity_registry import EntityRegistry
+
+
+@pytest.fixture
+def registry(tmp_path):
+    with EntityRegistry(str(tmp_path / "registry.sqlite")) as registry:
+        yield registry
+
+def entity(entity_id, name, cui=None):
+    return {"id": entity_id, "cui": cui, "name": name, "label": "GENE", "normalized_name": None,
+            "normalization_source": None, "url": None}
+
+def test_offset_of_appended_and_rewritten_files(registry, tmp_path):
+    raw = tmp_path / "raw.csv"
+    raw.write_text("text\na\nb\n")
+    assert registry.offset(str(raw)) == 0
+    registry.set_offset(str(raw), 2)
+
+    # rows appended: the rows read before are skipped
+    with open(raw, "a") as f:
+        f.write("c\n")
+    assert registry.offset(str(raw)) == 2
+
+    # same file name, other content: read again from the start
+    raw.write_text("text\nz\n")
+    assert registry.offset(str(raw)) == 0
+
+def test_entities_lookups(registry):
+    registry.add_entities(pd.DataFrame([entity("id1", "brca1", "C1"), entity("id2", "p53")]), run="run1")
+    assert registry.entities(["id1", "id3"]).index.tolist() == ["id1"]
+    assert registry.ids_by_name(["p53", "tp53"]).to_dict() == {"p53": "id2"}
+
+    registry.update_entities(pd.DataFrame([{**entity("id1", "brca1"), "normalized_name": "BRCA1 gene"}]), run="run2")
+    known = registry.entities(["id1"]).loc["id1"]
+    assert known["normalized_name"] == "BRCA1 gene" and known["first_seen"] == "run1"
+
+def test_evidence_counts_add_up(registry):
+    relations = pd.DataFrame({":START_ID": ["a"], ":TYPE": ["BINDS"], ":END_ID": ["b"], "evidence_count": [2]})
+    registry.add_relations(relations, run="run1")
+    registry.add_relations(relations.assign(evidence_count=3), run="run2")
+    assert registry._conn.execute("SELECT evidence_count, first_seen, last_seen FROM relations").fetchall() == [(5, "run1", "run2")]
+
+def test_known_evidence(registry):
+    # hashes above 2^63 are stored as negative sqlite integers
+    keys = pd.Series([1, 2**64 - 1], dtype=object)
+    registry.add_evidence(keys[:1])
+    assert registry.known_evidence(keys).tolist() == [True, False]
+    registry.add_evidence(keys)
+    assert registry.known_evidence(keys).tolist() == [True, True]
+
+def test_pending_relations_come_back_with_their_entity(registry):
+    pending = pd.DataFrame({"ent1": ["brca1", "tp53"], "relation": ["BINDS"] * 2, "ent2": ["p53", "x"],
+                            "pmid": ["1", "2"], "pmcid": [None, None], "fetching_date": ["2025"] * 2})
+    registry.add_pending(pending)
+    assert registry.pop_pending("run1").empty
+
+    registry.add_entities(pd.DataFrame([entity("id2", "p53")]), run="run2")
+    assert registry.pop_pending("run2")["ent1"].tolist() == ["brca1"]
+    assert registry.stats()["pending_relations"] == 1
+
+def test_failed_run_is_rolled_back(registry):
+    registry.begin()
+    registry.add_entities(pd.DataFrame([entity("id1", "brca1")]), run="run1")
+    registry.rollback()
+    assert registry.stats()["entities"] == 0
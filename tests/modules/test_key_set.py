@@ -0,0 +1,79 @@
+import os
+import pytest
+import numpy as np
+
+from modules.key_set import HashedKeySet, BloomKeySet, make_key_set, hash_key
+
+# ------------------------
+# Tests
+# ------------------------
+def test_hash_key_is_stable():
+    assert hash_key(("tp53", "GENE", 1, 2)) == hash_key(("tp53", "GENE", 1, 2))
+    assert hash_key(("tp53", "GENE", 1, 2)) != hash_key(("tp53", "GENE", 1, 3))
+    assert hash_key("tp53") == hash_key(("tp53",))
+
+def test_hashed_set_add_and_contains():
+    keys = HashedKeySet(capacity=10)
+    assert keys.add(("tp53", "GENE", 1, 2))
+    assert not keys.add(("tp53", "GENE", 1, 2))
+    assert ("tp53", "GENE", 1, 2) in keys
+    assert ("brca1", "GENE", 1, 2) not in keys
+    assert len(keys) == 1
+
+def test_hashed_set_grows():
+    keys = HashedKeySet(capacity=10)
+    size = keys.nbytes
+    added = [keys.add(("entity", i)) for i in range(1000)]
+    assert all(added)
+    assert len(keys) == 1000
+    assert keys.nbytes > size
+    assert all(("entity", i) in keys for i in range(1000))
+    assert ("entity", 1000) not in keys
+
+def test_hashed_set_memory_mapped(tmp_path):
+    path = str(tmp_path / "spill" / "entity_keys.npy")
+    keys = HashedKeySet(capacity=10, path=path)
+    for i in range(100):
+        keys.add(("entity", i))
+    assert isinstance(keys._slots, np.memmap)
+    assert np.count_nonzero(np.load(path)) == 100
+    assert not (tmp_path / "spill" / "entity_keys.npy.resize").exists()
+    assert ("entity", 99) in keys
+
+def test_bloom_set():
+    keys = BloomKeySet(capacity=1000, error_rate=1e-3)
+    added = [keys.add(("relation", i)) for i in range(1000)]
+    assert sum(added) >= 995
+    assert all(("relation", i) in keys for i in range(1000))
+    false_positives = sum(("other", i) in keys for i in range(10000))
+    assert false_positives < 50
+    assert keys.nbytes < 1000 * 8
+
+def test_make_key_set(tmp_path):
+    assert isinstance(make_key_set("keys", mode="exact"), HashedKeySet)
+    bloom = make_key_set("keys", mode="bloom", spill_dir=str(tmp_path))
+    assert isinstance(bloom, BloomKeySet)
+    assert [path.name for path in tmp_path.iterdir()] == [os.path.basename(bloom.path)]
+    assert bloom.path.endswith(".npy") and os.path.basename(bloom.path).startswith("keys-")
+    # the file of a set is removed when it is closed
+    bloom.close()
+    assert not list(tmp_path.iterdir())
+    with pytest.raises(ValueError):
+        make_key_set("keys", mode="cuckoo")
+
+def test_spilled_sets_of_a_name_are_independent(tmp_path):
+    first = make_key_set("entity_keys", mode="exact", spill_dir=str(tmp_path))
+    first.add("k1")
+    second = make_key_set("entity_keys", mode="exact", spill_dir=str(tmp_path))
+    # second grows (and replaces its file) while first is open
+    for i in range(1000):
+        second.add(("k2", i))
+
+    assert first.path != second.path
+    assert "k1" in first and len(first) == 1
+    assert ("k2", 0) not in first and "k1" not in second
+    assert all(("k2", i) in second for i in range(1000))
+    first.close()
+    assert os.path.exists(second.path) and not os.path.exists(first.path)
+    second.close()
+    assert not list(tmp_path.iterdir())
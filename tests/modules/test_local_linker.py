@@ -0,0 +1,82 @@
+import pytest
+import json
+from unittest.mock import Mock
+
+from modules.local_linker import LocalUMLSLinker
+
+# ------------------------
+# Fixtures
+# ------------------------
+MRCONSO_ROWS = [
+    # CUI|LAT|TS|LUI|STT|SUI|ISPREF|AUI|SAUI|SCUI|SDUI|SAB|TTY|CODE|STR|SRL|SUPPRESS|CVF|
+    "C0079419|ENG|S|L1|PF|S1|N|A1||||MSH|EN|D1|TP53 protein|0|N||",
+    "C0079419|ENG|P|L2|PF|S2|Y|A2||||MTH|PN|D1|Tumor protein p53|0|N||",
+    "C0079419|ENG|S|L3|VO|S3|Y|A3||||MSH|SY|D1|p53 tumor suppressor|0|N||",
+    "C0376571|ENG|P|L4|PF|S4|Y|A4||||MTH|PN|D2|BRCA1 gene|0|N||",
+    "C0376571|FRE|P|L5|PF|S5|Y|A5||||MSHFRE|PN|D2|gene BRCA1|0|N||",
+    "C0006826|ENG|P|L6|PF|S6|Y|A6||||MSH|MH|D3|Malignant neoplasms|0|N||",
+    "C0006826|ENG|S|L7|PF|S7|Y|A7||||MSH|SY|D3|Cancer|0|N||",
+]
+
+@pytest.fixture
+def mrconso_index(tmp_path):
+    mrconso = tmp_path / "MRCONSO.RRF"
+    mrconso.write_text("\n".join(MRCONSO_ROWS) + "\n", encoding="utf-8")
+    index_dir = tmp_path / "local_linker"
+    LocalUMLSLinker.build(str(mrconso), str(index_dir))
+    return str(index_dir)
+
+@pytest.fixture
+def linker(mrconso_index):
+    return LocalUMLSLinker(mrconso_index, threshold=0.8)
+
+# ------------------------
+# Tests
+# ------------------------
+def test_exact_alias_returns_normalize_shape(linker):
+    result = linker.normalize("p53 tumor suppressor")
+    assert result == {
+        "cui": "C0079419",
+        # the preferred name of the concept, not the alias that matched
+        "normalized_name": "Tumor protein p53",
+        "normalization_source": "MTH",
+        "url": "https://uts-ws.nlm.nih.gov/rest/content/current/CUI/C0079419",
+    }
+
+def test_close_variant_is_linked(linker):
+    assert linker.normalize("malignant neoplasm")["cui"] == "C0006826"
+    assert linker.normalize(" BRCA1 Gene ")["cui"] == "C0376571"
+
+def test_non_english_rows_are_skipped(linker):
+    assert len(linker.concept_cuis) == 3
+    assert linker.normalize("gene brca1 xyz").get("normalized_name") != "gene BRCA1"
+
+def test_low_confidence_without_fallback(linker):
+    assert linker.normalize("hemoglobin") == {}
+    assert linker.normalize_many([]) == {}
+
+def test_low_confidence_goes_to_fallback(mrconso_index):
+    fallback = Mock()
+    fallback.normalize_many.return_value = {"hemoglobin": {"cui": "C0019046"}}
+    linker = LocalUMLSLinker(mrconso_index, threshold=0.8, fallback=fallback)
+
+    results = linker.normalize_many(["cancer", "hemoglobin"])
+    fallback.normalize_many.assert_called_once_with(["hemoglobin"])
+    assert results["cancer"]["cui"] == "C0006826"
+    assert results["hemoglobin"] == {"cui": "C0019046"}
+
+def test_scispacy_kb(tmp_path):
+    kb = tmp_path / "kb.jsonl"
+    kb.write_text("\n".join(json.dumps(concept) for concept in [
+        {"concept_id": "C0079419", "canonical_name": "Tumor protein p53", "aliases": ["TP53", "p53"]},
+        {"concept_id": "C0376571", "canonical_name": "BRCA1 gene", "aliases": ["BRCA1"]},
+    ]), encoding="utf-8")
+    LocalUMLSLinker.build(str(kb), str(tmp_path / "kb_index"))
+    linker = LocalUMLSLinker(str(tmp_path / "kb_index"))
+    result = linker.normalize("tumor protein p53")
+    assert result["cui"] == "C0079419"
+    assert result["normalization_source"] == "scispacy"
+
+def test_missing_index(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        LocalUMLSLinker(str(tmp_path / "missing"))
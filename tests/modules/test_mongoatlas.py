@@ -117,8 +117,10 @@ def test_fetch_articles_returns_filtered_docs(mock_client):
     assert articles[0]["pmid"] == "1"
     assert "Abstract1" in articles[0]["text"]
     assert "Title1" in articles[0]["text"]
-    assert "k1" in articles[0]["text"]
-    assert "m1" in articles[0]["text"]
+    # MeSH and keywords are kept out of the NER text
+    assert "k1" not in articles[0]["text"]
+    assert "m1" not in articles[0]["text"]
+    assert articles[0]["curated_terms"] == ["m1", "k1"]
 
 def test_fetch_articles_handles_pymongo_error(mock_client):
     _, _, _, mock_collection = mock_client
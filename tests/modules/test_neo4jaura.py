@@ -3,6 +3,7 @@ from unittest.mock import MagicMock, patch
 import pandas as pd
 from neo4j.exceptions import Neo4jError
 from modules.neo4jaura import Neo4jAuraConnector
+from config.neo4jdb_config import NEO4J_LABELS
 
 # ---------------- Fixtures ----------------
 
@@ -84,6 +85,24 @@ def test_load_ents_success(mock_driver, mock_session, mock_transaction, sample_n
     connector._ents_batch_load = MagicMock()
     connector.load_ents_to_aura(["GENE_OR_GENE_PRODUCT"], str(sample_nodes_csv))
     connector._ents_batch_load.assert_called_once()
+    mock_session.run.assert_called_with(
+        "CREATE CONSTRAINT gene_or_gene_product_id IF NOT EXISTS FOR (n:GENE_OR_GENE_PRODUCT) REQUIRE n.id IS UNIQUE")
+
+def test_entity_label_added_once(mock_driver, mock_session):
+    connector = Neo4jAuraConnector("fake_uri", auth=("user","pass"))
+    #the constraint exists: nothing to do
+    mock_session.run.return_value.single.return_value = {"n": 1}
+    connector._ensure_entity_label(mock_session)
+    assert mock_session.run.call_count == 1
+
+    #first load with the entity label: constraint, then the label on the nodes already there
+    mock_session.run.reset_mock()
+    mock_session.run.return_value.single.return_value = {"n": 0}
+    connector._ensure_entity_label(mock_session)
+    queries = [call.args[0] for call in mock_session.run.call_args_list]
+    assert queries[1] == "CREATE CONSTRAINT entity_id IF NOT EXISTS FOR (n:Entity) REQUIRE n.id IS UNIQUE"
+    assert len(queries) == 2 + len(NEO4J_LABELS)
+    assert all("SET n:Entity" in query for query in queries[2:])
 
 def test_load_ents_invalid_label(mock_driver, sample_nodes_csv):
     connector = Neo4jAuraConnector("fake_uri", auth=("user","pass"))
@@ -96,6 +115,24 @@ def test_get_nodes_with_label_returns_records(mock_driver, sample_nodes_csv):
     assert len(nodes) == 2
     assert nodes[0]["id"] == "gene1"
 
+def test_get_nodes_with_label_missing_values_are_null(mock_driver, tmp_path):
+    path = tmp_path / "nodes.csv"
+    pd.DataFrame({":LABEL": ["GENE_OR_GENE_PRODUCT"], ":ID": ["gene1"], "name": ["gene a"], "cui": [None]}).to_csv(path, index=False)
+    connector = Neo4jAuraConnector("fake_uri", auth=("user","pass"))
+    assert connector._get_nodes_with_label("GENE_OR_GENE_PRODUCT", str(path)) == [{"id": "gene1", "name": "gene a", "cui": None}]
+
+def test_nodes_url_is_loaded(mock_driver, mock_transaction, tmp_path):
+    path = tmp_path / "nodes.csv"
+    pd.DataFrame({":LABEL": ["GENE_OR_GENE_PRODUCT"], ":ID": ["gene1"], "name": ["gene a"],
+                  "url": ["https://uts.nlm.nih.gov/C001"]}).to_csv(path, index=False)
+    connector = Neo4jAuraConnector("fake_uri", auth=("user","pass"))
+    nodes = connector._get_nodes_with_label("GENE_OR_GENE_PRODUCT", str(path))
+    assert nodes[0]["url"] == "https://uts.nlm.nih.gov/C001"
+    #a changed url alone rewrites the node
+    connector._ents_batch_load("GENE_OR_GENE_PRODUCT", nodes, mock_transaction)
+    query = mock_transaction.run.call_args.args[0]
+    assert "coalesce(n.url, '') <> coalesce(row.url, '')" in query and "url: row.url" in query
+
 def test_get_nodes_with_label_empty(mock_driver, empty_nodes_csv):
     connector = Neo4jAuraConnector("fake_uri", auth=("user","pass"))
     nodes = connector._get_nodes_with_label("GENE_OR_GENE_PRODUCT", str(empty_nodes_csv))
@@ -125,6 +162,29 @@ def test_load_rels_success(mock_driver, mock_session, mock_transaction, sample_r
     connector.load_rels_to_aura(["AFFECTS"], str(sample_rels_csv))
     connector._rels_batch_load.assert_called_once()
 
+def test_get_relations_with_type_evidence(mock_driver, tmp_path):
+    path = tmp_path / "rels.csv"
+    pd.DataFrame({":START_ID": ["gene1", "gene2"], ":END_ID": ["gene2", "gene1"], ":TYPE": ["AFFECTS"] * 2,
+                  "evidence_count": [2, 1], "pmids": ["123;456", "789"]}).to_csv(path, index=False)
+    connector = Neo4jAuraConnector("fake_uri", auth=("user","pass"))
+    relations = connector._get_relations_with_type("AFFECTS", str(path))
+    assert relations == [{"start_id": "gene1", "end_id": "gene2", "evidence_count": 2, "pmids": ["123", "456"]},
+                         {"start_id": "gene2", "end_id": "gene1", "evidence_count": 1, "pmids": ["789"]}]
+
+def test_batch_load_rels_adds_or_sets_evidence(mock_driver, mock_transaction):
+    connector = Neo4jAuraConnector("fake_uri", auth=("user","pass"))
+    batch = [{"start_id": "gene1", "end_id": "gene2", "evidence_count": 1, "pmids": ["123"]}]
+    connector._rels_batch_load("AFFECTS", batch, mock_transaction)
+    query = mock_transaction.run.call_args.args[0]
+    assert "SET r.evidence_count = row.evidence_count" in query
+    #endpoints are looked up in the id index of the shared label
+    assert "MATCH (start:Entity {id: row.start_id})" in query and "MATCH (end:Entity {id: row.end_id})" in query
+
+    connector._rels_batch_load("AFFECTS", batch, mock_transaction, add_evidence=True)
+    query, parameters = mock_transaction.run.call_args.args
+    assert "coalesce(r.evidence_count, 0) + row.evidence_count" in query
+    assert parameters["batch"] == batch and parameters["max_pmids"] > 0
+
 def test_load_rels_invalid_type(mock_driver, sample_rels_csv):
     connector = Neo4jAuraConnector("fake_uri", auth=("user","pass"))
     with pytest.raises(AssertionError):
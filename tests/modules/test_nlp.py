@@ -0,0 +1,71 @@
+import pytest
+import spacy
+
+from unittest.mock import MagicMock
+from spacy.language import Language
+
+from modules.nlp import StreamingOptimizedNLP
+from modules.writers import read_output
+
+# ------------------------
+# Fixtures
+# ------------------------
+LEMMAS = {"produces": "produce"}
+
+@Language.component("lower_lemmas")
+def lower_lemmas(doc):
+    for token in doc:
+        token.lemma_ = LEMMAS.get(token.lower_, token.lower_)
+    return doc
+
+@pytest.fixture
+def nlp_pipe():
+    """Stands for the NER model: sentences, lemmas and two entity types."""
+    nlp = spacy.blank("en")
+    nlp.add_pipe("sentencizer")
+    nlp.add_pipe("lower_lemmas")
+    nlp.add_pipe("entity_ruler", name="ner").add_patterns([{"label": "GENE_OR_GENE_PRODUCT", "pattern": "TP53"},
+                                                           {"label": "AMINO_ACID", "pattern": "p53"}])
+    return nlp
+
+class FakeNormalizer:
+    def normalize_many(self, texts):
+        return {text: {"cui": f"C{text}", "normalized_name": text.upper()} for text in texts}
+
+@pytest.fixture
+def make_annotator(nlp_pipe, tmp_path, monkeypatch):
+    # the caches are created under the working directory
+    monkeypatch.chdir(tmp_path)
+    def _make_annotator(run):
+        return StreamingOptimizedNLP(FakeNormalizer(), f"out/entities{run}.csv", f"out/relations{run}.csv",
+                                     known_entities_path=str(tmp_path / "missing.csv"), nlp_pipe=nlp_pipe)
+    return _make_annotator
+
+def outputs(run):
+    entities = read_output(f"out/entities{run}.csv", dtype=str, keep_default_na=False)
+    relations = read_output(f"out/relations{run}.csv", dtype=str, keep_default_na=False)
+    return entities.to_dict("records"), relations.to_dict("records")
+
+# ------------------------
+# Tests
+# ------------------------
+def test_cached_article_is_not_parsed_again(make_annotator):
+    first = make_annotator(1)
+    first.extract_entities_and_relations("TP53 produces p53.", {"pmid": "1", "fetching_date": "2025-01-01"})
+    first.close()
+    entities, relations = outputs(1)
+    assert {entity["text"] for entity in entities} == {"tp53", "p53"}
+    assert [(relation["ent1"], relation["relation"], relation["ent2"]) for relation in relations] == \
+           [("tp53", "PRODUCES", "p53")]
+
+    second = make_annotator(2)
+    second.parse = MagicMock(side_effect=AssertionError("cached articles aren't parsed"))
+    second.extract_entities_and_relations("TP53 produces p53.", {"pmid": "2", "fetching_date": "2025-02-01"})
+    assert second.result_cache.stats()["hits"] == 1
+    second.close()
+    second.parse.assert_not_called()
+
+    # the same rows, with the metadata of the new article
+    new_metadata = {"pmid": "2", "fetching_date": "2025-02-01"}
+    assert outputs(2) == ([{**entity, **new_metadata} for entity in entities],
+                          [{**relation, **new_metadata} for relation in relations])
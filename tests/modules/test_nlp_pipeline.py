@@ -0,0 +1,61 @@
+import pytest
+import spacy
+
+from pathlib import Path
+from unittest.mock import patch
+
+from modules.nlp import StreamingOptimizedNLP
+
+# ------------------------
+# Fixtures
+# ------------------------
+real_load = spacy.load
+
+def fake_model(name, exclude=()):
+    """Stands for the NER model package, a sentencizer plays the parser."""
+    if isinstance(name, Path):
+        return real_load(name)
+    nlp = spacy.blank("en")
+    if "parser" not in exclude:
+        nlp.add_pipe("sentencizer", name="parser")
+    nlp.add_pipe("entity_ruler", name="ner").add_patterns([{"label": "GENE_OR_GENE_PRODUCT", "pattern": "TP53"}])
+    return nlp
+
+@pytest.fixture
+def load():
+    with patch("modules.nlp.spacy.load", side_effect=fake_model) as load:
+        yield load
+
+# ------------------------
+# Tests
+# ------------------------
+def test_profile_components(load, tmp_path):
+    nlp = StreamingOptimizedNLP.load_pipeline("no_parser", pipelines_dir=str(tmp_path))
+    assert nlp.pipe_names == ["sentencizer", "ner", "merge_entities"]
+    assert load.call_args.kwargs["exclude"] == ["parser"]
+
+    full = StreamingOptimizedNLP.load_pipeline("full", pipelines_dir=str(tmp_path))
+    assert full.pipe_names == ["parser", "ner", "merge_entities"]
+
+def test_assembled_pipeline_is_reused(load, tmp_path):
+    StreamingOptimizedNLP.load_pipeline("no_parser", pipelines_dir=str(tmp_path))
+    saved = list(tmp_path.iterdir())
+    assert len(saved) == 1 and ".no_parser-" in saved[0].name
+
+    nlp = StreamingOptimizedNLP.load_pipeline("no_parser", pipelines_dir=str(tmp_path))
+    assert load.call_args.args == (saved[0],)
+    doc = nlp("TP53 is mutated. It is common.")
+    assert [ent.text for ent in doc.ents] == ["TP53"]
+    assert len(list(doc.sents)) == 2
+
+def test_edited_profile_is_assembled_again(load, tmp_path):
+    StreamingOptimizedNLP.load_pipeline("no_parser", pipelines_dir=str(tmp_path))
+    edited = {"no_parser": {"exclude": ["parser"], "sentencizer": False}}
+    with patch.dict("modules.nlp.PIPELINE_PROFILES", edited), patch.dict("modules.doc_cache.PIPELINE_PROFILES", edited):
+        nlp = StreamingOptimizedNLP.load_pipeline("no_parser", pipelines_dir=str(tmp_path))
+    assert nlp.pipe_names == ["ner", "merge_entities"]
+    assert len(list(tmp_path.iterdir())) == 2
+
+def test_unknown_profile(load, tmp_path):
+    with pytest.raises(ValueError):
+        StreamingOptimizedNLP.load_pipeline("tiny", pipelines_dir=str(tmp_path))
@@ -0,0 +1,103 @@
+import pytest
+import sqlite3
+import pickle
+import json
+import time
+
+from pathlib import Path
+
+from modules.normalization_cache import NormalizationCache
+
+# ------------------------
+# Fixtures
+# ------------------------
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "cache" / "normalization_cache.sqlite")
+
+@pytest.fixture
+def cache(cache_path):
+    cache = NormalizationCache(path=cache_path, cache_size=2, negative_ttl=60)
+    yield cache
+    cache.close()
+
+POSITIVE = {"cui": "C0000001", "normalized_name": "Human", "normalization_source": "MTH", "url": "u"}
+
+# ------------------------
+# Tests
+# ------------------------
+def test_set_and_get(cache):
+    cache.set("key1", "human", POSITIVE)
+    assert cache.get("key1") == POSITIVE
+    assert "key1" in cache
+    assert cache.get("missing") is None
+    assert len(cache) == 1
+
+def test_entries_are_persisted_immediately(cache, cache_path):
+    cache.set("key1", "human", POSITIVE)
+    # a second connection (another annotator process) sees the entry without any save
+    other = NormalizationCache(path=cache_path)
+    assert other.get("key1") == POSITIVE
+    other.close()
+
+def test_lru_is_bounded_but_disk_keeps_everything(cache):
+    for i in range(5):
+        cache.set(f"key{i}", f"text{i}", POSITIVE)
+    assert len(cache._lru) == 2
+    assert len(cache) == 5
+    assert cache.get("key0") == POSITIVE
+
+def test_negative_results_expire(cache, monkeypatch):
+    cache.set("key1", "unknown", {})
+    assert cache.get("key1") == {}
+    later = time.time() + 61
+    monkeypatch.setattr("modules.normalization_cache.time.time", lambda: later)
+    assert cache.get("key1") is None
+
+def test_positive_results_do_not_expire(cache, monkeypatch):
+    cache.set("key1", "human", POSITIVE)
+    later = time.time() + 10**6
+    monkeypatch.setattr("modules.normalization_cache.time.time", lambda: later)
+    cache._lru.clear()
+    assert cache.get("key1") == POSITIVE
+
+def test_import_pickle(cache, tmp_path):
+    pickle_path = tmp_path / "normalization_cache.pkl"
+    with open(pickle_path, "wb") as f:
+        pickle.dump({"key1": POSITIVE, "key2": {}}, f)
+    assert cache.import_pickle(str(pickle_path)) == 2
+    assert cache.get("key1") == POSITIVE
+    assert len(cache) == 2
+
+def test_variants_are_looked_up_by_canonical_form(cache):
+    cache.set("key1", "TNF-α", POSITIVE)
+    cache.set("key2", "tnf alpha", {})
+    # negative results are never variants
+    assert cache.with_canonical("tnfalpha") == [POSITIVE]
+    assert cache.with_canonical("brca1") == []
+
+def test_pickled_rows_get_their_text_when_seen(cache, tmp_path):
+    pickle_path = tmp_path / "normalization_cache.pkl"
+    with open(pickle_path, "wb") as f:
+        pickle.dump({"key1": POSITIVE}, f)
+    cache.import_pickle(str(pickle_path))
+    assert cache.with_canonical("human") == []
+    assert cache.get("key1", "Humans") == POSITIVE
+    assert cache.with_canonical("human") == [POSITIVE]
+
+def test_canonical_column_is_added_to_old_caches(cache_path):
+    Path(cache_path).parent.mkdir(parents=True)
+    conn = sqlite3.connect(cache_path)
+    conn.execute("CREATE TABLE normalizations (key TEXT PRIMARY KEY, text TEXT, result TEXT NOT NULL, "
+                 "negative INTEGER NOT NULL, updated_at REAL NOT NULL)")
+    conn.execute("INSERT INTO normalizations VALUES ('key1', 'Humans', ?, 0, 0)", (json.dumps(POSITIVE),))
+    conn.commit()
+    conn.close()
+
+    cache = NormalizationCache(path=cache_path)
+    assert cache.get("key1") == POSITIVE
+    assert cache.with_canonical("human") == [POSITIVE]
+    cache.close()
+
+def test_import_missing_pickle(cache, tmp_path):
+    assert cache.import_pickle(str(tmp_path / "missing.pkl")) == 0
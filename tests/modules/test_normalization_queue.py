@@ -0,0 +1,109 @@
+import pytest
+import threading
+
+from modules.normalization_cache import NormalizationCache
+from modules.normalization_queue import NormalizationQueue
+from modules.variant_index import VariantIndex
+
+# ------------------------
+# Fixtures
+# ------------------------
+class FakeNormalizer:
+    def __init__(self):
+        self.batches = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def normalize_many(self, texts):
+        self.release.wait(timeout=5)
+        self.batches.append(list(texts))
+        return {text: {"cui": "C" + text, "normalized_name": text.upper()}
+                for text in texts if text != "broken"}
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = NormalizationCache(path=str(tmp_path / "normalization_cache.sqlite"))
+    yield cache
+    cache.close()
+
+@pytest.fixture
+def normalizer():
+    return FakeNormalizer()
+
+@pytest.fixture
+def queue(normalizer, cache):
+    queue = NormalizationQueue(normalizer, cache, batch_size=10, max_wait=60)
+    yield queue
+    queue.close()
+
+# ------------------------
+# Tests
+# ------------------------
+def test_duplicate_submissions_resolved_once(queue, normalizer):
+    for _ in range(3):
+        queue.submit("k1", "tp53")
+        queue.submit("k2", "brca1")
+    queue.wait()
+    assert normalizer.batches == [["tp53", "brca1"]]
+    assert queue.results(["k1", "k2"]) == {"k1": {"cui": "Ctp53", "normalized_name": "TP53"},
+                                           "k2": {"cui": "Cbrca1", "normalized_name": "BRCA1"}}
+    assert len(queue) == 0
+
+def test_cached_keys_are_not_queued(queue, normalizer, cache):
+    cache.set("k1", "tp53", {"cui": "C1"})
+    queue.submit("k1", "tp53")
+    queue.wait()
+    assert normalizer.batches == []
+    assert queue.results(["k1"]) == {"k1": {"cui": "C1"}}
+
+def test_full_batches_are_sent_without_waiting(queue, normalizer):
+    for i in range(25):
+        queue.submit(f"k{i}", f"t{i}")
+    queue.wait()
+    assert [len(batch) for batch in normalizer.batches][:2] == [10, 10]
+    assert sum(len(batch) for batch in normalizer.batches) == 25
+
+def test_wait_only_for_given_keys(queue, normalizer):
+    normalizer.release.clear()
+    queue.submit("k1", "tp53")
+    # k1 is being normalized, waiting on another key returns right away
+    queue.wait(["k2"])
+    assert len(queue) == 1
+    normalizer.release.set()
+    queue.wait(["k1"])
+    assert len(queue) == 0
+
+def test_failed_texts_have_no_result(queue):
+    queue.submit("k1", "broken")
+    queue.wait()
+    assert queue.results(["k1"]) == {"k1": None}
+
+def test_close_drains_the_queue(normalizer, cache):
+    queue = NormalizationQueue(normalizer, cache, batch_size=10, max_wait=60)
+    queue.submit("k1", "tp53")
+    queue.close()
+    assert cache.get("k1") == {"cui": "Ctp53", "normalized_name": "TP53"}
+    # nothing is queued after close
+    queue.submit("k2", "brca1")
+    assert len(queue) == 0
+
+def test_known_variants_skip_the_normalizer(normalizer, cache):
+    variants = VariantIndex(cache)
+    variants.add("tnf-alpha", {"cui": "C1456820"})
+    queue = NormalizationQueue(normalizer, cache, variants, batch_size=10, max_wait=60)
+    queue.submit("k1", "tnf alpha")
+    queue.submit("k2", "brca1")
+    queue.close()
+    assert normalizer.batches == [["brca1"]]
+    assert cache.get("k1") == {"cui": "C1456820"}
+    # resolved texts become known variants
+    assert variants.lookup("BRCA-1")["cui"] == "Cbrca1"
+
+def test_stats_count_submissions_by_outcome(queue, cache):
+    cache.set("k1", "tp53", {"cui": "C1"})
+    queue.submit("k1", "tp53")
+    queue.submit("k2", "brca1")
+    queue.wait()
+    stats = queue.stats()
+    assert (stats["submitted"], stats["cached"], stats["queued"]) == (2, 1, 1)
+    assert stats["hit_rate"] == 0.5
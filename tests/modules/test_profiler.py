@@ -0,0 +1,63 @@
+import json
+import pytest
+import spacy
+
+from modules.profiler import LatencyHistogram, Profiler
+
+# ------------------------
+# Fixtures
+# ------------------------
+@pytest.fixture
+def nlp():
+    nlp = spacy.blank("en")
+    nlp.add_pipe("sentencizer")
+    return nlp
+
+# ------------------------
+# Tests
+# ------------------------
+def test_pipeline_components_are_timed(nlp):
+    profiler = Profiler(enabled=True, log_every=None)
+    doc = profiler.run_pipeline(nlp, "TP53 binds oxygen. BRCA1 regulates RAD51.")
+    assert len(list(doc.sents)) == 2
+    assert set(profiler.stages) == {"pipeline.tokenizer", "pipeline.sentencizer"}
+    assert profiler.stages["pipeline.sentencizer"][0] == 1
+    assert profiler.counters["tokens"] == len(doc)
+
+def test_report(tmp_path):
+    profiler = Profiler(enabled=True, log_every=1)
+    with profiler.stage("matcher"):
+        sum(range(10000))
+    profiler.count("entities", 3)
+    profiler.article_done()
+    profiler.article_done()
+
+    path = tmp_path / "profile.json"
+    profiler.write(str(path), info={"unique_relations": 1})
+    report = json.loads(path.read_text())
+    assert report["articles"] == 2
+    assert report["entities_per_article"] == 1.5
+    assert report["stages"]["matcher"]["calls"] == 1
+    assert report["stages"]["matcher"]["wall_share"] == 1.0
+    assert report["info"] == {"unique_relations": 1}
+
+def test_disabled_profiler_does_nothing(nlp, tmp_path):
+    profiler = Profiler(enabled=False)
+    with profiler.stage("matcher"):
+        pass
+    profiler.run_pipeline(nlp, "TP53 binds oxygen.")
+    profiler.article_done()
+    profiler.write(str(tmp_path / "profile.json"))
+    assert profiler.stages == {} and not profiler.counters
+    assert not (tmp_path / "profile.json").exists()
+
+def test_latency_histogram():
+    histogram = LatencyHistogram(buckets_ms=(10, 100))
+    assert histogram.quantile(0.5) is None
+    for seconds in (0.001, 0.005, 0.05, 0.2):
+        histogram.record(seconds)
+    summary = histogram.to_dict()
+    assert summary["count"] == 4
+    assert summary["buckets"] == {"<=10ms": 2, "<=100ms": 1, ">100ms": 1}
+    assert summary["p50_ms"] == 10
+    assert summary["p99_ms"] == 200.0
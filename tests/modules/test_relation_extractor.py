@@ -0,0 +1,105 @@
+import pytest
+import spacy
+from spacy.tokens import Doc, Span
+
+from modules.relation_extractor import RelationExtractor
+from modules.writers import read_output
+
+# ------------------------
+# Fixtures
+# ------------------------
+@pytest.fixture
+def vocab():
+    return spacy.blank("en").vocab
+
+@pytest.fixture
+def extractor(vocab, tmp_path):
+    extractor = RelationExtractor(vocab, str(tmp_path / "relations.csv"), max_window=5)
+    yield extractor
+    extractor.close()
+
+def make_doc(vocab, words, lemmas, ents, sent_starts=None):
+    """ents = list of (start, end, label), one sentence unless sent_starts is given"""
+    sent_starts = sent_starts or [True] + [False] * (len(words) - 1)
+    doc = Doc(vocab, words=words, lemmas=lemmas, sent_starts=sent_starts)
+    doc.ents = [Span(doc, start, end, label=label) for start, end, label in ents]
+    return doc
+
+# ------------------------
+# Tests
+# ------------------------
+def test_relations_are_found_and_written_once(extractor, vocab, tmp_path):
+    doc = make_doc(vocab, ["TP53", "produces", "p53", "."], ["tp53", "produce", "p53", "."],
+                   [(0, 1, "GENE_OR_GENE_PRODUCT"), (2, 3, "AMINO_ACID")])
+    assert extractor.find_relations(doc) == [("tp53", "PRODUCES", "p53")]
+
+    extractor.extract_relations(doc, {"pmid": "1"}).extract_relations(doc, {"pmid": "1"})
+    extractor.close()
+    relations = read_output(str(tmp_path / "relations.csv"), dtype=str)
+    assert relations[["ent1", "relation", "ent2", "pmid"]].values.tolist() == [["tp53", "PRODUCES", "p53", "1"]]
+
+def test_sentences_without_trigger_are_skipped(extractor, vocab):
+    doc = make_doc(vocab, ["TP53", "and", "p53", "."], ["tp53", "and", "p53", "."],
+                   [(0, 1, "GENE_OR_GENE_PRODUCT"), (2, 3, "AMINO_ACID")])
+    assert extractor.find_relations(doc) == []
+
+@pytest.mark.parametrize("length", [11, 12, 17, 23])
+def test_sentence_windows_cover_every_match(extractor, vocab, length):
+    # a first short sentence, then one longer than 2 * max_window (5)
+    words = ["a", "."] + ["w"] * length
+    doc = make_doc(vocab, words, words, [], sent_starts=[True, False, True] + [False] * (length - 1))
+    sent = list(doc.sents)[1]
+    windows = extractor._sentence_windows(sent)
+
+    assert all(len(window) <= 10 for window in windows)
+    assert windows[0].start == sent.start and windows[-1].end == sent.end
+    # consecutive windows overlap by max_window tokens
+    assert all(previous.end - window.start == 5 for previous, window in zip(windows, windows[1:]))
+    # any span of up to max_window tokens of the sentence is inside a window
+    for start in range(sent.start, sent.end):
+        for end in range(start + 1, min(start + 5, sent.end) + 1):
+            assert any(window.start <= start and end <= window.end for window in windows)
+
+def test_short_sentence_is_its_own_window(extractor, vocab):
+    doc = make_doc(vocab, ["w"] * 10, ["w"] * 10, [])
+    assert [(window.start, window.end) for window in extractor._sentence_windows(doc[:])] == [(0, 10)]
+
+def test_entities_in_span_boundaries(vocab):
+    doc = make_doc(vocab, ["w"] * 10, ["w"] * 10, [(1, 2, "A"), (3, 5, "B"), (6, 7, "C"), (8, 9, "D")])
+    ents = doc.ents
+    ent_starts = [ent.start for ent in ents]
+    def found(start, end):
+        return [ent.label_ for ent in RelationExtractor._entities_in_span(ents, ent_starts, start, end)]
+
+    assert found(1, 5) == ["A", "B"]
+    # entities crossing the span start or end are left out
+    assert found(2, 7) == ["B", "C"]
+    assert found(4, 7) == ["C"]
+    assert found(1, 4) == ["A"]
+    # the span end is exclusive
+    assert found(0, 1) == []
+    assert found(9, 10) == []
+    # stops after 3 entities, a span with more than 2 never makes a relation
+    assert found(0, 10) == ["A", "B", "C"]
+
+def test_dependency_patterns_run_on_candidate_sentences(extractor, vocab):
+    # TP53 -> produces -> p53 in the second sentence, the first one has no trigger
+    words = ["TP53", "and", "p53", ".", "TP53", "produces", "p53", "."]
+    doc = Doc(vocab, words=words, lemmas=["tp53", "and", "p53", ".", "tp53", "produce", "p53", "."],
+              heads=[0, 0, 0, 0, 4, 4, 5, 4], deps=["ROOT", "cc", "conj", "punct", "ROOT", "dobj", "dobj", "punct"],
+              sent_starts=[True, False, False, False, True, False, False, False])
+    doc.ents = [Span(doc, start, start + 1, label=label)
+                for start, label in [(0, "GENE_OR_GENE_PRODUCT"), (2, "AMINO_ACID"),
+                                     (4, "GENE_OR_GENE_PRODUCT"), (6, "AMINO_ACID")]]
+    calls = []
+    for pattern_id, matcher in list(extractor.matchers.items()):
+        if extractor.relation_index.patterns[pattern_id]["kind"] == "dependency":
+            def spy(doclike, matcher=matcher):
+                calls.append((doclike.start, doclike.end))
+                return matcher(doclike)
+            extractor.matchers[pattern_id] = spy
+
+    # the token pattern and the dependency pattern find the same relation
+    assert extractor.find_relations(doc) == [("tp53", "PRODUCES", "p53")] * 2
+    # only the candidate sentence is walked, never the whole doc
+    assert calls and set(calls) == {(4, 8)}
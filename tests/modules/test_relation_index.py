@@ -0,0 +1,74 @@
+import pytest
+import spacy
+from spacy.tokens import Doc, Span
+
+from modules.relation_index import RelationPatternIndex
+from config.nlp_config import MATCHER_PATTERNS, DEPENDENCY_MATCHER_PATTERNS
+
+# ------------------------
+# Fixtures
+# ------------------------
+@pytest.fixture
+def index():
+    return RelationPatternIndex(MATCHER_PATTERNS, DEPENDENCY_MATCHER_PATTERNS)
+
+@pytest.fixture
+def make_sent():
+    vocab = spacy.blank("en").vocab
+    def _make_sent(words, lemmas, ents):
+        """ents = list of (start, end, label)"""
+        doc = Doc(vocab, words=words, lemmas=lemmas, sent_starts=[True] + [False] * (len(words) - 1))
+        doc.ents = [Span(doc, start, end, label=label) for start, end, label in ents]
+        return doc[:]
+    return _make_sent
+
+# ------------------------
+# Tests
+# ------------------------
+def test_triggers_are_indexed_per_relation(index):
+    assert "produce" in index.triggers["PRODUCES"]["LEMMA"]
+    assert "bind" in index.triggers["BINDS"]["LEMMA"]
+    # the first constrained token is the trigger, not the preposition after it
+    assert "part" in index.triggers["PART_OF"]["LOWER"]
+    assert "of" not in index.triggers["PART_OF"]["LOWER"]
+
+def test_type_pairs_are_compiled_per_relation(index):
+    assert ("GENE_OR_GENE_PRODUCT", "AMINO_ACID") in index.type_pairs["PRODUCES"]
+    assert ("AMINO_ACID", "GENE_OR_GENE_PRODUCT") not in index.type_pairs["PRODUCES"]
+
+def test_candidate_patterns_are_subset_of_relation(index, make_sent):
+    sent = make_sent(["TP53", "produces", "p53"], ["tp53", "produce", "p53"],
+                     [(0, 1, "GENE_OR_GENE_PRODUCT"), (2, 3, "AMINO_ACID")])
+    pattern_ids = index.candidate_patterns(sent)
+    assert pattern_ids
+    assert {index.patterns[pattern_id]["relation"] for pattern_id in pattern_ids} == {"PRODUCES"}
+    # 'produce' also triggers a CELL/ORGAN pattern, but no such entity is in the sentence
+    assert len(pattern_ids) < sum(pattern["relation"] == "PRODUCES" for pattern in index.patterns)
+
+def test_same_label_pair_needs_two_entities(index, make_sent):
+    sent = make_sent(["BRCA1", "regulates", "itself"], ["brca1", "regulate", "itself"],
+                     [(0, 1, "GENE_OR_GENE_PRODUCT")])
+    assert index.candidate_relations(sent) == set()
+    sent = make_sent(["BRCA1", "regulates", "RAD51"], ["brca1", "regulate", "rad51"],
+                     [(0, 1, "GENE_OR_GENE_PRODUCT"), (2, 3, "GENE_OR_GENE_PRODUCT")])
+    assert index.candidate_relations(sent) == {"REGULATES"}
+
+def test_candidate_relations_with_trigger_and_entities(index, make_sent):
+    sent = make_sent(["TP53", "produces", "p53"], ["tp53", "produce", "p53"],
+                     [(0, 1, "GENE_OR_GENE_PRODUCT"), (2, 3, "AMINO_ACID")])
+    assert "PRODUCES" in index.candidate_relations(sent)
+
+def test_no_candidates_without_trigger(index, make_sent):
+    sent = make_sent(["TP53", "and", "p53"], ["tp53", "and", "p53"],
+                     [(0, 1, "GENE_OR_GENE_PRODUCT"), (2, 3, "AMINO_ACID")])
+    assert index.candidate_relations(sent) == set()
+
+def test_no_candidates_with_single_entity(index, make_sent):
+    sent = make_sent(["TP53", "produces", "proteins"], ["tp53", "produce", "protein"],
+                     [(0, 1, "GENE_OR_GENE_PRODUCT")])
+    assert index.candidate_relations(sent) == set()
+
+def test_no_candidates_with_incompatible_entities(index, make_sent):
+    sent = make_sent(["liver", "surrounds", "kidney"], ["liver", "surround", "kidney"],
+                     [(0, 1, "ORGANISM"), (2, 3, "ORGANISM")])
+    assert "SURROUNDS" not in index.candidate_relations(sent)
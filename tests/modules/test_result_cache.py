@@ -0,0 +1,58 @@
+import pytest
+
+from unittest.mock import patch
+
+from modules.result_cache import AnnotationResultCache
+
+# ------------------------
+# Fixtures
+# ------------------------
+@pytest.fixture
+def cache(tmp_path):
+    cache = AnnotationResultCache("model-1", path=str(tmp_path / "results.sqlite"))
+    yield cache
+    cache.close()
+
+ENTITIES = [("tp53", "GENE_OR_GENE_PRODUCT"), ("oxygen", "SIMPLE_CHEMICAL")]
+RELATIONS = [("tp53", "BINDS", "oxygen")]
+
+# ------------------------
+# Tests
+# ------------------------
+def test_results_round_trip(cache):
+    key = cache.key("TP53 binds oxygen.")
+    assert cache.get(key) is None
+    cache.set(key, ENTITIES, RELATIONS)
+    assert cache.get(key) == (ENTITIES, RELATIONS)
+    assert cache.stats() == {"lookups": 2, "hits": 1, "hit_rate": 0.5}
+
+def test_results_persist_across_runs(cache, tmp_path):
+    cache.set(cache.key("TP53 binds oxygen."), ENTITIES, [])
+    cache.close()
+    reopened = AnnotationResultCache("model-1", path=str(tmp_path / "results.sqlite"))
+    assert reopened.get(reopened.key("TP53 binds oxygen.")) == (ENTITIES, [])
+    assert len(reopened) == 1
+    reopened.close()
+
+def test_key_depends_on_text_model_and_patterns(cache, tmp_path):
+    other_model = AnnotationResultCache("model-2", path=str(tmp_path / "results.sqlite"))
+    assert cache.key("TP53 binds oxygen.") != cache.key("TP53 binds oxygen!")
+    assert cache.key("TP53 binds oxygen.") != other_model.key("TP53 binds oxygen.")
+    other_model.close()
+
+    # changing the patterns invalidates every cached result
+    with patch("modules.result_cache.MATCHER_PATTERNS", {"BINDS": []}):
+        new_patterns = AnnotationResultCache("model-1", path=str(tmp_path / "results.sqlite"))
+    assert cache.key("TP53 binds oxygen.") != new_patterns.key("TP53 binds oxygen.")
+    new_patterns.close()
+
+def test_prune_removes_rows_of_other_versions(cache, tmp_path):
+    cache.set(cache.key("TP53 binds oxygen."), ENTITIES, RELATIONS)
+    other_model = AnnotationResultCache("model-2", path=str(tmp_path / "results.sqlite"))
+    other_model.set(other_model.key("TP53 binds oxygen."), ENTITIES, [])
+    assert len(cache) == 2
+
+    assert other_model.prune() == 1
+    other_model.close()
+    assert len(cache) == 1
+    assert cache.get(cache.key("TP53 binds oxygen.")) is None
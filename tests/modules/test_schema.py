@@ -0,0 +1,21 @@
+import io
+import pandas as pd
+
+from modules.schema import NEO4J_ENTITIES, RAW_RELATIONS, STRING, read_csv, apply_schema
+
+
+def test_read_csv_with_schema():
+    csv = io.StringIO("name,:LABEL,fetching_date,cui\nbrca1,GENE,2025-01-01 10:00:00.5,C1\np53,GENE,not a date,\n")
+    entities = read_csv(csv, NEO4J_ENTITIES)
+    assert entities["name"].dtype == STRING
+    assert isinstance(entities[":LABEL"].dtype, pd.CategoricalDtype)
+    # dates are parsed once, what isn't a date is missing
+    assert entities["fetching_date"].tolist()[0] == pd.Timestamp("2025-01-01 10:00:00.5")
+    assert entities["fetching_date"].isna().tolist() == [False, True]
+    assert entities["cui"].isna().tolist() == [False, True]
+
+def test_apply_schema_ignores_missing_columns():
+    relations = apply_schema(pd.DataFrame({"ent1": ["a"], "relation": ["BINDS"], "other": [1]}), RAW_RELATIONS)
+    assert relations["ent1"].dtype == STRING
+    assert isinstance(relations["relation"].dtype, pd.CategoricalDtype)
+    assert relations["other"].dtype == "int64"
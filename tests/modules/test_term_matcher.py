@@ -0,0 +1,76 @@
+import pytest
+import spacy
+import pandas as pd
+
+from modules.term_matcher import CuratedTermMatcher
+
+# ------------------------
+# Fixtures
+# ------------------------
+@pytest.fixture
+def nlp():
+    return spacy.blank("en")
+
+@pytest.fixture
+def known_entities_csv(tmp_path):
+    df = pd.DataFrame({
+        ":ID": ["id1", "id2", "id3"],
+        "name": ["breast cancer", "cancer", "erbb-2"],
+        ":LABEL": ["CANCER", "CANCER", "GENE_OR_GENE_PRODUCT"],
+        "cui": ["C0006142", None, "C0069515"],
+        "normalized_name": ["Malignant neoplasm of breast", None, "ERBB2 gene"],
+        "normalization_source": ["MTH", None, "MTH"],
+        "url": ["https://example.com/C0006142", None, "https://example.com/C0069515"],
+    })
+    path = tmp_path / "entities4neo4j.csv"
+    df.to_csv(path, index=False)
+    return path
+
+# ------------------------
+# Tests
+# ------------------------
+def test_load_known_entities(nlp, known_entities_csv):
+    term_matcher = CuratedTermMatcher(nlp, str(known_entities_csv))
+    assert len(term_matcher) == 3
+    assert "Breast Cancer" in term_matcher
+
+def test_missing_known_entities_file(nlp, tmp_path):
+    term_matcher = CuratedTermMatcher(nlp, str(tmp_path / "missing.csv"))
+    assert len(term_matcher) == 0
+    assert term_matcher.match(["Breast Cancer"]) == []
+
+def test_match_returns_label_and_cui(nlp, known_entities_csv):
+    term_matcher = CuratedTermMatcher(nlp, str(known_entities_csv))
+    found = term_matcher.match(["Receptor, ERBB-2"])
+    assert found == [{
+        "text": "erbb-2",
+        "label": "GENE_OR_GENE_PRODUCT",
+        "cui": "C0069515",
+        "normalized_name": "ERBB2 gene",
+        "normalization_source": "MTH",
+        "url": "https://example.com/C0069515",
+    }]
+
+def test_match_prefers_longest_span(nlp, known_entities_csv):
+    term_matcher = CuratedTermMatcher(nlp, str(known_entities_csv))
+    found = term_matcher.match(["Breast Cancer"])
+    assert [entity["text"] for entity in found] == ["breast cancer"]
+
+def test_terms_are_matched_separately(nlp):
+    term_matcher = CuratedTermMatcher(nlp)
+    term_matcher.add("lung cancer", "CANCER")
+    # joined together these two terms would contain 'lung cancer'
+    assert term_matcher.match(["Lung", "Cancer Screening"]) == []
+
+def test_add_fills_missing_cui_only(nlp):
+    term_matcher = CuratedTermMatcher(nlp)
+    term_matcher.add("tp53", "GENE_OR_GENE_PRODUCT")
+    term_matcher.add("tp53", "GENE_OR_GENE_PRODUCT", {"cui": "C0079419", "normalized_name": "TP53 gene"})
+    term_matcher.add("tp53", "GENE_OR_GENE_PRODUCT", {"cui": "C9999999"})
+    found = term_matcher.match(["TP53"])
+    assert found[0]["cui"] == "C0079419"
+
+def test_generic_entities_are_ignored(nlp):
+    term_matcher = CuratedTermMatcher(nlp)
+    term_matcher.add("tumor patients", "CANCER")
+    assert len(term_matcher) == 0
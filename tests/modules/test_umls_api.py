@@ -1,6 +1,8 @@
+import asyncio
+import threading
 import pytest
 from unittest.mock import patch, Mock
-from modules.umls_api import UMLSNormalizer  # adjust import path
+from modules.umls_api import UMLSNormalizer, RateLimiter  # adjust import path
 
 # ------------------------
 # Fixtures
@@ -12,9 +14,8 @@ def normalizer():
 # ------------------------
 # Test successful normalization
 # ------------------------
-@patch("modules.umls_api.time.sleep")  # avoid actual sleeping
-@patch("modules.umls_api.rq.get")      # mock requests.get
-def test_normalize_success(mock_get, mock_sleep, normalizer):
+@patch("modules.umls_api.rq.Session.get")      # mock the pooled session get
+def test_normalize_success(mock_get, normalizer):
     # Mock the API JSON response
     mock_response = Mock()
     mock_response.status_code = 200
@@ -40,17 +41,18 @@ def test_normalize_success(mock_get, mock_sleep, normalizer):
     assert result["normalization_source"] == "UMLS"
     assert result["url"] == "https://example.com/C0000001"
 
-    # Ensure requests.get was called with correct parameters
+    # Ensure the session get was called with correct parameters
     mock_get.assert_called_once()
     called_args, called_kwargs = mock_get.call_args
     assert "human" in called_kwargs["params"]["string"]
+    # the request latency is recorded for the annotation profile
+    assert normalizer.latency.count == 1
 
 # ------------------------
 # Test empty results
 # ------------------------
-@patch("modules.umls_api.time.sleep")
-@patch("modules.umls_api.rq.get")
-def test_normalize_no_results(mock_get, mock_sleep, normalizer):
+@patch("modules.umls_api.rq.Session.get")
+def test_normalize_no_results(mock_get, normalizer):
     mock_response = Mock()
     mock_response.status_code = 200
     mock_response.json.return_value = {"result": {"results": []}}
@@ -62,9 +64,8 @@ def test_normalize_no_results(mock_get, mock_sleep, normalizer):
 # ------------------------
 # Test result with "ui" == "NONE"
 # ------------------------
-@patch("modules.umls_api.time.sleep")
-@patch("modules.umls_api.rq.get")
-def test_normalize_ui_none(mock_get, mock_sleep, normalizer):
+@patch("modules.umls_api.rq.Session.get")
+def test_normalize_ui_none(mock_get, normalizer):
     mock_response = Mock()
     mock_response.status_code = 200
     mock_response.json.return_value = {
@@ -78,12 +79,113 @@ def test_normalize_ui_none(mock_get, mock_sleep, normalizer):
 # ------------------------
 # Test non-200 status code
 # ------------------------
-@patch("modules.umls_api.time.sleep")
-@patch("modules.umls_api.rq.get")
-def test_normalize_error_status(mock_get, mock_sleep, normalizer):
+@patch("modules.umls_api.rq.Session.get")
+def test_normalize_error_status(mock_get, normalizer):
     mock_response = Mock()
     mock_response.status_code = 500
     mock_get.return_value = mock_response
 
     result = normalizer.normalize("error")
     assert result == {}
+
+# ------------------------
+# Test concurrent lookups of a string share one request
+# ------------------------
+def _ok_response(ui):
+    mock_response = Mock()
+    mock_response.status_code = 200
+    mock_response.json.return_value = {
+        "result": {"results": [{"ui": ui, "name": ui, "rootSource": "UMLS", "uri": "u"}]}
+    }
+    return mock_response
+
+@patch("modules.umls_api.rq.Session.get")
+def test_concurrent_same_string_coalesced(mock_get, normalizer):
+    release = threading.Event()
+    def slow_get(url, params):
+        release.wait(timeout=5)
+        return _ok_response("C0000001")
+    mock_get.side_effect = slow_get
+
+    async def run():
+        tasks = [asyncio.create_task(normalizer.anormalize("tp53")) for _ in range(5)]
+        await asyncio.sleep(0.05)
+        release.set()
+        return await asyncio.gather(*tasks)
+
+    results = asyncio.run(run())
+    assert mock_get.call_count == 1
+    assert all(result["cui"] == "C0000001" for result in results)
+    assert normalizer._in_flight == {}
+
+@patch("modules.umls_api.rq.Session.get")
+def test_waiters_survive_leader_cancellation(mock_get, normalizer):
+    release = threading.Event()
+    def slow_get(url, params):
+        release.wait(timeout=5)
+        return _ok_response("C0000001")
+    mock_get.side_effect = slow_get
+
+    async def run():
+        leader = asyncio.create_task(normalizer.anormalize("tp53"))
+        await asyncio.sleep(0.05)
+        waiter = asyncio.create_task(normalizer.anormalize("tp53"))
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        await asyncio.sleep(0.05)
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.wait_for(waiter, timeout=5)
+
+    # the waiter sends the request itself once the leader is cancelled
+    assert asyncio.run(run())["cui"] == "C0000001"
+    assert mock_get.call_count == 2
+    assert normalizer._in_flight == {}
+
+@patch("modules.umls_api.rq.Session.get")
+def test_concurrent_sync_callers(mock_get, normalizer):
+    # each normalize call runs its own event loop, they don't share lookups
+    both_started = threading.Barrier(2, timeout=5)
+    def slow_get(url, params):
+        both_started.wait()
+        return _ok_response("C0000001")
+    mock_get.side_effect = slow_get
+
+    results, errors = [], []
+    def call():
+        try:
+            results.append(normalizer.normalize("tp53"))
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=call) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    assert errors == []
+    assert [result["cui"] for result in results] == ["C0000001"] * 2
+    assert normalizer._in_flight == {}
+
+# ------------------------
+# Test batch normalization
+# ------------------------
+@patch("modules.umls_api.rq.Session.get")
+def test_normalize_many_leaves_out_failures(mock_get, normalizer):
+    def get(url, params):
+        if params["string"] == "broken":
+            raise ConnectionError("reset")
+        return _ok_response("C" + params["string"])
+    mock_get.side_effect = get
+
+    results = normalizer.normalize_many(["a", "b", "broken"])
+    assert set(results) == {"a", "b"}
+    assert results["a"]["cui"] == "Ca"
+    assert normalizer.normalize_many([]) == {}
+
+def test_rate_limiter_spaces_slots():
+    limiter = RateLimiter(requests_per_second=10)
+    delays = [limiter.reserve() for _ in range(3)]
+    assert delays[0] == pytest.approx(0, abs=0.01)
+    assert delays[2] == pytest.approx(0.2, abs=0.01)
@@ -0,0 +1,81 @@
+import pytest
+import pandas as pd
+
+from modules.normalization_cache import NormalizationCache
+from modules.variant_index import VariantIndex, canonicalize
+
+# ------------------------
+# Fixtures
+# ------------------------
+TNF = {"cui": "C1456820", "normalized_name": "Tumor Necrosis Factor-alpha", "normalization_source": "MTH", "url": "u1"}
+ERBB2 = {"cui": "C0069515", "normalized_name": "ERBB2 gene", "normalization_source": "MTH", "url": "u2"}
+
+@pytest.fixture
+def index():
+    index = VariantIndex()
+    index.add("tnf-alpha", TNF)
+    index.add("erbb-2", ERBB2)
+    return index
+
+# ------------------------
+# Tests
+# ------------------------
+@pytest.mark.parametrize("variant, canonical", [
+    ("TNF-α", "tnfalpha"),
+    ("tnf alpha", "tnfalpha"),
+    ("Breast Cancers", "breastcancer"),
+    ("cell lines", "cellline"),
+    ("therapies", "therapy"),
+    ("virus", "virus"),
+    ("kras", "kras"),
+    ("ERBB-2", "erbb2"),
+    ("-", ""),
+])
+def test_canonicalize(variant, canonical):
+    assert canonicalize(variant) == canonical
+
+def test_lookup_variants(index):
+    assert index.lookup("TNFα")["cui"] == "C1456820"
+    assert index.lookup("erbb2") == ERBB2
+    assert index.lookup("brca1") is None
+    assert index.stats() == {"variants": 2, "lookups": 3, "hits": 2, "hit_rate": 0.6667}
+
+def test_texts_without_cui_ignored(index):
+    index.add("brca1", {})
+    index.add("brca2", {"cui": ""})
+    assert len(index) == 2
+
+def test_ambiguous_variants_never_match(index):
+    index.add("ERBB 2", {"cui": "C9999999"})
+    assert index.lookup("erbb-2") is None
+    # the same CUI again doesn't make it ambiguous
+    index.add("tnf alpha", TNF)
+    assert index.lookup("tnf-alpha") == TNF
+
+def test_from_sources(tmp_path):
+    cache = NormalizationCache(path=str(tmp_path / "cache.sqlite"))
+    cache.set("k1", "tnf-alpha", TNF)
+    cache.set("k2", "unknown", {})
+    entities = tmp_path / "entities4neo4j.csv"
+    pd.DataFrame({":ID": ["id1", "id2"], "name": ["erbb-2", "cancer"], ":LABEL": ["GENE_OR_GENE_PRODUCT", "CANCER"],
+                  "cui": ["C0069515", None], "normalized_name": ["ERBB2 gene", None],
+                  "normalization_source": ["MTH", None], "url": ["u2", None]}).to_csv(entities, index=False)
+
+    index = VariantIndex.from_sources(cache, str(entities))
+    # only the entities csv is indexed in memory, the cache is queried
+    assert len(index) == 1
+    assert index.lookup("TNF α")["cui"] == "C1456820"
+    assert index.lookup("ERBB2")["cui"] == "C0069515"
+    assert index.lookup("unknown") is None
+
+    # texts cached later are variants right away
+    cache.set("k3", "brca-1", {"cui": "C0376571"})
+    assert index.lookup("BRCA1")["cui"] == "C0376571"
+    # variants of different CUIs across the cache and the csv are ambiguous
+    cache.set("k4", "erbb 2", {"cui": "C9999999"})
+    assert index.lookup("ERBB2") is None
+    cache.close()
+
+def test_missing_entities_csv(tmp_path):
+    index = VariantIndex.from_sources(entities_path=str(tmp_path / "missing.csv"))
+    assert len(index) == 0
@@ -0,0 +1,167 @@
+import pytest
+import pandas as pd
+
+from modules.writers import make_writer, read_output, output_files, merge_outputs
+
+# ------------------------
+# Fixtures
+# ------------------------
+COLUMNS = ["text", "label", "pmid", "cui"]
+ROWS = [
+    {"text": "tp53", "label": "GENE", "pmid": "1", "cui": "C1"},
+    # missing and extra keys, the columns stay aligned
+    {"label": "CANCER", "text": "glioma", "pmid": "2", "extra": "dropped"},
+    {"text": "brca1", "label": "GENE", "pmid": "3", "cui": ""},
+]
+
+@pytest.fixture
+def base_path(tmp_path):
+    return str(tmp_path / "out" / "extracted_entities.csv")
+
+# ------------------------
+# Tests
+# ------------------------
+def test_csv_fixed_columns(base_path):
+    with make_writer(base_path, COLUMNS, format="csv") as writer:
+        writer.write_rows(ROWS[:1])
+        writer.write_rows(ROWS[1:])
+    assert writer.paths == [base_path]
+
+    df = pd.read_csv(base_path, dtype=str)
+    assert list(df.columns) == COLUMNS
+    assert df["text"].tolist() == ["tp53", "glioma", "brca1"]
+    assert df["cui"].isna().tolist() == [False, True, True]
+
+def test_rows_are_flushed_on_write(base_path):
+    writer = make_writer(base_path, COLUMNS, format="csv")
+    writer.write_rows(ROWS)
+    assert len(pd.read_csv(base_path)) == 3
+    writer.close()
+
+def test_gzip_csv(base_path):
+    with make_writer(base_path, COLUMNS, format="csv", compression="gzip") as writer:
+        writer.write_rows(ROWS)
+    assert writer.path.endswith(".csv.gz")
+    assert read_output(base_path)["text"].tolist() == ["tp53", "glioma", "brca1"]
+
+def test_rotation(base_path):
+    with make_writer(base_path, COLUMNS, format="csv", rotate_bytes=1) as writer:
+        for row in ROWS:
+            writer.write_rows([row])
+    assert len(writer.paths) == 3
+    assert output_files(base_path) == writer.paths
+    assert writer.paths[1].endswith("extracted_entities.1.csv")
+    assert read_output(base_path, dtype=str)["pmid"].tolist() == ["1", "2", "3"]
+
+def test_new_writer_replaces_previous_outputs(base_path):
+    with make_writer(base_path, COLUMNS, format="csv", rotate_bytes=1) as writer:
+        for row in ROWS:
+            writer.write_rows([row])
+    with make_writer(base_path, COLUMNS, format="csv") as writer:
+        writer.write_rows(ROWS[:1])
+    assert output_files(base_path) == [base_path]
+    assert len(read_output(base_path)) == 1
+
+def test_read_output_missing(base_path):
+    with pytest.raises(FileNotFoundError):
+        read_output(base_path)
+
+def test_unknown_format(base_path):
+    with pytest.raises(ValueError):
+        make_writer(base_path, COLUMNS, format="xlsx")
+
+def test_parquet(base_path):
+    pytest.importorskip("pyarrow")
+    with make_writer(base_path, COLUMNS, format="parquet", compression="zstd") as writer:
+        writer.write_rows(ROWS)
+    assert writer.path.endswith("extracted_entities.parquet")
+    df = read_output(base_path)
+    assert list(df.columns) == COLUMNS
+    assert df["cui"].isna().tolist() == [False, True, True]
+
+def test_zstd_csv(base_path):
+    pytest.importorskip("zstandard")
+    with make_writer(base_path, COLUMNS, format="csv", compression="zstd") as writer:
+        writer.write_rows(ROWS)
+    assert writer.path.endswith(".csv.zst")
+    assert len(read_output(base_path)) == 3
+
+def test_rotate_returns_complete_files(base_path):
+    writer = make_writer(base_path, COLUMNS, format="csv")
+    # nothing written yet, nothing to rotate
+    assert writer.rotate() == []
+    writer.write_rows(ROWS[:1])
+    assert writer.rotate() == [base_path]
+    writer.write_rows(ROWS[1:])
+    writer.close()
+    assert len(read_output(base_path)) == 3
+
+def test_resume_keeps_only_given_files(base_path):
+    writer = make_writer(base_path, COLUMNS, format="csv")
+    writer.write_rows(ROWS[:1])
+    complete = writer.rotate()
+    # written after the checkpoint, lost on resume
+    writer.write_rows(ROWS[1:])
+    writer.close()
+
+    with make_writer(base_path, COLUMNS, format="csv", keep=complete) as writer:
+        writer.write_rows(ROWS[2:])
+    assert output_files(base_path) == writer.paths
+    assert read_output(base_path)["text"].tolist() == ["tp53", "brca1"]
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_commit_keeps_writing_to_the_same_file(base_path, compression):
+    writer = make_writer(base_path, COLUMNS, format="csv", compression=compression)
+    # nothing written yet, nothing committed
+    assert writer.commit() == []
+    for row in ROWS:
+        writer.write_rows([row])
+        committed = writer.commit()
+    writer.close()
+    assert [file["path"] for file in committed] == writer.paths
+    assert len(writer.paths) == 1
+    assert committed[0]["rows"] == 3
+    assert read_output(base_path)["text"].tolist() == ["tp53", "glioma", "brca1"]
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_resume_truncates_to_the_commit_and_appends(base_path, compression):
+    writer = make_writer(base_path, COLUMNS, format="csv", compression=compression)
+    writer.write_rows(ROWS[:1])
+    committed = writer.commit()
+    # written after the checkpoint, lost on resume
+    writer.write_rows(ROWS[1:2])
+    writer.close()
+
+    with make_writer(base_path, COLUMNS, format="csv", compression=compression, keep=committed) as writer:
+        writer.write_rows(ROWS[2:])
+        assert writer.commit()[0]["rows"] == 2
+    assert len(output_files(base_path)) == 1
+    assert read_output(base_path)["text"].tolist() == ["tp53", "brca1"]
+
+def test_resume_after_rotation(base_path):
+    writer = make_writer(base_path, COLUMNS, format="csv", rotate_bytes=1)
+    writer.write_rows(ROWS[:1])
+    writer.write_rows(ROWS[1:2])
+    committed = writer.commit()
+    writer.close()
+    assert [file["rows"] for file in committed] == [1, 1]
+
+    with make_writer(base_path, COLUMNS, format="csv", rotate_bytes=1, keep=committed) as writer:
+        writer.write_rows(ROWS[2:])
+    assert len(writer.paths) == 3
+    assert read_output(base_path)["text"].tolist() == ["tp53", "glioma", "brca1"]
+
+def test_merge_outputs(tmp_path, base_path):
+    sources = [str(tmp_path / "out" / f"extracted_entities.worker{i}.csv") for i in range(2)]
+    with make_writer(sources[0], COLUMNS, format="csv", rotate_bytes=1) as writer:
+        writer.write_rows(ROWS[:1])
+        writer.write_rows(ROWS[1:2])
+    with make_writer(sources[1], COLUMNS, format="csv", compression="gzip") as writer:
+        writer.write_rows(ROWS[2:])
+
+    assert merge_outputs(sources, base_path, COLUMNS, chunksize=1) == [base_path]
+    df = pd.read_csv(base_path, dtype=str, keep_default_na=False)
+    assert df["text"].tolist() == ["tp53", "glioma", "brca1"]
+    # empty values stay empty
+    assert df["cui"].tolist() == ["C1", "", ""]
+    assert all(output_files(source) == [] for source in sources)
@@ -40,7 +40,7 @@ def test_load_to_aura_args_validation(labels_to_load, ents_csv, reltypes_to_load
             if labels_to_load and ents_csv:
                 mock_instance.load_ents_to_aura.assert_called_once_with(labels_to_load, ents_csv)
             if reltypes_to_load and rels_csv:
-                mock_instance.load_rels_to_aura.assert_called_once_with(reltypes_to_load, rels_csv)
+                mock_instance.load_rels_to_aura.assert_called_once_with(reltypes_to_load, rels_csv, add_evidence=False)
 
 
 def test_load_to_aura_keyboard_interrupt(caplog):
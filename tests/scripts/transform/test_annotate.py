@@ -0,0 +1,165 @@
+import pytest
+from unittest.mock import patch, MagicMock
+
+from scripts.transform.annotate import annotate_mongo_articles, annotate_partition, worker_path, partition_query
+from scripts.transform.annotate import extract_relations_from_docs
+from modules.writers import make_writer, read_output
+from modules.checkpoint import AnnotationCheckpoint
+from config.nlp_config import ENTITY_COLUMNS, RELATION_COLUMNS
+
+
+def make_articles(pmids):
+    return [{"pmid": pmid, "pmcid": None, "fetching_date": "2025", "text": f"text {pmid}", "curated_terms": []}
+            for pmid in pmids]
+
+@pytest.fixture
+def mocks(tmp_path):
+    """Patch the connector, the normalizer and the annotator of the annotate script."""
+    with patch("scripts.transform.annotate.MongoAtlasConnector") as connector_class, \
+         patch("scripts.transform.annotate.get_normalizer"), \
+         patch("scripts.transform.annotate.StreamingOptimizedNLP") as nlp_class, \
+         patch("scripts.transform.annotate.prune_result_cache"), \
+         patch("scripts.transform.annotate.tqdm", side_effect=lambda articles, **kwargs: articles):
+        connector = connector_class.return_value
+        annotator = MagicMock()
+        # chained calls return the annotator itself
+        for method in ("extract_entities_and_relations", "extract_relations", "extract_curated_entities"):
+            getattr(annotator, method).return_value = annotator
+        annotator.commit_outputs.side_effect = lambda: {"entities": ["e.csv"], "relations": ["r.csv"]}
+        nlp_class.return_value = annotator
+        yield connector, nlp_class, annotator, tmp_path / "annotation_checkpoint.json"
+
+def run(mocks, **kwargs):
+    checkpoint_path = mocks[-1]
+    annotate_mongo_articles(checkpoint_every=2, checkpoint_path=str(checkpoint_path), **kwargs)
+
+def test_checkpoints_are_saved_periodically(mocks):
+    connector, nlp_class, annotator, checkpoint_path = mocks
+    connector.fetch_articles_from_atlas.return_value = make_articles(["1", "2", "3"])
+    run(mocks)
+    connector.fetch_articles_from_atlas.assert_called_once_with(query={}, sort=[("pmid", 1)])
+    # every 2 articles, then once at the end
+    assert annotator.commit_outputs.call_count == 2
+    annotator.close.assert_called_once()
+    assert checkpoint_path.exists()
+    annotator.write_profile.assert_called_once()
+
+def test_articles_are_annotated_in_one_call(mocks):
+    connector, nlp_class, annotator, checkpoint_path = mocks
+    connector.fetch_articles_from_atlas.return_value = make_articles(["1"])
+    run(mocks)
+    annotator.extract_entities_and_relations.assert_called_once_with(
+        "text 1", article_metadata={"pmid": "1", "pmcid": None, "fetching_date": "2025"})
+    # docs are not saved unless asked
+    assert nlp_class.call_args.kwargs["doc_cache"] is None
+
+def test_parsed_docs_are_cached(mocks, tmp_path):
+    connector, nlp_class, annotator, checkpoint_path = mocks
+    connector.fetch_articles_from_atlas.return_value = []
+    with patch("scripts.transform.annotate.DocCache") as doc_cache_class, \
+         patch("scripts.transform.annotate.docs_key", return_value="model-1.full-0"):
+        run(mocks, cache_docs=True)
+        # a fresh run replaces the docs of the previous one
+        doc_cache_class.clear.assert_called_once_with("model-1.full-0")
+        doc_cache_class.assert_called_once_with("model-1.full-0", name="docs")
+        assert nlp_class.call_args.kwargs["doc_cache"] is doc_cache_class.return_value
+
+        run(mocks, cache_docs=True, resume=True)
+        doc_cache_class.clear.assert_called_once()
+
+def test_relations_only_rerun(mocks):
+    connector, nlp_class, annotator, checkpoint_path = mocks
+    docs = [("doc1", {"pmid": "1"}), ("doc2", {"pmid": "2"})]
+    with patch("scripts.transform.annotate.load_docs", return_value=docs) as load_docs, \
+         patch("scripts.transform.annotate.RelationExtractor") as extractor_class:
+        extract_relations_from_docs("r.csv", model="model-1")
+    assert load_docs.call_args.args[0] == "model-1"
+    # no annotator (NER, normalization, entities output), only the relation extractor
+    nlp_class.assert_not_called()
+    assert extractor_class.call_args.args[1] == "r.csv"
+    extractor = extractor_class.return_value
+    assert [call.args for call in extractor.extract_relations.call_args_list] == [("doc1",), ("doc2",)]
+    extractor.close.assert_called_once()
+
+def test_resume_goes_on_after_last_key(mocks):
+    connector, nlp_class, annotator, checkpoint_path = mocks
+    connector.fetch_articles_from_atlas.return_value = make_articles(["1", "2"])
+    run(mocks)
+
+    connector.fetch_articles_from_atlas.return_value = make_articles(["3"])
+    run(mocks, resume=True)
+    connector.fetch_articles_from_atlas.assert_called_with(query={"pmid": {"$gt": "2"}}, sort=[("pmid", 1)])
+    assert nlp_class.call_args.kwargs["resume_outputs"] == {"entities": ["e.csv"], "relations": ["r.csv"]}
+
+def test_interrupted_run_keeps_last_checkpoint(mocks):
+    connector, nlp_class, annotator, checkpoint_path = mocks
+    connector.fetch_articles_from_atlas.return_value = make_articles(["1", "2", "3"])
+    annotator.extract_entities_and_relations.side_effect = [annotator, annotator, KeyboardInterrupt]
+    with pytest.raises(KeyboardInterrupt):
+        run(mocks)
+    annotator.close.assert_called_once()
+
+    connector.fetch_articles_from_atlas.return_value = []
+    run(mocks, resume=True)
+    connector.fetch_articles_from_atlas.assert_called_with(query={"pmid": {"$gt": "2"}}, sort=[("pmid", 1)])
+
+def test_resume_with_other_number_of_workers_is_refused(mocks):
+    connector, nlp_class, annotator, checkpoint_path = mocks
+    connector.fetch_articles_from_atlas.return_value = make_articles(["1", "2"])
+    run(mocks)
+    with pytest.raises(ValueError, match="--workers 1"):
+        run(mocks, resume=True, workers=2)
+
+    # a worker checkpoint of an interrupted 2 worker run
+    checkpoint_path.unlink()
+    AnnotationCheckpoint(worker_path(str(checkpoint_path), 1)).save("3", 1, {}, workers=2)
+    for workers in (1, 3):
+        with pytest.raises(ValueError, match="--workers 2"):
+            run(mocks, resume=True, workers=workers)
+    # nothing was annotated, the worker checkpoint is still there
+    connector.fetch_articles_from_atlas.assert_called_once()
+    assert AnnotationCheckpoint(worker_path(str(checkpoint_path), 1)).load()["last_key"] == "3"
+
+def test_worker_path_and_partition_query():
+    assert worker_path("data/extracted_entities.csv", 3) == "data/extracted_entities.worker3.csv"
+    assert worker_path("cache/annotation_checkpoint.json", 0) == "cache/annotation_checkpoint.worker0.json"
+    assert partition_query(1, 4) == {"$expr": {"$eq": [{"$mod": [{"$toLong": "$pmid"}, 4]}, 1]}}
+
+def test_partition_is_filtered_server_side(mocks):
+    connector, nlp_class, annotator, checkpoint_path = mocks
+    connector.fetch_articles_from_atlas.return_value = []
+    annotate_partition("e.csv", "r.csv", checkpoint_path=str(checkpoint_path), partition=(1, 4), nlp_pipe="pipe")
+    connector.fetch_articles_from_atlas.assert_called_once_with(
+        query={"$and": [{}, partition_query(1, 4)]}, sort=[("pmid", 1)])
+    assert nlp_class.call_args.kwargs["nlp_pipe"] == "pipe"
+
+def fake_partition(ents_path, rels_path, resume, checkpoint_every, checkpoint_path, partition, nlp_pipe, cache_docs,
+                   profile_path):
+    """Stands for annotate_partition in the forked workers, writes one row per output."""
+    worker, workers = partition
+    assert nlp_pipe == "shared pipe"
+    with make_writer(ents_path, ENTITY_COLUMNS) as writer:
+        writer.write_rows([{"text": f"entity{worker}", "label": "GENE", "pmid": str(worker)}])
+    with make_writer(rels_path, RELATION_COLUMNS) as writer:
+        writer.write_rows([{"ent1": f"entity{worker}", "relation": "BINDS", "ent2": "x", "pmid": str(worker)}])
+
+def test_workers_outputs_are_merged(tmp_path):
+    ents_path, rels_path = str(tmp_path / "entities.csv"), str(tmp_path / "relations.csv")
+    with patch("scripts.transform.annotate.annotate_partition", fake_partition), \
+         patch("scripts.transform.annotate.prune_result_cache"), \
+         patch("scripts.transform.annotate.StreamingOptimizedNLP.load_pipeline", return_value="shared pipe"):
+        annotate_mongo_articles(ents_path, rels_path, checkpoint_path=str(tmp_path / "checkpoint.json"), workers=3)
+
+    assert read_output(ents_path)["text"].tolist() == ["entity0", "entity1", "entity2"]
+    assert len(read_output(rels_path)) == 3
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["entities.csv", "relations.csv"]
+
+def test_failed_worker_stops_before_merge(tmp_path):
+    def failing_partition(*args, **kwargs):
+        raise ValueError("boom")
+    with patch("scripts.transform.annotate.annotate_partition", failing_partition), \
+         patch("scripts.transform.annotate.prune_result_cache"), \
+         patch("scripts.transform.annotate.StreamingOptimizedNLP.load_pipeline", return_value="shared pipe"):
+        with pytest.raises(RuntimeError, match="annotate-worker0"):
+            annotate_mongo_articles(str(tmp_path / "e.csv"), str(tmp_path / "r.csv"),
+                                    checkpoint_path=str(tmp_path / "checkpoint.json"), workers=2)
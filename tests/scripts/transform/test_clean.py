@@ -4,6 +4,11 @@ import pytest
 import tempfile
 from scripts.transform.clean import prepare_data_for_neo4j
 
+@pytest.fixture(autouse=True)
+def registry_dir(tmp_path, monkeypatch):
+    # the full clean writes the default registry (relative path) unless given another one
+    monkeypatch.chdir(tmp_path)
+
 @pytest.fixture
 def tmp_csv_files():
     with tempfile.TemporaryDirectory() as tmpdir:
@@ -73,3 +78,207 @@ def test_text_lowercased(tmp_csv_files):
     assert all(df_ents['name'] == df_ents['name'].str.lower())
 
 
+
+def test_chunked_cleaning_matches_whole_file(tmp_csv_files):
+    ents_path, rels_path, tmpdir = tmp_csv_files
+    whole = prepare_data_for_neo4j(ents_path, rels_path, saving_dir=os.path.join(tmpdir, "whole"))
+    chunked = prepare_data_for_neo4j(ents_path, rels_path, saving_dir=os.path.join(tmpdir, "chunked"), chunksize=1)
+
+    ents_whole, ents_chunked = pd.read_csv(whole[0]), pd.read_csv(chunked[0])
+    assert ents_whole.drop(columns=[":ID"]).equals(ents_chunked.drop(columns=[":ID"]))
+
+    # relations are mapped to the ids of their entities and aggregated by (start, type, end)
+    names = dict(zip(ents_chunked[":ID"], ents_chunked["name"]))
+    rels = pd.read_csv(chunked[1])
+    assert sorted(zip(rels[":START_ID"].map(names), rels[":END_ID"].map(names))) == [("cancer", "diabetes"), ("diabetes", "cancer")]
+    assert rels["pmids"].tolist() == [1, 2]
+    assert pd.read_csv(whole[1]).equals(rels)
+
+def test_relations_are_aggregated_with_their_evidence(tmp_csv_files):
+    ents_path, rels_path, tmpdir = tmp_csv_files
+    relations = pd.read_csv(rels_path)
+    extra = pd.DataFrame({"ent1": ["cancer", "Cancer", "Cancer"], "ent2": ["diabetes", "Diabetes", "Diabetes"],
+                          "relation": ["related_to", "related_to", "causes"], "pmid": [3, 4, 4], "pmcid": [30, 40, 40],
+                          "fetching_date": ["2025-01-01"] * 3})
+    pd.concat([relations, extra]).to_csv(rels_path, index=False)
+
+    _, out_rels = prepare_data_for_neo4j(ents_path, rels_path, saving_dir=tmpdir, chunksize=2, max_pmids=2)
+    names = dict(zip(pd.read_csv(os.path.join(tmpdir, "entities4neo4j.csv"))[":ID"], ["cancer", "diabetes", "unknown"]))
+    rels = pd.read_csv(out_rels, dtype={"pmids": str})
+    rels["start"], rels["end"] = rels[":START_ID"].map(names), rels[":END_ID"].map(names)
+    # an article counts once, all the articles are counted, only max_pmids are kept
+    assert rels[["start", ":TYPE", "end", "evidence_count", "pmids"]].values.tolist() == [
+        ["cancer", "related_to", "diabetes", 3, "1;3"],
+        ["diabetes", "related_to", "cancer", 1, "2"],
+        ["cancer", "causes", "diabetes", 1, "4"]]
+
+def test_evidence_aggregator_chunks_match_one_chunk():
+    from scripts.transform.clean import _EvidenceAggregator
+    evidence = pd.DataFrame({":START_ID": ["a", "b", "a", "a", "b", "a", "c"], ":TYPE": ["r"] * 7,
+                             ":END_ID": ["b", "a", "b", "b", "a", "b", "a"], "pmid": ["1", "2", "3", None, "4", "5", "6"]})
+    whole, chunked = _EvidenceAggregator(max_pmids=2), _EvidenceAggregator(max_pmids=2)
+    whole.add(evidence)
+    for start in range(0, len(evidence), 2):
+        chunked.add(evidence.iloc[start:start + 2])
+
+    assert len(chunked) == 3
+    assert chunked.relations().values.tolist() == whole.relations().values.tolist() == [
+        ["a", "b", "r", 4, "1;3"], ["b", "a", "r", 2, "2;4"], ["c", "a", "r", 1, "6"]]
+
+def test_unresolved_relations_are_reported(tmp_csv_files):
+    ents_path, rels_path, tmpdir = tmp_csv_files
+    relations = pd.read_csv(rels_path)
+    extra = pd.DataFrame({"ent1": ["Cancer", "Nowhere"], "ent2": ["Nothing", "Nothing"], "relation": ["related_to"] * 2,
+                          "pmid": [4, 5], "pmcid": [40, 50], "fetching_date": ["2025-01-01"] * 2})
+    pd.concat([relations, extra]).to_csv(rels_path, index=False)
+
+    _, out_rels = prepare_data_for_neo4j(ents_path, rels_path, saving_dir=tmpdir)
+    assert len(pd.read_csv(out_rels)) == 2
+    unresolved = pd.read_csv(os.path.join(tmpdir, "unresolved_relations.csv"))
+    assert unresolved[["ent1", "ent2", "missing"]].values.tolist() == [["cancer", "nothing", "end"], ["nowhere", "nothing", "both"]]
+
+def test_relations_without_entities(tmp_csv_files):
+    ents_path, rels_path, tmpdir = tmp_csv_files
+    pd.read_csv(ents_path).iloc[:0].to_csv(ents_path, index=False)
+    _, out_rels = prepare_data_for_neo4j(ents_path, rels_path, saving_dir=tmpdir)
+    assert pd.read_csv(out_rels).empty
+    assert (pd.read_csv(os.path.join(tmpdir, "unresolved_relations.csv"))["missing"] == "both").all()
+
+def test_entity_ids_are_stable_across_runs(tmp_csv_files):
+    ents_path, rels_path, tmpdir = tmp_csv_files
+    first = prepare_data_for_neo4j(ents_path, rels_path, saving_dir=os.path.join(tmpdir, "first"))
+    # more rows, in another order: the entities already seen keep their id
+    entities = pd.read_csv(ents_path)
+    extra = entities.iloc[[2]].assign(text="Leukemia", cui="C0003")
+    pd.concat([extra, entities.iloc[::-1]]).to_csv(ents_path, index=False)
+    second = prepare_data_for_neo4j(ents_path, rels_path, saving_dir=os.path.join(tmpdir, "second"))
+
+    ids_first = dict(zip(pd.read_csv(first[0])["name"], pd.read_csv(first[0])[":ID"]))
+    ids_second = dict(zip(pd.read_csv(second[0])["name"], pd.read_csv(second[0])[":ID"]))
+    assert {name: ids_second[name] for name in ids_first} == ids_first
+    assert len(set(ids_second.values())) == 4
+    assert pd.read_csv(first[1]).equals(pd.read_csv(second[1]))
+
+def test_entity_ids_derive_from_cui_or_label_and_text():
+    from scripts.transform.clean import _entity_ids
+    cui = pd.Series(["C0001", None, None], dtype=object)
+    ids = _entity_ids(cui, pd.Series(["Disease", "Disease", "Gene"]), pd.Series(["cancer", "unknown", "unknown"]))
+    # the CUI alone identifies an entity, its text or label don't matter
+    assert _entity_ids(cui[:1], pd.Series(["Gene"]), pd.Series(["tumor"]))[0] == ids[0]
+    assert len(set(ids)) == 3 and all(len(entity_id) == 32 for entity_id in ids)
+
+def test_first_incremental_clean_matches_full_clean(tmp_csv_files):
+    from scripts.transform.clean import prepare_incremental_data_for_neo4j
+    ents_path, rels_path, tmpdir = tmp_csv_files
+    registry_path = os.path.join(tmpdir, "registry.sqlite")
+    full = prepare_data_for_neo4j(ents_path, rels_path, saving_dir=os.path.join(tmpdir, "full"))
+    new_ents, changed_ents, new_rels = prepare_incremental_data_for_neo4j(
+        ents_path, rels_path, saving_dir=os.path.join(tmpdir, "delta"), registry_path=registry_path, chunksize=1)
+
+    assert pd.read_csv(new_ents).equals(pd.read_csv(full[0]))
+    assert pd.read_csv(new_rels).equals(pd.read_csv(full[1]))
+    assert pd.read_csv(changed_ents).empty
+
+    # nothing new: empty deltas
+    deltas = prepare_incremental_data_for_neo4j(ents_path, rels_path, saving_dir=os.path.join(tmpdir, "delta"),
+                                                registry_path=registry_path)
+    assert all(pd.read_csv(path).empty for path in deltas)
+
+def test_incremental_clean_reads_only_new_rows(tmp_csv_files):
+    from scripts.transform.clean import prepare_incremental_data_for_neo4j
+    ents_path, rels_path, tmpdir = tmp_csv_files
+    registry_path = os.path.join(tmpdir, "registry.sqlite")
+    first = prepare_incremental_data_for_neo4j(ents_path, rels_path, saving_dir=tmpdir, registry_path=registry_path)
+    ids = dict(zip(pd.read_csv(first[0])["name"], pd.read_csv(first[0])[":ID"]))
+
+    # a new entity, a known one with a new normalization, a relation to an entity that doesn't exist yet
+    entities = pd.read_csv(ents_path)
+    more_entities = pd.concat([entities.iloc[[0]].assign(text="Leukemia", cui="C0003", normalized_name="Leukemia"),
+                               entities.iloc[[2]].assign(normalized_name="Diabetes Mellitus")])
+    more_entities.to_csv(ents_path, mode="a", header=False, index=False)
+    pd.DataFrame({"ent1": ["Cancer", "Cancer"], "ent2": ["Leukemia", "Lymphoma"], "relation": ["related_to"] * 2,
+                  "pmid": [4, 5], "pmcid": [40, 50], "fetching_date": ["2025-01-01"] * 2}
+                 ).to_csv(rels_path, mode="a", header=False, index=False)
+    new_ents, changed_ents, new_rels = prepare_incremental_data_for_neo4j(
+        ents_path, rels_path, saving_dir=tmpdir, registry_path=registry_path)
+
+    assert pd.read_csv(new_ents)["name"].tolist() == ["leukemia"]
+    changed = pd.read_csv(changed_ents)
+    assert changed[[":ID", "name", "normalized_name"]].values.tolist() == [[ids["diabetes"], "diabetes", "Diabetes Mellitus"]]
+    rels = pd.read_csv(new_rels)
+    assert rels[[":START_ID", ":TYPE"]].values.tolist() == [[ids["cancer"], "related_to"]]
+
+    # the pending relation is added by the run that registers its entity
+    entities.iloc[[0]].assign(text="Lymphoma", cui="C0004").to_csv(ents_path, mode="a", header=False, index=False)
+    new_ents, _, new_rels = prepare_incremental_data_for_neo4j(ents_path, rels_path, saving_dir=tmpdir,
+                                                               registry_path=registry_path)
+    lymphoma = pd.read_csv(new_ents)[":ID"].tolist()
+    assert pd.read_csv(new_rels)[[":START_ID", ":END_ID"]].values.tolist() == [[ids["cancer"], lymphoma[0]]]
+
+def test_incremental_clean_after_full_clean(tmp_csv_files):
+    from scripts.transform.clean import prepare_incremental_data_for_neo4j
+    from modules.entity_registry import EntityRegistry
+    ents_path, rels_path, tmpdir = tmp_csv_files
+    registry_path = os.path.join(tmpdir, "registry.sqlite")
+    pd.DataFrame({"ent1": ["Cancer"], "ent2": ["Lymphoma"], "relation": ["related_to"], "pmid": [5], "pmcid": [50],
+                  "fetching_date": ["2025-01-01"]}).to_csv(rels_path, mode="a", header=False, index=False)
+    full_ents, _ = prepare_data_for_neo4j(ents_path, rels_path, saving_dir=tmpdir, registry_path=registry_path)
+    ids = dict(zip(pd.read_csv(full_ents)["name"], pd.read_csv(full_ents)[":ID"]))
+    with EntityRegistry(registry_path) as registry:
+        assert registry.stats() == {"entities": 3, "relations": 2, "pending_relations": 1}
+
+    # the full clean is registered, the incremental clean has nothing to add
+    deltas = prepare_incremental_data_for_neo4j(ents_path, rels_path, saving_dir=tmpdir, registry_path=registry_path)
+    assert all(pd.read_csv(path).empty for path in deltas)
+
+    # new entities (one of them resolves the relation the full clean couldn't), an article already
+    # counted and a new one for a known relation
+    entities = pd.read_csv(ents_path)
+    pd.concat([entities.iloc[[0]].assign(text="Lymphoma", cui="C0004"), entities.iloc[[0]].assign(text="Leukemia", cui="C0003")]
+              ).to_csv(ents_path, mode="a", header=False, index=False)
+    pd.DataFrame({"ent1": ["Cancer"] * 3, "ent2": ["Diabetes", "Diabetes", "Leukemia"], "relation": ["related_to"] * 3,
+                  "pmid": [1, 4, 4], "pmcid": [10, 40, 40], "fetching_date": ["2025-01-01"] * 3}
+                 ).to_csv(rels_path, mode="a", header=False, index=False)
+    new_ents, changed_ents, new_rels = prepare_incremental_data_for_neo4j(
+        ents_path, rels_path, saving_dir=tmpdir, registry_path=registry_path)
+
+    new_ids = dict(zip(pd.read_csv(new_ents)["name"], pd.read_csv(new_ents)[":ID"]))
+    assert list(new_ids) == ["lymphoma", "leukemia"]
+    assert pd.read_csv(changed_ents).empty
+    rels = pd.read_csv(new_rels, dtype={"pmids": str})
+    assert rels[[":START_ID", ":END_ID", "evidence_count", "pmids"]].values.tolist() == [
+        [ids["cancer"], new_ids["lymphoma"], 1, "5"],
+        [ids["cancer"], ids["diabetes"], 1, "4"],
+        [ids["cancer"], new_ids["leukemia"], 1, "4"]]
+    with EntityRegistry(registry_path) as registry:
+        assert registry.stats() == {"entities": 5, "relations": 4, "pending_relations": 0}
+        # the evidence of the full clean and the new one add up
+        assert registry._conn.execute("SELECT evidence_count FROM relations WHERE start_id = ? AND end_id = ?",
+                                      (ids["cancer"], ids["diabetes"])).fetchone() == (2,)
+
+def test_export_for_neo4j_admin(tmp_csv_files):
+    import gzip, json
+    from scripts.transform.clean import export_for_neo4j_admin
+    ents_path, rels_path, tmpdir = tmp_csv_files
+    out_ents, out_rels = prepare_data_for_neo4j(ents_path, rels_path, saving_dir=tmpdir)
+    export_dir = os.path.join(tmpdir, "import")
+    manifest_path = export_for_neo4j_admin(out_ents, out_rels, export_dir=export_dir, shard_rows=2, database="graph")
+
+    manifest = json.load(open(manifest_path))
+    # 3 Disease nodes: 2 shards of at most 2 rows, after the header
+    assert manifest["nodes"]["Disease"] == {"rows": 3, "files": ["nodes/Disease/header.csv", "nodes/Disease/part-00000.csv.gz",
+                                                                 "nodes/Disease/part-00001.csv.gz"]}
+    assert manifest["relationships"]["related_to"]["rows"] == 2
+    assert open(os.path.join(export_dir, "nodes/Disease/header.csv")).read().strip() == \
+        "id:ID,name,cui,normalized_name,normalization_source,url"
+    assert open(os.path.join(export_dir, "relationships/related_to/header.csv")).read().strip() == \
+        ":START_ID,:END_ID,evidence_count:int,pmids:string[]"
+
+    with gzip.open(os.path.join(export_dir, "nodes/Disease/part-00000.csv.gz"), "rt") as f:
+        ids = [line.split(",")[0] for line in f.read().splitlines()]
+    assert ids == pd.read_csv(out_ents)[":ID"].tolist()[:2]
+
+    command = manifest["command"]
+    assert command.startswith("neo4j-admin database import full graph --id-type=string")
+    assert "--nodes=Disease:Entity=nodes/Disease/header.csv,nodes/Disease/part-00000.csv.gz,nodes/Disease/part-00001.csv.gz" in command
+    assert command in open(os.path.join(export_dir, "import.sh")).read()